@@ -38,26 +38,138 @@ NettoieXLSX_GUI.py (V15)
   colonnes différentes, toutes les variantes sont conservées.
 """
 
+import contextlib
 import os
+import re
+import sys
+import time
 import threading
 import unicodedata
 import datetime as dt
 import importlib
+import importlib.abc
 import importlib.util
 from decimal import Decimal, InvalidOperation
 
+# -------- Profilage du démarrage --------
+# Budget (secondes) entre le lancement du script et le premier affichage de la fenêtre.
+STARTUP_BUDGET_S = 1.5
+DEBUG_STARTUP = "--debug-startup" in sys.argv or bool(os.environ.get("NETTOIEXLSX_DEBUG_STARTUP"))
+
+
+class _TimedLoader:
+    """Enveloppe un loader pour chronométrer l'exécution du module (mode --debug-startup)."""
+
+    def __init__(self, loader, name, profiler):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profiler._import_stack()
+        stack.append(0.0)
+        t = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            cumul = time.perf_counter() - t
+            children = stack.pop()
+            if stack:
+                stack[-1] += cumul
+            self._profiler._record_import(self._name, cumul - children, cumul, len(stack))
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    """Finder placé en tête de sys.meta_path : délègue la recherche et chronomètre le chargement."""
+
+    def __init__(self, profiler):
+        self._profiler = profiler
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        if getattr(self._local, "resolving", False):
+            return None
+        self._local.resolving = True
+        try:
+            spec = None
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+        finally:
+            self._local.resolving = False
+        if spec is None or spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, fullname, self._profiler)
+        return spec
+
+
+class StartupProfiler:
+    """Jalons du démarrage (import, fenêtre affichée, thème, drag & drop…) et temps d'import par module."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.marks = []    # [(libellé, secondes depuis t0)]
+        self.imports = []  # [(self_us, cumul_us, profondeur, module)] dans l'ordre de fin de chargement
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def install_import_hook(self):
+        sys.meta_path.insert(0, _ImportTimer(self))
+
+    def mark(self, label):
+        with self._lock:
+            self.marks.append((label, time.perf_counter() - self.t0))
+
+    def elapsed(self, label):
+        for name, t in self.marks:
+            if name == label:
+                return t
+        return None
+
+    def _import_stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record_import(self, name, self_s, cumul_s, depth):
+        with self._lock:
+            self.imports.append((int(self_s * 1e6), int(cumul_s * 1e6), depth, name))
+
+    def report(self) -> str:
+        lines = ["Rapport de démarrage (secondes depuis le lancement) :"]
+        for name, t in self.marks:
+            lines.append(f"  {t:8.3f}  {name}")
+        first_paint = self.elapsed("fenêtre affichée")
+        if first_paint is not None:
+            verdict = "OK" if first_paint <= STARTUP_BUDGET_S else "DÉPASSÉ"
+            lines.append(f"Premier affichage : {first_paint:.3f} s (budget {STARTUP_BUDGET_S:.1f} s) -> {verdict}")
+        if self.imports:
+            lines.append("import time: self [us] | cumulative | imported package")
+            for self_us, cumul_us, depth, name in self.imports:
+                lines.append(f"import time: {self_us:>9} | {cumul_us:>10} | {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+
+STARTUP = StartupProfiler()
+if DEBUG_STARTUP:
+    STARTUP.install_import_hook()
+
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 import tkinter.font as tkfont
 
+# Thème et drag & drop : détectés ici (coût nul), importés après le premier affichage.
 _TTKBOOTSTRAP_AVAILABLE = importlib.util.find_spec("ttkbootstrap") is not None
-if _TTKBOOTSTRAP_AVAILABLE:
-    ttkbootstrap = importlib.import_module("ttkbootstrap")
-    ttk = ttkbootstrap
-    StyleBase = ttkbootstrap.Style
-else:
-    from tkinter import ttk
-    StyleBase = None
 
 # -------- Réglages d'affichage --------
 GLOBAL_WIDTH_OFFSET = 0.64  # correction écart Excel
@@ -178,8 +290,13 @@ INTRO_LOG_TEXT = (
     "- l’extraction des « workflows » sous DMF\n"
     "- le fichier « Envoi BDC » sous SAG/TUTOS complété lors du traitement des bons de commande\n\n"
     "Pour garantir une bonne utilisation de la macro, mettez les bons fichiers sur la bonne ligne correspondante\n"
-    "(Astuce : glissez vos fichiers .xlsx sur les champs !)\n\n"
+    "(Astuce : glissez vos fichiers .xlsx dans la fenêtre, ils sont rangés automatiquement sur la bonne ligne !)\n"
+    "(Plusieurs fichiers d’une même extraction, par année ou par semaine, peuvent aller sur la même ligne :\n"
+    " ils sont réunis et les lignes en double entre fichiers sont écartées.)\n\n"
     "Dans les fichiers extraits de Geslab, seules les lignes sous 'Liste des résultats' seront prises en compte.\n"
+    "Pour n’obtenir que l’onglet Global (plus rapide), choisissez « Global seul » dans « Feuilles à produire ».\n"
+    "Après un traitement, « Rechercher » affiche toutes les lignes d’un BDC sans rouvrir le classeur.\n"
+    "« Lignage » indique, pour chaque ligne de Global, les lignes des fichiers sources qui l’ont alimentée.\n"
 )
 
 # Lazy imports pour accélérer l'ouverture de l'interface
@@ -188,40 +305,115 @@ load_workbook = None
 get_column_letter = None
 Font = None
 Alignment = None
-_DEPS_LOADED = False
-_DEPS_ERROR = None
 
-def ensure_deps_loaded():
-    global pd, load_workbook, get_column_letter, Font, Alignment, _DEPS_LOADED, _DEPS_ERROR
-    if _DEPS_LOADED:
-        return
-    if _DEPS_ERROR is not None:
-        raise _DEPS_ERROR
-    try:
+
+class LazyDeps:
+    """Chargement paresseux et thread-safe de pandas/openpyxl.
+
+    Un seul thread importe (verrou) ; les autres attendent le même Future. Le préchargement
+    exécute aussi les chemins chauds du premier traitement (lecture/écriture openpyxl,
+    E/S Excel de pandas, parsing de dates) pour que le premier clic soit aussi rapide que le second.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._future = None
+        self.warm_up_error = None  # exception du préchauffage (sans effet sur le chargement)
+
+    @property
+    def loaded(self) -> bool:
+        f = self._future
+        return f is not None and f.done() and f.exception() is None
+
+    def _submit(self):
+        from concurrent.futures import Future
+        with self._lock:
+            if self._future is not None:
+                return self._future, False
+            self._future = Future()
+            self._future.set_running_or_notify_cancel()
+            return self._future, True
+
+    def _run(self, future, warm_up: bool):
+        try:
+            self._import()
+        except BaseException as exc:
+            # import manqué : les appels suivants retentent (dépendance installée entre-temps…)
+            with self._lock:
+                self._future = None
+            future.set_exception(exc)
+            return
+        if warm_up:
+            try:
+                self._warm_up()
+            except Exception as exc:  # simple optimisation : les dépendances restent utilisables
+                self.warm_up_error = exc
+                STARTUP.mark(f"préchauffage interrompu : {exc}")
+                if sys.stderr is not None:
+                    print(f"Préchauffage des dépendances interrompu : {exc}", file=sys.stderr)
+        future.set_result(True)
+        STARTUP.mark("dépendances chargées")
+
+    def start_background(self):
+        """Lance le chargement + préchauffage dans un thread démon (sans effet s'il est déjà lancé)."""
+        future, owner = self._submit()
+        if owner:
+            threading.Thread(target=self._run, args=(future, True), daemon=True).start()
+        return future
+
+    def wait(self, timeout=None):
+        """Bloque jusqu'à ce que les dépendances soient utilisables ; relève l'erreur d'import éventuelle."""
+        future, owner = self._submit()
+        if owner:
+            self._run(future, False)
+        return future.result(timeout)
+
+    @staticmethod
+    def _import():
+        global pd, load_workbook, get_column_letter, Font, Alignment
         import pandas as _pd
         from openpyxl import load_workbook as _load_workbook
         from openpyxl.utils import get_column_letter as _get_column_letter
         from openpyxl.styles import Font as _Font, Alignment as _Alignment
-        pd = _pd
-        load_workbook = _load_workbook
+        # Les globales ne sont publiées qu'une fois tous les imports réussis.
+        Font, Alignment = _Font, _Alignment
         get_column_letter = _get_column_letter
-        Font = _Font
-        Alignment = _Alignment
-        _DEPS_LOADED = True
-    except Exception as exc:
-        _DEPS_ERROR = exc
-        raise
+        load_workbook = _load_workbook
+        pd = _pd
+
+    @staticmethod
+    def _warm_up():
+        import io
+        importlib.import_module("openpyxl.reader.excel")
+        importlib.import_module("openpyxl.writer.excel")
+        importlib.import_module("openpyxl.worksheet._reader")
+        importlib.import_module("openpyxl.worksheet._writer")
+        importlib.import_module("pandas.io.excel._openpyxl")
+        # Aller-retour complet sur un mini classeur : ExcelWriter, styles, read_excel.
+        buf = io.BytesIO()
+        sample = pd.DataFrame({"Commande": ["12690"], "Date envoi": [dt.datetime(2026, 1, 5, 10, 30)], "Agent": ["Dupont"]})
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            sample.to_excel(writer, index=False, sheet_name="Global")
+            ws = writer.book["Global"]
+            ws.cell(row=1, column=1).font = Font(name="Calibri", size=9)
+            ws.cell(row=1, column=1).alignment = Alignment(horizontal="center", vertical="center")
+        buf.seek(0)
+        pd.read_excel(buf, sheet_name=0, header=None, engine="openpyxl")
+        pd.to_datetime("05/01/2026", dayfirst=True, errors="coerce")
+        pd.to_datetime("05/01/2026 10:30:00", dayfirst=True, errors="coerce")
+        to_decimal("1 234,56 €")
+
+
+DEPS = LazyDeps()
+
+def ensure_deps_loaded():
+    DEPS.wait()
 
 def preload_deps_in_background():
-    thread = threading.Thread(target=ensure_deps_loaded, daemon=True)
-    thread.start()
+    DEPS.start_background()
 
-# Drag & drop (optionnel)
-try:
-    from tkinterdnd2 import DND_FILES, TkinterDnD
-    DND_AVAILABLE = True
-except Exception:
-    DND_AVAILABLE = False
+# Drag & drop (optionnel, chargé après le premier affichage)
+DND_AVAILABLE = importlib.util.find_spec("tkinterdnd2") is not None
 
 # -------- Helpers --------
 def strip_accents(text: str) -> str:
@@ -253,10 +445,11 @@ def date_to_text_dmy(value):
     if isinstance(d, dt.date): return d.strftime("%d/%m/%Y")
     return str(d).strip()
 
+_DATETIME_TEXT_RE = re.compile(r"^\s*(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})\s+\d{1,2}:\d{2}(:\d{2})?\s*$")
+
 def strip_times_in_worksheet(ws):
     ensure_deps_loaded()
-    import re
-    pat = re.compile(r"^\s*(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})\s+\d{1,2}:\d{2}(:\d{2})?\s*$")
+    pat = _DATETIME_TEXT_RE
     for row in ws.iter_rows():
         for cell in row:
             v = cell.value
@@ -378,17 +571,23 @@ SYN = {
 }
 
 # -------- Process --------
+# process_* lisent le fichier ; clean_* appliquent le nettoyage à un DataFrame (fichier entier ou bloc de lignes).
 def process_commandes(path: str) -> pd.DataFrame:
-    df = read_after_skip(path, 20)
+    return clean_commandes(read_after_skip(path, 20))
+
+def clean_commandes(df: pd.DataFrame) -> pd.DataFrame:
     cols = list(df.columns)
     def col(name): return pick_column(cols, SYN[name])
     # filtres
     c_f = col("Fournisseur"); c_n = col("Nature de dépense")
-    if c_f is not None:
-        df = df[~df[c_f].astype(str).str.strip().str.upper().eq("FCM 3MUNDI ESR-M")]
-    if c_n is not None:
-        nature_clean = df[c_n].astype(str).map(strip_accents).str.lower().str.strip()
-        df = df[nature_clean != "mission"]
+    if use_polars():
+        df = df[polars_commandes_keep(df, c_f, c_n)]
+    else:
+        if c_f is not None:
+            df = df[~df[c_f].astype(str).str.strip().str.upper().eq("FCM 3MUNDI ESR-M")]
+        if c_n is not None:
+            nature_clean = df[c_n].astype(str).map(strip_accents).str.lower().str.strip()
+            df = df[nature_clean != "mission"]
     # ordre final
     order_map = [
         ("N° commande","N° commande"),
@@ -407,7 +606,9 @@ def process_commandes(path: str) -> pd.DataFrame:
     return out.dropna(how="all")
 
 def process_constatations(path: str) -> pd.DataFrame:
-    df = read_after_skip(path, 17)
+    return clean_constatations(read_after_skip(path, 17))
+
+def clean_constatations(df: pd.DataFrame) -> pd.DataFrame:
     cols = list(df.columns)
     c_cmd = pick_column(cols, SYN["Commande"])
     c_stat = pick_column(cols, SYN["Statut (constatations)"])
@@ -418,7 +619,9 @@ def process_constatations(path: str) -> pd.DataFrame:
     return out.dropna(how="all")
 
 def process_envoi_bdc(path: str) -> pd.DataFrame:
-    df = read_after_skip(path, 0)
+    return clean_envoi_bdc(read_after_skip(path, 0))
+
+def clean_envoi_bdc(df: pd.DataFrame) -> pd.DataFrame:
     df = df.iloc[:, :3].copy()
     while df.shape[1] < 3:
         df[df.shape[1]] = None
@@ -426,15 +629,20 @@ def process_envoi_bdc(path: str) -> pd.DataFrame:
     return df.dropna(how="all")
 
 def process_factures(path: str) -> pd.DataFrame:
-    df = read_after_skip(path, 19)
+    return clean_factures(read_after_skip(path, 19))
+
+def clean_factures(df: pd.DataFrame) -> pd.DataFrame:
     cols = list(df.columns)
     c_nat = pick_column(cols, SYN["Nature de dépense"])
     c_fou = pick_column(cols, SYN["Fournisseur"])
-    if c_nat is not None:
-        nat_clean = df[c_nat].astype(str).str.strip().str.upper()
-        df = df[~nat_clean.eq("MI")]
-    if c_fou is not None:
-        df = df[~df[c_fou].astype(str).str.strip().str.upper().eq("FCM 3MUNDI ESR-M")]
+    if use_polars():
+        df = df[polars_factures_keep(df, c_nat, c_fou)]
+    else:
+        if c_nat is not None:
+            nat_clean = df[c_nat].astype(str).str.strip().str.upper()
+            df = df[~nat_clean.eq("MI")]
+        if c_fou is not None:
+            df = df[~df[c_fou].astype(str).str.strip().str.upper().eq("FCM 3MUNDI ESR-M")]
     c_bdc = pick_column(cols, SYN["N° commande"])
     c_ht  = pick_column(cols, SYN["Montant HT"])
     c_reg = pick_column(cols, SYN["Date de règlement"])
@@ -448,17 +656,26 @@ def process_workflow(path: str) -> pd.DataFrame:
     return dataframe_below_marker_or_first(path, marker="Liste des résultats")
 
 # -------- Auto-fit --------
-def autofit_worksheet(ws, df: pd.DataFrame, min_width=10, max_width=60, padding=2):
-    for idx, col_name in enumerate(df.columns, start=1):
+def autofit_widths(df: pd.DataFrame, min_width=10, max_width=60, padding=2) -> list:
+    widths = []
+    for col_name in df.columns:
         col_vals = df[col_name].astype(str).fillna("")
         max_len = max([len(str(col_name))] + [len(v) for v in col_vals])
-        ws.column_dimensions[get_column_letter(idx)].width = max(min_width, min(max_len + padding, max_width))
+        widths.append(max(min_width, min(max_len + padding, max_width)))
+    return widths
+
+def autofit_worksheet(ws, df: pd.DataFrame, min_width=10, max_width=60, padding=2):
+    for idx, width in enumerate(autofit_widths(df, min_width, max_width, padding), start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = width
 
 # -------- Global --------
 def choose_workflow_value_column(df_wf: pd.DataFrame):
     if df_wf is None or df_wf.empty:
         return None, None
-    cols = list(df_wf.columns)
+    return workflow_columns(list(df_wf.columns))
+
+def workflow_columns(cols):
+    """(colonne BDC, colonne valeur) du Workflow d'après les seuls noms de colonnes."""
     c_bdc = pick_column(cols, SYN["N° commande"])
     for key in ("Date", "Statut"):
         c = pick_column(cols, SYN[key]) if key in SYN else None
@@ -467,37 +684,15 @@ def choose_workflow_value_column(df_wf: pd.DataFrame):
         return c_bdc, cols[1]
     return c_bdc, None
 
-def create_and_fill_global_sheet(writer, df_cmd, df_envoi, df_fact, df_wf, df_const):
-    ensure_deps_loaded()
-    book = writer.book
-    ws = book.create_sheet("Global")
-
-    ws.page_setup.orientation = 'landscape'
-    ws.page_margins.left = 0.19685  # 0,5 cm
-    ws.page_margins.right = 0.19685
-
-    headers = ["BDC", "OBJET", "FOURN.", "HT", "VISA", "ENVOYE", "SF", "WORKFLOW", "PAYE", "SOLDE", "STATUT"]
-    ws.append(headers)
-
-    header_font = Font(name="Calibri", size=12)
-    header_align = Alignment(horizontal="center", vertical="center")
-    for c in range(1, len(headers)+1):
-        cell = ws.cell(row=1, column=c); cell.font = header_font; cell.alignment = header_align
-
-    for i, w in enumerate(GLOBAL_COLUMN_WIDTHS, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = w + GLOBAL_WIDTH_OFFSET
-
-    body_font = Font(name="Calibri", size=9)
-    body_align = Alignment(horizontal="center", vertical="center")
-
-    if df_cmd is None or df_cmd.empty or "N° commande" not in df_cmd.columns:
-        ws.row_dimensions[1].height = 30
-        return ws
+GLOBAL_HEADERS = ["BDC", "OBJET", "FOURN.", "HT", "VISA", "ENVOYE", "SF", "WORKFLOW", "PAYE", "SOLDE", "STATUT"]
 
+def build_global_lookups(df_envoi, df_fact, df_wf, df_const) -> dict:
+    """Tables de correspondance par BDC utilisées pour F, G, H, I et J."""
+    ensure_deps_loaded()
     # Envoi BDC -> F
-    envoi_lookup = {}
+    envoi_lookup, envoi_rows = {}, {}
     if df_envoi is not None and not df_envoi.empty:
-        for _, r in df_envoi.iterrows():
+        for row_no, (_, r) in enumerate(df_envoi.iterrows()):
             key = str(r.get("Commande", "")).strip()
             if not key: continue
             b_txt = date_to_text_dmy(r.get("Date envoi"))
@@ -505,59 +700,66 @@ def create_and_fill_global_sheet(writer, df_cmd, df_envoi, df_fact, df_wf, df_co
             val = f"{b_txt} {c_txt}".strip() if (b_txt or c_txt) else ""
             if key not in envoi_lookup:
                 envoi_lookup[key] = val
+                envoi_rows[key] = row_no
 
     # Factures -> agrégats pour I (Payé) et J (Solde)
-    # Stocke date parsée ET valeur brute pour le cas 1 facture sans date exploitable
-    fact_agg = {}  # bdc -> {'count': n, 'sum': Decimal, 'date': dt.date|None, 'raw': Any|None}
-    if df_fact is not None and not df_fact.empty and "N° commande" in df_fact.columns:
-        for _, r in df_fact.iterrows():
-            key = str(r.get("N° commande", "")).strip()
-            if not key: continue
-            amt = to_decimal(r.get("Montant HT"))
-            raw_date = r.get("Date de règlement")
-            dreg = to_date_only(raw_date)  # dt.date | "" | original si non parsé
-
-            if key not in fact_agg:
-                fact_agg[key] = {'count': 0, 'sum': Decimal('0'), 'date': None, 'raw': None}
-
-            fact_agg[key]['count'] += 1
-            fact_agg[key]['sum'] += amt
-
-            if fact_agg[key]['count'] == 1:
-                fact_agg[key]['date'] = dreg if isinstance(dreg, dt.date) else None
-                fact_agg[key]['raw']  = raw_date
-            else:
-                fact_agg[key]['date'] = None
-                fact_agg[key]['raw']  = None
+    fact_agg = FactureTotals.from_frame(df_fact)
 
     # Workflow -> H
-    wf_lookup = {}
+    wf_lookup, wf_rows = {}, {}
     wf_bdc_col, wf_val_col = choose_workflow_value_column(df_wf)
     if df_wf is not None and not df_wf.empty and wf_bdc_col is not None:
-        for _, r in df_wf.iterrows():
+        for row_no, (_, r) in enumerate(df_wf.iterrows()):
             key = str(r.get(wf_bdc_col, "")).strip()
             if not key: continue
             v = r.get(wf_val_col) if wf_val_col else ""
             v = to_date_only(v)
             wf_lookup[key] = v
+            wf_rows[key] = row_no
 
     # Constatation -> Statut (pour G)
     const_stat_by_full, const_stat_by_extract = {}, {}
+    const_rows_full, const_rows_extract = {}, {}
     if df_const is not None and not df_const.empty:
-        for _, r in df_const.iterrows():
+        for row_no, (_, r) in enumerate(df_const.iterrows()):
             key_full = str(r.get("Commande", "")).strip()
             key_ex = str(r.get("extrait commande", "")).strip()
             st = r.get("Statut")
-            if key_full: const_stat_by_full[key_full] = st
-            if key_ex: const_stat_by_extract[key_ex] = st
+            if key_full: const_stat_by_full[key_full] = st; const_rows_full[key_full] = row_no
+            if key_ex: const_stat_by_extract[key_ex] = st; const_rows_extract[key_ex] = row_no
+
+    return {
+        "envoi": envoi_lookup,
+        "fact": fact_agg,
+        "wf": wf_lookup,
+        "const_full": const_stat_by_full,
+        "const_extract": const_stat_by_extract,
+        # ligne source retenue par BDC (traçabilité)
+        "envoi_rows": envoi_rows,
+        "wf_rows": wf_rows,
+        "const_full_rows": const_rows_full,
+        "const_extract_rows": const_rows_extract,
+    }
+
+def iter_global_rows(df_cmd, lookups, lineage=None):
+    """Génère (index Commande, valeurs A..K) dans l'ordre de Commande, doublons stricts exclus.
+
+    lineage (GlobalLineage) : reçoit, pour chaque ligne produite, les lignes sources qui l'ont
+    alimentée, relevées au passage des jointures."""
+    envoi_lookup = lookups["envoi"]
+    fact_agg = lookups["fact"]
+    wf_lookup = lookups["wf"]
+    const_stat_by_full = lookups["const_full"]
+    const_stat_by_extract = lookups["const_extract"]
 
     # Déduplication stricte : signature (toutes colonnes)
     seen_signatures = set()
 
     # Lignes Global
-    for _, row in df_cmd.iterrows():
+    for cmd_pos, (idx, row) in enumerate(df_cmd.iterrows()):
         bdc = str(row.get("N° commande", "")).strip()
         if not bdc: continue
+        const_pos = -1
 
         b = row.get("Libellé", "-")
         c = row.get("Fournisseur", "-")
@@ -575,30 +777,33 @@ def create_and_fill_global_sheet(writer, df_cmd, df_envoi, df_fact, df_wf, df_co
             f_norm = strip_accents(str(f)).lower()
             if "ss objet regul ca" in f_norm:
                 st = const_stat_by_full.get(bdc)
+                const_pos = lookups["const_full_rows"].get(bdc, -1)
                 if st is None or (isinstance(st, float) and pd.isna(st)):
                     st = const_stat_by_extract.get(bdc[:5])
+                    const_pos = lookups["const_extract_rows"].get(bdc[:5], -1)
                 g = st if st not in (None, "") and not (isinstance(st, float) and pd.isna(st)) else "Pas de SF connu"
 
         # H (WORKFLOW)
         h = wf_lookup.get(bdc, "")
 
         # I (PAYE)
-        fa = fact_agg.get(bdc)
-        if fa is None or fa['count'] == 0:
+        pos = fact_agg.positions.get(bdc)
+        n = fact_agg.count(pos) if pos is not None else 0
+        if n == 0:
             i = "pas de paiement connu"
-        elif fa['count'] == 1:
-            if isinstance(fa['date'], dt.date):
-                i = fa['date']  # vraie date
+        elif n == 1:
+            paid = fact_agg.single_date(pos)
+            if paid is not None:
+                i = paid  # vraie date
             else:
-                raw = fa['raw']
+                raw = fact_agg.raw.get(pos)
                 txt = date_to_text_dmy(raw) if raw not in (None, "") else "date manquante"
                 i = txt
         else:
-            n = fa['count']
             i = f"{n} paiement" + ("s" if n >= 2 else "")
 
         # J (SOLDE) = D - somme(Montant HT factures)
-        total_fact = fact_agg.get(bdc, {'sum': Decimal('0')})['sum']
+        total_fact = fact_agg.total(pos) if pos is not None else Decimal('0')
         d_amount = to_decimal(d_val_raw)
         solde = d_amount - total_fact
         j = float(solde)
@@ -612,25 +817,90 @@ def create_and_fill_global_sheet(writer, df_cmd, df_envoi, df_fact, df_wf, df_co
             continue  # doublon strict -> on ignore
         seen_signatures.add(signature)
 
-        ws.append(row_values)
+        if lineage is not None:
+            lineage.add(cmd_pos, lookups["envoi_rows"].get(bdc, -1), const_pos,
+                        -1 if pos is None else pos, lookups["wf_rows"].get(bdc, -1))
+        yield idx, row_values
 
-    # Mise en forme corps
-    max_row = ws.max_row
-    for r in range(2, max_row+1):
-        ws.cell(row=r, column=1).number_format = "@"
-        for col in (8, 9):  # H, I si dates
-            cell = ws.cell(row=r, column=col)
-            if isinstance(cell.value, (pd.Timestamp, dt.datetime, dt.date)):
-                cell.number_format = "dd/mm/yyyy"
-        jcell = ws.cell(row=r, column=10)  # J solde
-        if isinstance(jcell.value, (int, float)):
-            jcell.number_format = "0.00"
-        ws.row_dimensions[r].height = 30
-        for ccol in range(1, len(headers)+1):
-            cell = ws.cell(row=r, column=ccol); cell.font = body_font; cell.alignment = body_align
-
-    ws.row_dimensions[1].height = 30
-    return ws
+def global_rows(df_cmd, df_envoi, df_fact, df_wf, df_const):
+    """(index Commande, valeurs A..K) de Global avec le moteur choisi (ENGINE)."""
+    if use_polars():
+        return iter_global_rows_polars(df_cmd, df_envoi, df_fact, df_wf, df_const)
+    return iter_global_rows(df_cmd, build_global_lookups(df_envoi, df_fact, df_wf, df_const))
+
+def global_table(df_cmd, df_envoi, df_fact, df_wf, df_const) -> "GlobalTable":
+    """Global sous forme compacte (vide si Commande est absente ou sans colonne N° commande)."""
+    if df_cmd is None or df_cmd.empty or "N° commande" not in df_cmd.columns:
+        return GlobalTable.from_rows([])
+    return GlobalTable.from_rows(global_rows(df_cmd, df_envoi, df_fact, df_wf, df_const))
+
+# Mise en forme de Global portée par la colonne (format de nombre) et par la feuille (hauteur de
+# ligne) : les valeurs sont typées (dates, nombres), le format ne dépend donc pas de la valeur.
+# Un texte sous un format date ou montant s'affiche tel quel.
+GLOBAL_ROW_HEIGHT = 30
+GLOBAL_COLUMN_FORMATS = {1: "@", 8: "dd/mm/yyyy", 9: "dd/mm/yyyy", 10: "0.00"}  # A, H/I, J ; autres : Standard
+# Styles nommés du corps de Global, par format de nombre : une cellule reçoit le sien à sa création
+GLOBAL_STYLE_NAMES = {None: "Global", "@": "Global texte", "dd/mm/yyyy": "Global date", "0.00": "Global montant"}
+
+def setup_global_sheet(ws):
+    """Mise en page, largeurs et styles de colonnes de Global (communs aux deux modes d'écriture).
+
+    Renvoie le nom du style (GLOBAL_STYLE_NAMES, ajouté au classeur au besoin) de chaque colonne,
+    à donner aux cellules du corps (global_cells)."""
+    from openpyxl.styles import NamedStyle
+    ws.page_setup.orientation = 'landscape'
+    ws.page_margins.left = 0.19685  # 0,5 cm
+    ws.page_margins.right = 0.19685
+    ws.sheet_format.defaultRowHeight = GLOBAL_ROW_HEIGHT
+    ws.sheet_format.customHeight = True
+    body_font = Font(name="Calibri", size=9)
+    body_align = Alignment(horizontal="center", vertical="center")
+    book = ws.parent
+    for number_format, name in GLOBAL_STYLE_NAMES.items():
+        if name not in book.named_styles:
+            book.add_named_style(NamedStyle(name, font=body_font, alignment=body_align,
+                                            number_format=number_format or "General"))
+    styles = []
+    for i, w in enumerate(GLOBAL_COLUMN_WIDTHS, start=1):
+        dim = ws.column_dimensions[get_column_letter(i)]
+        dim.width = w + GLOBAL_WIDTH_OFFSET
+        dim.font = body_font; dim.alignment = body_align
+        if i in GLOBAL_COLUMN_FORMATS:
+            dim.number_format = GLOBAL_COLUMN_FORMATS[i]
+        styles.append(GLOBAL_STYLE_NAMES[GLOBAL_COLUMN_FORMATS.get(i)])
+    return styles
+
+def global_header_cells(ws, cell_class):
+    """Entête de Global (cellules créées déjà mises en forme). cell_class : Cell ou WriteOnlyCell."""
+    font = Font(name="Calibri", size=12)
+    align = Alignment(horizontal="center", vertical="center")
+    cells = []
+    for header in GLOBAL_HEADERS:
+        cell = cell_class(ws, value=header); cell.font = font; cell.alignment = align
+        cells.append(cell)
+    return cells
+
+def global_cells(ws, values, styles, cell_class):
+    """Cellules d'une ligne de Global créées avec le style de leur colonne (Excel applique le style
+    de la cellule, pas celui de la colonne). styles : voir setup_global_sheet."""
+    cells = []
+    for value, style in zip(values, styles):
+        cell = cell_class(ws, value=value); cell.style = style
+        cells.append(cell)
+    return cells
+
+def create_and_fill_global_sheet(writer, rows):
+    """Feuille(s) Global (plusieurs au-delà de la limite de lignes d'Excel) remplie(s) avec rows (GlobalTable)."""
+    ensure_deps_loaded()
+    from openpyxl.cell import Cell
+    book = writer.book
+    for sheet_name, start, stop in sheet_chunks("Global", len(rows)):
+        ws = book.create_sheet(sheet_name)
+        ws.append(global_header_cells(ws, Cell))
+        column_styles = setup_global_sheet(ws)
+        # corps : hauteur de ligne par défaut de la feuille
+        for row_values in rows[start:stop]:
+            ws.append(global_cells(ws, row_values, column_styles, Cell))
 
 def create_cover_sheet(writer):
     ensure_deps_loaded()
@@ -644,166 +914,4152 @@ def create_cover_sheet(writer):
     ws.freeze_panes = "A2"
     return ws
 
-# -------- GUI --------
-BaseTk = TkinterDnD.Tk if DND_AVAILABLE else tk.Tk
+# -------- Résultats compacts --------
+# Entre le calcul et l'écriture, les agrégats Factures et les lignes de Global sont rangés en
+# tableaux NumPy (quelques octets par BDC ou par cellule) plutôt qu'en dict et listes d'objets.
+class FactureTotals:
+    """Agrégats Factures par BDC (I et J). positions : BDC -> rang dans les tableaux.
 
-class App(BaseTk):
-    def __init__(self):
-        super().__init__()
-        self.title("Nettoie XLSX — V15")
-        self.geometry("1060x740")
-        self.minsize(980, 700)
+    counts : nombre de factures ; cents : somme des montants en centimes (int64) ; exact : somme
+    Decimal des montants non exprimables en centimes (rare) ; ordinals : date de règlement de la
+    première facture (0 = non datée) ; raw : valeur brute de cette date quand elle est illisible ;
+    rows : positions des lignes Factures rangées par BDC, celles du BDC de rang pos étant
+    rows[offsets[pos]:offsets[pos + 1]] (traçabilité, voir GlobalLineage)."""
+    __slots__ = ("positions", "counts", "cents", "exact", "ordinals", "raw", "rows", "offsets")
 
-        if StyleBase is not None:
-            StyleBase(master=self, theme="minty")
-        else:
-            style = ttk.Style()
-            if "clam" in style.theme_names():
-                style.theme_use("clam")
+    MAX_CENTS = 10 ** 15  # au-delà (ou NaN, infini, fraction de centime) : somme Decimal exacte
 
-        self.configure(bg="#eef6ff")
-        padding = {"padx": 16, "pady": 10}
-        frm = tk.Frame(self, bg="#eef6ff")
-        frm.pack(fill="both", expand=True, **padding)
+    @classmethod
+    def from_frame(cls, df_fact):
+        import numpy as np
+        self = cls()
+        self.positions, self.exact, self.raw = {}, {}, {}
+        row_pos, row_cents, row_nos, ordinals = [], [], [], []
+        if df_fact is not None and not df_fact.empty and "N° commande" in df_fact.columns:
+            for row_no, (_, r) in enumerate(df_fact.iterrows()):
+                key = str(r.get("N° commande", "")).strip()
+                if not key: continue
+                pos = self.positions.get(key)
+                if pos is None:
+                    pos = self.positions[key] = len(self.positions)
+                    # seule la date d'une facture unique est affichée : celle de la première suffit
+                    raw_date = r.get("Date de règlement")
+                    dreg = to_date_only(raw_date)  # dt.date | "" | original si non parsé
+                    if isinstance(dreg, dt.date):
+                        ordinals.append(dreg.toordinal())
+                    else:
+                        ordinals.append(0)
+                        self.raw[pos] = raw_date
+                amt = to_decimal(r.get("Montant HT"))
+                cents = amt * 100 if amt.is_finite() else None
+                if cents is not None and cents == cents.to_integral_value() and abs(cents) < self.MAX_CENTS:
+                    row_pos.append(pos); row_cents.append(int(cents))
+                else:
+                    self.exact[pos] = self.exact.get(pos, Decimal('0')) + amt
+                    row_pos.append(pos); row_cents.append(0)
+                row_nos.append(row_no)
+        n = len(self.positions)
+        positions = np.asarray(row_pos, dtype=np.int64)
+        self.counts = np.bincount(positions, minlength=n).astype(np.int32)
+        self.cents = np.zeros(n, dtype=np.int64)
+        np.add.at(self.cents, positions, np.asarray(row_cents, dtype=np.int64))
+        self.ordinals = np.asarray(ordinals, dtype=np.int32)
+        self.rows = np.asarray(row_nos, dtype=np.int32)[np.argsort(positions, kind="stable")]
+        self.offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self.offsets[1:])
+        return self
 
-        title_font = tkfont.Font(size=16, weight="bold")
-        subtitle_font = tkfont.Font(size=10)
+    def rows_of(self, pos: int):
+        """Positions des lignes Factures du BDC de rang pos."""
+        return self.rows[self.offsets[pos]:self.offsets[pos + 1]]
 
-        header = tk.Frame(frm, bg="#d9f1ff", highlightthickness=1, highlightbackground="#b6dbf7")
-        header.grid(row=0, column=0, columnspan=3, sticky="we", pady=(0, 12))
-        ttk.Label(
-            header,
-            text="✨ Nettoie XLSX — Consolidation SAG",
-            font=title_font,
-            background="#d9f1ff",
-        ).pack(anchor="w", padx=12, pady=(8, 0))
-        ttk.Label(
-            header,
-            text="Importez vos fichiers sources, lancez le traitement et obtenez un export consolidé avec l’onglet Global.",
-            font=subtitle_font,
-            background="#d9f1ff",
-        ).pack(anchor="w", padx=12, pady=(0, 8))
+    def count(self, pos: int) -> int:
+        return int(self.counts[pos])
 
-        # Variables
-        self.commandes_var = tk.StringVar()
-        self.constatations_var = tk.StringVar()
-        self.factures_var = tk.StringVar()
-        self.envoi_var = tk.StringVar()
-        self.workflow_var = tk.StringVar()
-        self.outfile_var = tk.StringVar()
-        self.status_var = tk.StringVar(value="Prêt")
+    def total(self, pos: int) -> Decimal:
+        total = Decimal(int(self.cents[pos])) / 100
+        return total + self.exact[pos] if pos in self.exact else total
 
-        # Lignes fichiers (ordre demandé)
-        src_frame = tk.LabelFrame(
-            frm,
-            text="Fichiers sources",
-            bg="#f7fbff",
-            fg="#1f4a7c",
-            highlightthickness=1,
-            highlightbackground="#c6dcf5",
-        )
-        src_frame.grid(row=1, column=0, columnspan=3, sticky="we", pady=(0, 10))
-        src_frame.grid_columnconfigure(1, weight=1)
-        self._row_file(src_frame, 0, "Commandes (.xlsx)", self.commandes_var)
-        self._row_file(src_frame, 1, "Constatations (.xlsx)", self.constatations_var)
-        self._row_file(src_frame, 2, "Factures (.xlsx)", self.factures_var)
-        self._row_file(src_frame, 3, "Envoi BDC (.xlsx)", self.envoi_var)
-        self._row_file(src_frame, 4, "Workflow (.xlsx)", self.workflow_var)
+    def single_date(self, pos: int):
+        ordinal = int(self.ordinals[pos])
+        return dt.date.fromordinal(ordinal) if ordinal else None
 
-        # Sortie
-        out_frame = tk.LabelFrame(
-            frm,
-            text="Export",
-            bg="#f7fbff",
-            fg="#1f4a7c",
-            highlightthickness=1,
-            highlightbackground="#c6dcf5",
-        )
-        out_frame.grid(row=2, column=0, columnspan=3, sticky="we", pady=(0, 10))
-        out_frame.grid_columnconfigure(1, weight=1)
-        ttk.Label(out_frame, text="Fichier de sortie (.xlsx)", background="#f7fbff").grid(
-            row=0, column=0, sticky="w", padx=8, pady=6
-        )
-        ttk.Entry(out_frame, textvariable=self.outfile_var).grid(row=0, column=1, sticky="we", padx=8, pady=6)
-        ttk.Button(out_frame, text="Parcourir…", command=self._pick_outfile).grid(row=0, column=2, sticky="we", padx=8, pady=6)
+class GlobalRow:
+    """Vue d'une ligne de GlobalTable (séquence de valeurs A..K), sans copie."""
+    __slots__ = ("table", "pos")
 
-        # Boutons
-        btns = ttk.Frame(frm)
-        btns.grid(row=3, column=0, columnspan=3, sticky="we", pady=(0, 10))
-        ttk.Button(btns, text="Lancer le traitement", command=self.run).pack(side="left", padx=4)
-        ttk.Button(btns, text="Vider les champs", command=self.clear_fields).pack(side="left", padx=4)
+    def __init__(self, table, pos):
+        self.table, self.pos = table, pos
 
-        # Log (exactement tes lignes)
-        log_frame = tk.LabelFrame(
-            frm,
-            text="Journal",
-            bg="#f7fbff",
-            fg="#1f4a7c",
-            highlightthickness=1,
-            highlightbackground="#c6dcf5",
-        )
-        log_frame.grid(row=4, column=0, columnspan=3, sticky="nsew")
-        log_frame.grid_columnconfigure(0, weight=1)
-        log_frame.grid_rowconfigure(0, weight=1)
-        self.log = tk.Text(
-            log_frame,
-            height=16,
-            wrap="word",
-            bg="#ffffff",
-            highlightthickness=1,
-            highlightbackground="#d5e7fb",
-        )
-        scrollbar = ttk.Scrollbar(log_frame, command=self.log.yview)
-        self.log.configure(yscrollcommand=scrollbar.set)
-        self.log.grid(row=0, column=0, sticky="nsew")
-        scrollbar.grid(row=0, column=1, sticky="ns")
-        frm.grid_columnconfigure(0, weight=1)
-        frm.grid_rowconfigure(4, weight=1)
+    def __len__(self):
+        return len(self.table.codes)
 
-        for line in INTRO_LOG_TEXT.strip().splitlines():
-            self._log(line)
-        if not DND_AVAILABLE:
-            self._log("Drag & drop indisponible : installez 'tkinterdnd2' (pip install tkinterdnd2).")
-        preload_deps_in_background()
+    def __getitem__(self, col):
+        return self.table.value(self.pos, col)
 
-        status = tk.Frame(frm, bg="#eef6ff")
-        status.grid(row=5, column=0, columnspan=3, sticky="we", pady=(8, 0))
-        ttk.Label(status, textvariable=self.status_var, background="#eef6ff").pack(anchor="w")
+    def __iter__(self):
+        return (self.table.value(self.pos, col) for col in range(len(self.table.codes)))
 
-    # UI helpers
-    def _row_file(self, parent, row, label, var):
-        ttk.Label(parent, text=label, background="#f7fbff").grid(row=row, column=0, sticky="w", padx=8, pady=6)
-        entry = ttk.Entry(parent, textvariable=var)
-        entry.grid(row=row, column=1, sticky="we", padx=8, pady=6)
-        ttk.Button(parent, text="Parcourir…", command=lambda v=var: self._pick(v)).grid(row=row, column=2, sticky="we", padx=8, pady=6)
-        if DND_AVAILABLE:
-            entry.drop_target_register(DND_FILES)
-            entry.dnd_bind('<<Drop>>', lambda e, v=var: self._on_drop(e, v))
+class GlobalTable:
+    """Lignes de Global en colonnes : index Commande, J en float64, autres colonnes en codes (int32)
+    vers leurs valeurs distinctes. L'itération restitue les listes de valeurs A..K d'origine."""
+    __slots__ = ("index", "codes", "categories", "amounts")
 
-    def _pick(self, var):
-        path = filedialog.askopenfilename(filetypes=[("Excel","*.xlsx")])
-        if path: var.set(path)
+    AMOUNT_COL = 9  # J (SOLDE)
 
-    def _pick_outfile(self):
-        initial_dir = ""
-        for v in (self.commandes_var.get(), self.constatations_var.get(), self.factures_var.get(),
-                  self.envoi_var.get(), self.workflow_var.get()):
-            if v: initial_dir = os.path.dirname(v); break
-        path = filedialog.asksaveasfilename(defaultextension=".xlsx",
+    @staticmethod
+    def _key(v):
+        if isinstance(v, float) and v != v:
+            return (v.__class__, "nan")
+        return (v.__class__, v)  # 3, 3.0 et True restent distincts
+
+    @classmethod
+    def from_rows(cls, rows):
+        """rows : itérable de (index Commande, valeurs A..K)."""
+        import numpy as np
+        ncols = len(GLOBAL_HEADERS)
+        index, amounts = [], []
+        codes = [[] for _ in range(ncols)]
+        categories = [[] for _ in range(ncols)]
+        lookups = [{} for _ in range(ncols)]
+        for idx, values in rows:
+            index.append(idx)
+            for col, v in enumerate(values):
+                if col == cls.AMOUNT_COL and amounts is not None:
+                    if v.__class__ is float:
+                        amounts.append(v)
+                        continue
+                    # montant non flottant : colonne J codée comme les autres
+                    codes[col] = [cls._encode(a, lookups[col], categories[col]) for a in amounts]
+                    amounts = None
+                codes[col].append(cls._encode(v, lookups[col], categories[col]))
+        self = cls()
+        self.index = np.asarray(index) if index else np.zeros(0, dtype=np.int64)
+        self.codes = [np.asarray(c, dtype=np.int32) for c in codes]
+        self.categories = categories
+        self.amounts = np.asarray(amounts, dtype=np.float64) if amounts is not None else None
+        return self
+
+    @classmethod
+    def _encode(cls, v, lookup, categories):
+        try:
+            key = cls._key(v)
+            code = lookup.get(key)
+            if code is None:
+                code = lookup[key] = len(categories)
+                categories.append(v)
+            return code
+        except TypeError:  # valeur non hachable : conservée telle quelle
+            categories.append(v)
+            return len(categories) - 1
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            part = GlobalTable()
+            part.index = self.index[key]
+            part.codes = [c[key] for c in self.codes]
+            part.categories = self.categories  # partagées
+            part.amounts = self.amounts[key] if self.amounts is not None else None
+            return part
+        return GlobalRow(self, range(len(self))[key])
+
+    def value(self, pos: int, col: int):
+        if col == self.AMOUNT_COL and self.amounts is not None:
+            return float(self.amounts[pos])
+        return self.categories[col][self.codes[col][pos]]
+
+    def _blocks(self, size=10000):
+        for start in range(0, len(self), size):
+            stop = start + size
+            cols = [[cats[c] for c in codes[start:stop].tolist()] for cats, codes in zip(self.categories, self.codes)]
+            if self.amounts is not None:
+                cols[self.AMOUNT_COL] = self.amounts[start:stop].tolist()
+            yield self.index[start:stop].tolist(), cols
+
+    def __iter__(self):
+        for _, cols in self._blocks():
+            for values in zip(*cols):
+                yield list(values)
+
+    def items(self):
+        """(index Commande, valeurs A..K), comme global_rows."""
+        for index, cols in self._blocks():
+            for idx, values in zip(index, zip(*cols)):
+                yield idx, list(values)
+
+    def column(self, col: int) -> list:
+        """Valeurs d'une colonne (0 : A … 10 : K)."""
+        if col == self.AMOUNT_COL and self.amounts is not None:
+            return self.amounts.tolist()
+        cats = self.categories[col]
+        return [cats[c] for c in self.codes[col].tolist()]
+
+    def columns(self) -> list:
+        """Valeurs de chaque colonne A..K."""
+        return [self.column(col) for col in range(len(self.codes))]
+
+    def strings(self) -> list:
+        """Textes distincts présents (table de chaînes partagées)."""
+        import numpy as np
+        found = []
+        for cats, codes in zip(self.categories, self.codes):
+            used = np.unique(codes) if len(codes) < len(cats) else range(len(cats))
+            found.extend(cats[c] for c in used if isinstance(cats[c], str))
+        return found
+
+class GlobalLineage:
+    """Lignes sources de chaque ligne de Global, relevées par iter_global_rows pendant les jointures.
+
+    Positions à partir de 0 dans les feuilles nettoyées (ligne du classeur = position + 2), -1 :
+    aucune ligne. commande, envoi, constatation, workflow : ligne retenue par la jointure ;
+    factures : rang du BDC dans FactureTotals, toutes ses lignes étant données par factures_rows.
+    """
+    __slots__ = ("_buffers", "commande", "envoi", "constatation", "factures", "workflow", "fact")
+
+    COLUMNS = ("commande", "envoi", "constatation", "factures", "workflow")
+
+    def __init__(self):
+        from array import array
+        self._buffers = [array("i") for _ in self.COLUMNS]
+        self.fact = None
+
+    def add(self, commande: int, envoi: int, constatation: int, factures: int, workflow: int):
+        for buf, pos in zip(self._buffers, (commande, envoi, constatation, factures, workflow)):
+            buf.append(pos)
+
+    def freeze(self, fact):
+        """Tableaux int32 définitifs ; fact : FactureTotals des jointures (None : Global vide)."""
+        import numpy as np
+        for name, buf in zip(self.COLUMNS, self._buffers):
+            setattr(self, name, np.frombuffer(buf, dtype=np.int32) if buf else np.zeros(0, dtype=np.int32))
+        self._buffers, self.fact = None, fact
+        return self
+
+    def __len__(self):
+        return len(self.commande)
+
+    def factures_rows(self, i: int):
+        """Positions des lignes Factures de la ligne i de Global (vide sans facture)."""
+        import numpy as np
+        group = int(self.factures[i])
+        return self.fact.rows_of(group) if group >= 0 else np.zeros(0, dtype=np.int32)
+
+# -------- Moteur Polars (optionnel) --------
+# "pandas" (référence) ou "polars" : filtres texte, jointures et agrégats par BDC en LazyFrames
+# Polars (multi-thread, mémoire Arrow). Les conversions de valeurs (dates jj/mm/aaaa, montants FR)
+# restent celles du moteur pandas, appliquées une fois par valeur distincte.
+ENGINE = os.environ.get("NETTOIEXLSX_ENGINE", "pandas")
+_POLARS_AVAILABLE = importlib.util.find_spec("polars") is not None
+
+def use_polars() -> bool:
+    return (ENGINE or "").lower() == "polars" and _POLARS_AVAILABLE
+
+def _polars():
+    import polars as pl
+    return pl
+
+def process_pool(max_workers: int, **kwargs):
+    """ProcessPoolExecutor des lectures et écritures parallèles. Une fois Polars chargé, ses fils
+    rendent fork dangereux (blocage possible du processus copié) : les processus sont alors lancés
+    en "spawn"."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    if "polars" in sys.modules and multiprocessing.get_start_method() == "fork":
+        kwargs["mp_context"] = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, **kwargs)
+
+def _is_nan(v) -> bool:
+    return v is None or (isinstance(v, float) and v != v) or (v is not None and not isinstance(v, str) and pd.isna(v))
+
+def _text_view(values):
+    """str(v) par valeur, None pour les vides (comme astype(str) puis comparaison en pandas)."""
+    return [None if _is_nan(v) else str(v) for v in values]
+
+def _key_view(values):
+    """Clé de jointure BDC : str(v).strip(), y compris 'nan' comme dans le moteur pandas."""
+    return [str(v).strip() for v in values]
+
+def _cached(fn):
+    """Applique fn une fois par valeur distincte (les NaN sont traités ensemble)."""
+    cache = {}
+    nan_key = object()
+    def apply(values):
+        out = []
+        for v in values:
+            k = nan_key if _is_nan(v) and not isinstance(v, str) else (type(v), v)
+            try:
+                r = cache[k]
+            except KeyError:
+                r = cache[k] = fn(v)
+            except TypeError:  # valeur non hachable
+                r = fn(v)
+            out.append(r)
+        return out
+    return apply
+
+def polars_commandes_keep(df, c_f, c_n):
+    """Masque des lignes Commande conservées (FCM 3MUNDI ESR-M et Mission exclus)."""
+    pl = _polars()
+    cols = {}
+    if c_f is not None: cols["f"] = _text_view(df[c_f].tolist())
+    if c_n is not None: cols["n"] = _text_view(df[c_n].tolist())
+    if not cols:
+        return [True] * len(df)
+    keep = pl.lit(True)
+    if c_f is not None:
+        keep = keep & ~(pl.col("f").str.strip_chars().str.to_uppercase() == "FCM 3MUNDI ESR-M").fill_null(False)
+    if c_n is not None:
+        nature = pl.col("n").str.normalize("NFD").str.replace_all(r"\p{Mn}", "").str.to_lowercase().str.strip_chars()
+        keep = keep & (nature != "mission").fill_null(True)
+    lf = pl.LazyFrame(cols, schema={k: pl.String for k in cols})
+    return lf.select(keep.alias("keep")).collect()["keep"].to_numpy()
+
+def polars_factures_keep(df, c_nat, c_fou):
+    """Masque des lignes Factures conservées (nature MI et FCM 3MUNDI ESR-M exclus)."""
+    pl = _polars()
+    cols = {}
+    if c_nat is not None: cols["n"] = _text_view(df[c_nat].tolist())
+    if c_fou is not None: cols["f"] = _text_view(df[c_fou].tolist())
+    if not cols:
+        return [True] * len(df)
+    keep = pl.lit(True)
+    if c_nat is not None:
+        keep = keep & ~(pl.col("n").str.strip_chars().str.to_uppercase() == "MI").fill_null(False)
+    if c_fou is not None:
+        keep = keep & ~(pl.col("f").str.strip_chars().str.to_uppercase() == "FCM 3MUNDI ESR-M").fill_null(False)
+    lf = pl.LazyFrame(cols, schema={k: pl.String for k in cols})
+    return lf.select(keep.alias("keep")).collect()["keep"].to_numpy()
+
+def _scaled_amounts(values):
+    """Montants en entiers à l'échelle commune 10^exp (somme exacte côté Polars) ; None si non représentable."""
+    decs = _cached(to_decimal)(values)
+    if not all(d.is_finite() for d in decs):
+        return None
+    exp = min([0] + [d.as_tuple().exponent for d in decs])
+    scaled = []
+    for d in decs:
+        sign, digits, e = d.as_tuple()
+        n = int("".join(map(str, digits)) or "0") * 10 ** (e - exp)
+        scaled.append(-n if sign else n)
+    if scaled and max(abs(x) for x in scaled) * len(scaled) >= 2 ** 62:
+        return None
+    return scaled, exp
+
+def _iterrows_columns(df) -> dict:
+    """Valeurs par colonne telles que df.iterrows() les présente au moteur pandas.
+
+    iterrows reconstruit une Series par ligne, dont pandas infère le type : types communs
+    (int -> float), lignes textuelles (None -> NaN) ou de dates (NaN -> NaT). Seules les lignes
+    avec des vides et sans valeur numérique peuvent changer ; elles seules sont reconstruites.
+    """
+    if df is None:
+        return {}
+    import numpy as np
+    arr = df.to_numpy()
+    rows = arr.tolist()
+    if arr.dtype == object:
+        for r, row in enumerate(rows):
+            has_na = False
+            for v in row:
+                if v is None or v is pd.NA or v is pd.NaT or (isinstance(v, float) and v != v):
+                    has_na = True
+                elif isinstance(v, (int, float, Decimal)):  # bool inclus : la ligne reste object
+                    break
+            else:
+                if has_na:
+                    rows[r] = pd.Series(arr[r]).tolist()
+    return {name: [row[j] for row in rows] for j, name in enumerate(df.columns)}
+
+def _column(cols: dict, name, default, length: int):
+    return cols[name] if name in cols else [default] * length
+
+def iter_global_rows_polars(df_cmd, df_envoi, df_fact, df_wf, df_const):
+    """Mêmes règles A..K que iter_global_rows : jointures et agrégats en Polars, valeurs identiques."""
+    pl = _polars()
+    ensure_deps_loaded()
+    frames = [f for f in (df_cmd, df_envoi, df_fact, df_wf, df_const) if f is not None]
+    cmd, envoi_cols, fact_cols, wf_cols, const_cols = (
+        _iterrows_columns(df) for df in (df_cmd, df_envoi, df_fact, df_wf, df_const))
+    n_envoi, n_fact, n_wf, n_const = (0 if df is None else len(df) for df in (df_envoi, df_fact, df_wf, df_const))
+    amounts = _scaled_amounts(_column(fact_cols, "Montant HT", None, n_fact))
+    if amounts is None or any(f.columns.duplicated().any() for f in frames):
+        # montants non finis ou colonnes en double : le moteur de référence garde la main
+        yield from iter_global_rows(df_cmd, build_global_lookups(df_envoi, df_fact, df_wf, df_const))
+        return
+    scaled, exp = amounts
+    empty = lambda df: df is None or df.empty
+
+    index = list(df_cmd.index)
+    n_cmd = len(df_cmd)
+    col_b = _column(cmd, "Libellé", "-", n_cmd)
+    col_c = _column(cmd, "Fournisseur", "-", n_cmd)
+    col_d = _column(cmd, "Montant HT", "0", n_cmd)
+    col_e = _column(cmd, "Ind. Visa", "-", n_cmd)
+    col_k = _column(cmd, "Statut", "-", n_cmd)
+    bdcs = _key_view(_column(cmd, "N° commande", "", n_cmd))
+    q = pl.LazyFrame({
+        "i": list(range(len(bdcs))),
+        "bdc": bdcs,
+        "c_up": [str(c).strip().upper() for c in col_c],
+    }, schema={"i": pl.Int64, "bdc": pl.String, "c_up": pl.String}).filter(pl.col("bdc") != "")
+
+    # F : Envoi BDC, première occurrence par BDC
+    if not empty(df_envoi):
+        envoi = pl.LazyFrame({
+            "key": _key_view(_column(envoi_cols, "Commande", "", n_envoi)),
+            "b": _cached(date_to_text_dmy)(_column(envoi_cols, "Date envoi", None, n_envoi)),
+            "c": _cached(lambda v: "" if pd.isna(v) else str(v).strip())(_column(envoi_cols, "Agent", None, n_envoi)),
+        }, schema={"key": pl.String, "b": pl.String, "c": pl.String})
+        envoi = (envoi.filter(pl.col("key") != "")
+                 .unique(subset="key", keep="first", maintain_order=True)
+                 .select("key", pl.concat_str(["b", "c"], separator=" ").str.strip_chars().alias("f")))
+        q = q.join(envoi, left_on="bdc", right_on="key", how="left")
+    else:
+        q = q.with_columns(pl.lit(None, dtype=pl.String).alias("f"))
+
+    # I, J : Factures, nombre / somme / première ligne par BDC
+    if not empty(df_fact):
+        fact = pl.LazyFrame({
+            "key": _key_view(_column(fact_cols, "N° commande", "", n_fact)),
+            "amt": scaled,
+            "row": list(range(n_fact)),
+        }, schema={"key": pl.String, "amt": pl.Int64, "row": pl.Int64})
+        fact = (fact.filter(pl.col("key") != "")
+                .group_by("key")
+                .agg(pl.len().alias("n_fact"), pl.col("amt").sum().alias("sum_fact"), pl.col("row").first().alias("fact_row")))
+        q = q.join(fact, left_on="bdc", right_on="key", how="left")
+    else:
+        q = q.with_columns(pl.lit(None, dtype=pl.UInt32).alias("n_fact"), pl.lit(None, dtype=pl.Int64).alias("sum_fact"),
+                           pl.lit(None, dtype=pl.Int64).alias("fact_row"))
+
+    # H : Workflow, dernière occurrence par BDC
+    wf_bdc_col, wf_val_col = choose_workflow_value_column(df_wf)
+    if not empty(df_wf) and wf_bdc_col is not None:
+        wf = pl.LazyFrame({"key": _key_view(wf_cols[wf_bdc_col]), "wf_row": list(range(n_wf))},
+                          schema={"key": pl.String, "wf_row": pl.Int64})
+        wf = wf.filter(pl.col("key") != "").unique(subset="key", keep="last", maintain_order=True)
+        q = q.join(wf, left_on="bdc", right_on="key", how="left")
+    else:
+        q = q.with_columns(pl.lit(None, dtype=pl.Int64).alias("wf_row"))
+
+    # G : Constatation, dernière occurrence par Commande puis par extrait commande
+    const_status = _column(const_cols, "Statut", None, n_const)
+    if not empty(df_const):
+        rows = list(range(n_const))
+        full = pl.LazyFrame({"key": _key_view(_column(const_cols, "Commande", "", n_const)), "cf_row": rows},
+                            schema={"key": pl.String, "cf_row": pl.Int64})
+        full = full.filter(pl.col("key") != "").unique(subset="key", keep="last", maintain_order=True)
+        extract = pl.LazyFrame({"key": _key_view(_column(const_cols, "extrait commande", "", n_const)), "ce_row": rows},
+                               schema={"key": pl.String, "ce_row": pl.Int64})
+        extract = extract.filter(pl.col("key") != "").unique(subset="key", keep="last", maintain_order=True)
+        q = (q.join(full, left_on="bdc", right_on="key", how="left")
+             .with_columns(pl.col("bdc").str.slice(0, 5).alias("bdc5"))
+             .join(extract, left_on="bdc5", right_on="key", how="left"))
+    else:
+        q = q.with_columns(pl.lit(None, dtype=pl.Int64).alias("cf_row"), pl.lit(None, dtype=pl.Int64).alias("ce_row"))
+
+    f_norm = pl.col("f").fill_null("").str.normalize("NFD").str.replace_all(r"\p{Mn}", "").str.to_lowercase()
+    q = q.with_columns(
+        (pl.col("c_up") == "BNP PARIBAS - REGULARISATION CARTE ACHAT").alias("regul"),
+        f_norm.str.contains("ss objet regul ca", literal=True).alias("f_regul"),
+    ).sort("i")
+    res = q.select("i", "bdc", "f", "regul", "f_regul", "n_fact", "sum_fact", "fact_row", "wf_row", "cf_row", "ce_row").collect()
+
+    fact_raw = _column(fact_cols, "Date de règlement", None, n_fact)
+    wf_values = []
+    if wf_bdc_col is not None and not empty(df_wf):
+        wf_values = _cached(to_date_only)(wf_cols[wf_val_col] if wf_val_col else [""] * n_wf)
+    seen_signatures = set()
+    for i, bdc, f, regul, f_regul, n_fact, sum_fact, fact_row, wf_row, cf_row, ce_row in res.iter_rows():
+        f = f if f is not None else ""
+        if regul:
+            g = "ss objet Régul CA"
+        elif f_regul:
+            st = const_status[cf_row] if cf_row is not None else None
+            if st is None or (isinstance(st, float) and pd.isna(st)):
+                st = const_status[ce_row] if ce_row is not None else None
+            g = st if st not in (None, "") and not (isinstance(st, float) and pd.isna(st)) else "Pas de SF connu"
+        else:
+            g = "Pas de SF connu"
+        h = wf_values[wf_row] if wf_row is not None else ""
+        if not n_fact:
+            i_val = "pas de paiement connu"
+        elif n_fact == 1:
+            raw = fact_raw[fact_row]
+            dreg = to_date_only(raw)
+            if isinstance(dreg, dt.date):
+                i_val = dreg
+            else:
+                i_val = date_to_text_dmy(raw) if raw not in (None, "") else "date manquante"
+        else:
+            i_val = f"{n_fact} paiement" + ("s" if n_fact >= 2 else "")
+        total_fact = Decimal(sum_fact).scaleb(exp) if sum_fact is not None else Decimal('0')
+        j = float(to_decimal(col_d[i]) - total_fact)
+
+        row_values = [bdc, col_b[i], col_c[i], col_d[i], col_e[i], f, g, h, i_val, j, col_k[i]]
+        signature = tuple(sig_value(x) for x in row_values)
+        if signature in seen_signatures:
+            continue
+        seen_signatures.add(signature)
+        yield index[i], row_values
+
+# -------- Taille des entrées --------
+def _first_sheet_part(zf) -> str:
+    """Chemin (dans le zip) de la première feuille du classeur."""
+    import posixpath
+    import xml.etree.ElementTree as ET
+    ns_main = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+    ns_rel = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+    try:
+        wb_xml = ET.fromstring(zf.read("xl/workbook.xml"))
+        first = wb_xml.find(f"{ns_main}sheets/{ns_main}sheet")
+        rid = first.get(f"{ns_rel}id")
+        rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+        for rel in rels:
+            if rel.get("Id") == rid:
+                target = rel.get("Target")
+                return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+    except (KeyError, AttributeError, ET.ParseError):
+        pass
+    return "xl/worksheets/sheet1.xml"
+
+def sheet_dimension(xlsx_path: str):
+    """(lignes, colonnes) de la première feuille d'après <dimension>, sans parser les cellules.
+
+    Sans <dimension>, estimation grossière à partir de la taille décompressée de la feuille.
+    """
+    import re
+    import zipfile
+    from openpyxl.utils.cell import column_index_from_string
+    with zipfile.ZipFile(xlsx_path) as zf:
+        part = _first_sheet_part(zf)
+        with zf.open(part) as fh:
+            head = fh.read(4096).decode("utf-8", "ignore")
+        size = zf.getinfo(part).file_size
+    m = re.search(r'<(?:\w+:)?dimension\s+ref="\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?"', head)
+    if m and m.group(3):
+        rows = int(m.group(4)) - int(m.group(2)) + 1
+        cols = column_index_from_string(m.group(3)) - column_index_from_string(m.group(1)) + 1
+        return rows, cols
+    return max(1, size // 600), 10  # ~60 octets XML par cellule, 10 colonnes
+
+def estimate_input_cells(files: dict) -> int:
+    total = 0
+    for value in files.values():
+        for path in slot_paths(value):
+            rows, cols = sheet_dimension(path)
+            total += rows * cols
+    return total
+
+# -------- Plusieurs fichiers par case --------
+# Une case peut recevoir plusieurs exports (par année, par semaine…) : chemins séparés par ";",
+# motifs (Envoi BDC *.xlsx) ou liste. Les fichiers sont lus en parallèle puis mis bout à bout
+# dans l'ordre donné (motifs : ordre alphabétique) ; une ligne identique à une ligne d'un fichier
+# précédent (exports qui se chevauchent) est écartée, les doublons internes à un fichier restent.
+SLOT_SEPARATOR = ";"
+INPUT_WORKERS = None  # None : un processus par fichier, dans la limite des cœurs
+
+def slot_paths(value) -> list:
+    """Chemins d'une case : "" / None, chemin, "a.xlsx;b.xlsx", motif glob ou liste de ceux-ci."""
+    import glob
+    if not value:
+        return []
+    parts = value if isinstance(value, (list, tuple)) else str(value).split(SLOT_SEPARATOR)
+    paths = []
+    for part in parts:
+        part = str(part).strip()
+        if not part:
+            continue
+        matches = sorted(glob.glob(part)) if glob.has_magic(part) else []
+        paths.extend(matches or [part])  # motif sans correspondance : erreur de lecture explicite
+    return list(dict.fromkeys(paths))
+
+def row_keys(df) -> list:
+    """Clé stable de chaque ligne (sig_value de chaque cellule), indépendante du type de colonne."""
+    return [tuple(sig_value(v) for v in row) for row in df.itertuples(index=False, name=None)]
+
+def union_frames(frames: list):
+    """(DataFrame, lignes écartées) : frames mis bout à bout, sans les lignes déjà vues dans un
+    fichier précédent."""
+    if len(frames) == 1:
+        return frames[0], 0
+    df = pd.concat(frames, ignore_index=True, sort=False)
+    seen, keep, start = set(), [], 0
+    for frame in frames:
+        keys = row_keys(df.iloc[start:start + len(frame)])
+        keep.extend(k not in seen for k in keys)
+        seen.update(keys)
+        start += len(frame)
+    dropped = keep.count(False)
+    return (df[keep].reset_index(drop=True) if dropped else df), dropped
+
+# -------- Limite de lignes d'Excel --------
+# Une feuille plus longue que la limite (1 048 576 lignes, en-tête compris) est répartie sur des
+# feuilles numérotées (Commande_1, Commande_2…), Global comprise ; Global est calculée sur les
+# sources complètes, avant découpage.
+EXCEL_MAX_ROWS = 1_048_576
+SHEET_ROW_LIMIT = int(os.environ.get("NETTOIEXLSX_MAX_ROWS", EXCEL_MAX_ROWS))
+
+def sheet_chunks(name: str, nrows: int) -> list:
+    """[(nom de feuille, début, fin)] des tranches de nrows lignes de données (hors en-tête)."""
+    per_sheet = max(SHEET_ROW_LIMIT - 1, 1)
+    if nrows <= per_sheet:
+        return [(name, 0, nrows)]
+    count = -(-nrows // per_sheet)
+    return [(f"{name}_{k}", (k - 1) * per_sheet, min(k * per_sheet, nrows)) for k in range(1, count + 1)]
+
+def check_sheet_sizes(rows: dict, log=print):
+    """Annonce, avant le calcul de Global, les feuilles qui dépasseront la limite d'Excel."""
+    for name, nrows in rows.items():
+        chunks = sheet_chunks(name, nrows)
+        if len(chunks) > 1:
+            log(f"{name} : {nrows} lignes, au-delà de la limite d'Excel ({SHEET_ROW_LIMIT} lignes) : "
+                f"feuilles {chunks[0][0]} à {chunks[-1][0]}")
+
+# -------- Reconnaissance des fichiers --------
+# Lecture en flux des premières lignes de la première feuille (XML du classeur, sans pandas ni
+# openpyxl) puis comparaison aux signatures des exports : quelques millisecondes par fichier.
+CLASSIFY_MAX_ROWS = 40
+_XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+# (case, titre de la bannière Geslab, colonnes SYN attendues, entêtes propres à l'export)
+CLASSIFY_SIGNATURES = [
+    ("Commandes", "liste des commandes",
+     ["N° commande", "Libellé", "Fournisseur", "Montant HT", "Type de flux", "Ind. Visa", "Auteur"],
+     {"n cde de l org", "type de flux", "ind visa", "auteur"}),
+    ("Constatations", "liste des constatations",
+     ["Commande", "Fournisseur", "Statut (constatations)"],
+     {"n constatation", "n bl", "constatateur", "receptionneur", "date de creation"}),
+    ("Factures", "liste des factures",
+     ["N° commande", "Fournisseur", "Montant HT", "Nature de dépense", "Date de règlement"],
+     {"n facture geslab", "n facture de l org", "n facture fournisseur", "type de facture", "montant ttc"}),
+    ("EnvoiBDC", None,
+     ["Commande"],
+     {"date envoi", "agent", "commentaire", "facturation", "recurrence", "prestation", "demandeur"}),
+    ("Workflow", None,
+     [],
+     {"n doc pdap", "n fourn bfc", "raison sociale fourn", "n cde bfc", "n cde geslab", "motif du workflow",
+      "a traiter avant le", "gestionnaire"}),
+]
+
+def sniff_rows(xlsx_path: str, max_rows: int | None = None) -> list:
+    """Textes non vides des max_rows premières lignes de la première feuille."""
+    import zipfile
+    import xml.etree.ElementTree as ET
+    max_rows = CLASSIFY_MAX_ROWS if max_rows is None else max_rows
+    rows, needed = [], set()
+    with zipfile.ZipFile(xlsx_path) as zf:
+        with zf.open(_first_sheet_part(zf)) as fh:
+            row = []
+            for _, el in ET.iterparse(fh):
+                if el.tag == _XLSX_NS + "c":
+                    kind, v = el.get("t"), el.find(_XLSX_NS + "v")
+                    if kind == "inlineStr":
+                        row.append("".join(t.text or "" for t in el.iter(_XLSX_NS + "t")))
+                    elif v is not None and v.text:
+                        if kind == "s":
+                            row.append(int(v.text)); needed.add(int(v.text))
+                        else:
+                            row.append(v.text)
+                    el.clear()
+                elif el.tag == _XLSX_NS + "row":
+                    rows.append(row); row = []
+                    el.clear()
+                    if len(rows) >= max_rows:
+                        break
+        # table des chaînes partagées lue jusqu'au plus grand indice utile seulement
+        strings = {}
+        if needed and "xl/sharedStrings.xml" in zf.namelist():
+            last, i = max(needed), 0
+            with zf.open("xl/sharedStrings.xml") as fh:
+                for _, el in ET.iterparse(fh):
+                    if el.tag == _XLSX_NS + "si":
+                        if i in needed:
+                            strings[i] = "".join(t.text or "" for t in el.iter(_XLSX_NS + "t"))
+                        el.clear(); i += 1
+                        if i > last:
+                            break
+    out = []
+    for row in rows:
+        texts = [strings.get(v, "") if isinstance(v, int) else v for v in row]
+        out.append([t for t in texts if t.strip()])
+    return out
+
+def _signature_score(rows: list, normalized: list, banner, syn_keys, own_headers) -> int:
+    """0 si l'export ne correspond pas, sinon un score (plus grand = plus sûr)."""
+    has_banner = bool(banner) and any(banner in row for row in normalized[:3])
+    has_results = any("liste des resultats" in row for row in normalized)
+    best = 0
+    for raw, row in zip(rows, normalized):
+        if len(row) < 2:
+            continue
+        own = len(own_headers.intersection(row))
+        if own >= 2 or (has_banner and own >= 1):
+            syn = sum(1 for key in syn_keys if pick_column(raw, SYN[key]) is not None)
+            best = max(best, 2 * own + syn)
+    if banner:  # exports Geslab : bannière "Liste des …" ou marqueur "Liste des résultats" obligatoire
+        if not (has_banner or has_results):
+            return 0
+        best += 10 if has_banner and best else 0
+    return best
+
+def classify_workbook(xlsx_path: str):
+    """Case ("Commandes", "Constatations", "Factures", "EnvoiBDC", "Workflow") d'après le contenu, ou None."""
+    try:
+        rows = sniff_rows(xlsx_path)
+    except Exception:
+        return None
+    normalized = [[normalize_colname(v) for v in row] for row in rows]
+    scores = sorted(((_signature_score(rows, normalized, banner, syn, own), key)
+                     for key, banner, syn, own in CLASSIFY_SIGNATURES), reverse=True)
+    (top, key), (second, _) = scores[0], scores[1]
+    return key if top > 0 and top > second else None
+
+# -------- Mode hors mémoire (out-of-core) --------
+# "auto" : bascule selon la taille estimée des entrées ; "on" / "off" pour forcer.
+OUT_OF_CORE_MODE = os.environ.get("NETTOIEXLSX_OUT_OF_CORE", "auto")
+OUT_OF_CORE_THRESHOLD_CELLS = 4_000_000
+OUT_OF_CORE_PARTITIONS = 16
+OUT_OF_CORE_CHUNK_ROWS = 50_000
+
+def use_out_of_core(files: dict) -> bool:
+    mode = (OUT_OF_CORE_MODE or "auto").lower()
+    if mode in ("on", "1", "true"):
+        return True
+    if mode in ("off", "0", "false"):
+        return False
+    return estimate_input_cells(files) > OUT_OF_CORE_THRESHOLD_CELLS
+
+def _excel_na_strings():
+    try:
+        from pandas._libs.parsers import STR_NA_VALUES
+    except ImportError:  # pragma: no cover - emplacement interne de pandas
+        STR_NA_VALUES = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+                         "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+    from openpyxl.cell.cell import ERROR_CODES
+    return frozenset(STR_NA_VALUES) | frozenset(ERROR_CODES)
+
+class SheetChunkReader:
+    """Lecture en flux (openpyxl read_only) équivalente à read_after_skip / dataframe_below_marker_or_first.
+
+    Itère des DataFrames d'au plus chunk_rows lignes de données, avec l'entête détectée comme en
+    mode mémoire et l'index = position de la ligne dans la feuille. Les valeurs sont converties
+    comme pd.read_excel (entiers, textes vides ou "NA" -> NaN). max_width donne, en fin de lecture,
+    le nombre de colonnes réellement renseignées (pandas n'en garde pas davantage).
+    """
+
+    def __init__(self, xlsx_path: str, skip_rows: int = 0, marker: str | None = None,
+                 chunk_rows: int | None = None):
+        self.path = xlsx_path
+        self.skip_rows = skip_rows
+        self.marker = marker
+        self.chunk_rows = chunk_rows or OUT_OF_CORE_CHUNK_ROWS
+        self.columns = None
+        self.max_width = 0
+
+    def _locate(self, wb):
+        """(feuille, lignes à ignorer) : sous le marqueur s'il existe, sinon première feuille."""
+        if self.marker is not None:
+            marker_norm = normalize_colname(self.marker)
+            for ws in wb.worksheets:
+                for row_no, values in enumerate(ws.iter_rows(values_only=True), start=1):
+                    for v in values:
+                        if v is not None and normalize_colname(str(v)) == marker_norm:
+                            return ws, row_no
+            return wb.worksheets[0], 0
+        return wb.worksheets[0], self.skip_rows
+
+    def __iter__(self):
+        ensure_deps_loaded()
+        nan = float("nan")
+        na_strings = _excel_na_strings()
+        wb = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            ws, skip = self._locate(wb)
+            width = ws.max_column or 0  # <dimension> ; les lignes sont complétées jusqu'à cette largeur
+            ws.reset_dimensions()
+            header = None
+            rows, index = [], []
+            yielded = False
+            for row_no, values in enumerate(ws.iter_rows(values_only=True)):
+                conv = []
+                for v in values:
+                    if v is None or (isinstance(v, str) and v in na_strings):
+                        v = nan
+                    elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                        iv = int(v)
+                        v = iv if iv == v else float(v)
+                    conv.append(v)
+                used = len(conv)
+                while used and isinstance(conv[used - 1], float) and conv[used - 1] != conv[used - 1]:
+                    used -= 1
+                self.max_width = max(self.max_width, used)
+                if row_no < skip:
+                    continue
+                if header is None:
+                    if used and sum(1 for v in conv[:used] if not (isinstance(v, float) and v != v)) >= 2:
+                        width = max(width, used)
+                        header = [str(v).strip() for v in conv[:width]] + ["nan"] * (width - len(conv))
+                        self.columns = header
+                    continue
+                if not used:
+                    continue  # ligne vide : dropna(how="all")
+                conv = conv[:width] + [nan] * (width - len(conv))
+                rows.append(conv); index.append(row_no)
+                if len(rows) >= self.chunk_rows:
+                    yield self._frame(rows, index, header)
+                    rows, index, yielded = [], [], True
+            if header is not None and (rows or not yielded):
+                yield self._frame(rows, index, header)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _frame(rows, index, header):
+        df = pd.DataFrame(rows, index=index, columns=range(len(header)), dtype=object)
+        df.columns = header
+        return df.dropna(how="all")
+
+def _partition_of(key: str, n: int) -> int:
+    import zlib
+    # Partition sur les 5 premiers caractères : un BDC et son "extrait commande" tombent ensemble.
+    return zlib.crc32(key[:5].encode("utf-8")) % n
+
+class SpillStore:
+    """Stockage disque temporaire des sources nettoyées, par colonnes.
+
+    Chaque colonne d'une feuille a son propre fichier, où les blocs successifs sont ajoutés sous
+    forme de tableaux (dtype conservé) ; un fichier d'index les accompagne. Une lecture ne charge
+    que les colonnes demandées. Chaque source est conservée deux fois : dans l'ordre d'origine
+    (pour l'écriture de sa feuille) et répartie par hachage du BDC en N partitions (pour les
+    jointures Global partition par partition). Les partitions de Global calculées sont rangées
+    à part (add_global) et relues fusionnées dans l'ordre de Commande (iter_global).
+    """
+
+    def __init__(self, n_partitions: int | None = None):
+        import tempfile
+        self.n = n_partitions or OUT_OF_CORE_PARTITIONS
+        self.dir = tempfile.mkdtemp(prefix="nettoiexlsx_")
+        self.columns = {}  # feuille -> colonnes
+        self.widths = {}   # feuille -> [longueur max par colonne] (autofit)
+        self.rows = {}     # feuille -> nombre de lignes
+        self.global_parts = []  # partitions de Global enregistrées
+        self.global_rows = 0
+
+    def _path(self, name, part=None, column=None):
+        safe = name.replace(" ", "_") + ("" if part is None else f".{part}")
+        return os.path.join(self.dir, f"{safe}.{'idx' if column is None else column}")
+
+    @staticmethod
+    def _dump(path, obj):
+        import pickle
+        with open(path, "ab") as fh:
+            pickle.dump(obj, fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load_all(path):
+        import pickle
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as fh:
+            while True:
+                try:
+                    yield pickle.load(fh)
+                except EOFError:
+                    return
+
+    def _write_block(self, name, part, df):
+        self._dump(self._path(name, part), df.index.to_numpy())
+        for pos in range(df.shape[1]):
+            self._dump(self._path(name, part, pos), df.iloc[:, pos].array)
+
+    def _read_blocks(self, name, part=None, ncols=None):
+        """DataFrames successifs de name (partition part), limités aux ncols premières colonnes."""
+        columns = self.columns[name][:ncols]
+        readers = [self._load_all(self._path(name, part, pos)) for pos in range(len(columns))]
+        for index in self._load_all(self._path(name, part)):
+            # dtype explicite : sans lui, une colonne objet de textes serait convertie en str (None -> NaN)
+            df = pd.DataFrame({pos: pd.Series(arr, index=index, dtype=arr.dtype, copy=False)
+                               for pos, arr in enumerate(next(r) for r in readers)}, index=index)
+            df.columns = columns  # noms en double possibles (Workflow)
+            yield df
+
+    def append(self, name, df, partition_keys=None):
+        """Ajoute un bloc nettoyé. partition_keys : liste de Series de clés BDC (une ligne peut aller dans plusieurs partitions)."""
+        if name not in self.columns:
+            self.columns[name] = list(df.columns)
+            self.widths[name] = [len(str(c)) for c in df.columns]
+            self.rows[name] = 0
+        if df.empty:
+            return
+        widths = self.widths[name]
+        for pos in range(df.shape[1]):
+            col_vals = df.iloc[:, pos].astype(str).fillna("")  # comme autofit_worksheet
+            widths[pos] = max([widths[pos]] + [len(v) for v in col_vals])
+        self.rows[name] += len(df)
+        self._write_block(name, None, df)
+        if not partition_keys:
+            return
+        ids = [keys.map(lambda k: _partition_of(str(k).strip(), self.n)).to_numpy()
+               for keys in partition_keys]
+        for part in range(self.n):
+            mask = ids[0] == part
+            for other in ids[1:]:
+                mask |= other == part
+            if mask.any():
+                self._write_block(name, part, df[mask])
+
+    def iter_frames(self, name, ncols=None):
+        """Blocs de name dans l'ordre d'origine (ncols : seules les premières colonnes sont relues)."""
+        if name in self.columns:
+            yield from self._read_blocks(name, ncols=ncols)
+
+    def partition(self, name, part):
+        if name not in self.columns:
+            return None
+        frames = list(self._read_blocks(name, part))
+        if not frames:
+            return None
+        return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+    def partition_sources(self, part):
+        """(Commande, Envoi BDC, Factures, Workflow, Constatation) de la partition part, dans
+        l'ordre des arguments de global_rows ; None si la partition n'a pas de commande."""
+        df_cmd = self.partition("Commande", part)
+        if df_cmd is None:
+            return None
+        return (df_cmd, *(self.partition(name, part)
+                          for name in ("Envoi BDC", "Factures", "Workflow", "Constatation")))
+
+    def add_global(self, part, table):
+        """Range la Global (GlobalTable) calculée pour la partition part."""
+        self._dump(self._path("Global", part), table)
+        self.global_parts.append(part)
+        self.global_rows += len(table)
+
+    def iter_global(self):
+        """(index Commande, valeurs) de toutes les partitions de Global, fusionnées dans l'ordre de Commande."""
+        import heapq
+
+        def rows(part):
+            for table in self._load_all(self._path("Global", part)):
+                yield from table.items()
+        return heapq.merge(*(rows(p) for p in self.global_parts), key=lambda item: item[0])
+
+    def close(self):
+        import shutil
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+# (clé fichier, feuille, lignes ignorées, marqueur, nettoyage, colonnes de clé BDC pour le partitionnement)
+OUT_OF_CORE_SOURCES = [
+    ("Commandes", "Commande", 20, None, lambda df: clean_commandes(df), ["N° commande"]),
+    ("Constatations", "Constatation", 17, None, lambda df: clean_constatations(df), ["Commande", "extrait commande"]),
+    ("Factures", "Factures", 19, None, lambda df: clean_factures(df), ["N° commande"]),
+    ("EnvoiBDC", "Envoi BDC", 0, None, lambda df: clean_envoi_bdc(df), ["Commande"]),
+    ("Workflow", "Workflow", 0, "Liste des résultats", None, None),
+]
+
+def source_cell(v):
+    """(valeur, format de nombre) d'une cellule de feuille source : comme df.to_excel puis
+    strip_times_in_worksheet. Format None = Standard."""
+    if v is None or pd.isna(v):
+        return "", None
+    if hasattr(v, "item") and not isinstance(v, (pd.Timestamp, dt.datetime, dt.date)):
+        v = v.item()  # scalaires numpy
+    if isinstance(v, (pd.Timestamp, dt.datetime)):
+        return v.date(), "dd/mm/yyyy"
+    if isinstance(v, dt.date):
+        return v, "YYYY-MM-DD"
+    if isinstance(v, str) and _DATETIME_TEXT_RE.match(v):
+        d = pd.to_datetime(v, dayfirst=True, errors="coerce")
+        if pd.notna(d):
+            return d.date(), "dd/mm/yyyy"
+    return v, None
+
+def _source_cell_value(ws, v):
+    """Valeur ou WriteOnlyCell (si format de date) pour une feuille source en écriture seule."""
+    from openpyxl.cell import WriteOnlyCell
+    value, fmt = source_cell(v)
+    if fmt is None:
+        return value
+    cell = WriteOnlyCell(ws, value=value); cell.number_format = fmt
+    return cell
+
+def _append_row(ws, row_no, values, height=None):
+    """append en écriture seule ; la hauteur de ligne n'est conservée que le temps d'écrire la ligne."""
+    if height is not None:
+        ws.row_dimensions[row_no].height = height
+    ws.append(values)
+    if height is not None:
+        del ws.row_dimensions[row_no]
+
+def spill_sources(store, files: dict, wanted, log=print):
+    """Lecture : sources utiles lues par blocs, nettoyées et déversées dans store (SpillStore).
+
+    Renvoie la largeur utile de Workflow (None si la feuille n'est pas lue)."""
+    wf_width = None
+    for key, name, skip, marker, clean, key_cols in OUT_OF_CORE_SOURCES:
+        paths = slot_paths(files.get(key))
+        if not paths or name not in needed_sources(wanted):
+            continue
+        log(f"Lecture/Nettoyage (hors mémoire) : {name}"
+            + (f" ({len(paths)} fichiers)" if len(paths) > 1 else ""))
+        seen, dropped = set(), 0  # empreintes des lignes des fichiers précédents (plusieurs fichiers)
+        # l'index d'un bloc est le numéro de ligne dans son fichier : décalé au-delà des fichiers
+        # précédents, il garde l'ordre de la réunion (fichier, puis ligne) lors de la fusion de Global
+        offset = 0
+        for path in paths:
+            reader = SheetChunkReader(path, skip_rows=skip, marker=marker)
+            current, last = set(), offset - 1
+            for chunk in reader:
+                if len(chunk):
+                    chunk.index = chunk.index + offset
+                    last = max(last, int(chunk.index.max()))
+                cleaned = clean(chunk) if clean else chunk
+                if name in store.columns and list(cleaned.columns) != store.columns[name]:
+                    cleaned = cleaned.reindex(columns=store.columns[name])  # disposition du premier fichier
+                if len(paths) > 1:
+                    hashes = [hash(k) for k in row_keys(cleaned)]
+                    keep = [h not in seen for h in hashes]
+                    current.update(hashes)
+                    if not all(keep):
+                        dropped += keep.count(False)
+                        cleaned = cleaned[keep]
+                if key_cols is None:  # Workflow : clé détectée d'après les noms de colonnes
+                    wf_bdc_col, _ = workflow_columns(list(cleaned.columns))
+                    key_cols = [wf_bdc_col] if wf_bdc_col is not None else []
+                store.append(name, cleaned, [cleaned[c] for c in key_cols])
+            seen |= current
+            offset = last + 1
+            if name == "Workflow":
+                wf_width = max(wf_width or 0, reader.max_width)
+        if dropped:
+            log(f"{name} : {dropped} ligne(s) déjà présente(s) dans un fichier précédent écartée(s)")
+        if name not in store.columns:  # pas d'entête : même résultat qu'un DataFrame vide en mode mémoire
+            empty = pd.DataFrame()
+            store.append(name, clean(empty) if clean else empty)
+    return wf_width
+
+def spill_global(store, engine=None):
+    """Jointures : Global calculée partition par partition (jointures BDC et agrégats Factures)
+    puis rangée dans store. engine : calcul de Global d'une partition (global_rows par défaut)."""
+    engine = engine or global_rows
+    for part in range(store.n):
+        sources = store.partition_sources(part)
+        if sources is not None:
+            store.add_global(part, GlobalTable.from_rows(engine(*sources)))
+    return store.global_rows
+
+def _stream_cover_sheet(wb):
+    from openpyxl.cell import WriteOnlyCell
+    ws = wb.create_sheet("Page de garde")
+    ws.column_dimensions["A"].width = 120
+    ws.freeze_panes = "A2"
+    cover_align = Alignment(wrap_text=True, vertical="top")
+    for row_idx, line in enumerate(GLOBAL_COVER_TEXT.splitlines(), start=1):
+        cell = WriteOnlyCell(ws, value=line); cell.alignment = cover_align
+        _append_row(ws, row_idx, [cell], height=18)
+
+def _stream_source_sheets(wb, store, wanted, wf_width, record=None, log=print):
+    """Feuilles sources écrites en flux depuis store, découpées au-delà de la limite de lignes d'Excel."""
+    for name in ["Commande", "Envoi BDC", "Constatation", "Factures", "Workflow"]:
+        if name not in store.columns or name not in wanted:
+            continue
+        columns = store.columns[name]
+        ncols = len(columns) if name != "Workflow" else min(len(columns), wf_width or len(columns))
+        dup = pd.Index(columns[:ncols]).duplicated(keep=False)
+        chunks = sheet_chunks(name, store.rows[name])
+
+        def next_sheet():
+            sheet_name, start, stop = chunks.pop(0)
+            log(f"Écriture de la feuille {sheet_name}")
+            ws = wb.create_sheet(sheet_name)
+            for pos in range(ncols):
+                # même calcul que autofit_worksheet (une colonne en double n'y compte que par son nom)
+                max_len = len(str(columns[pos])) if dup[pos] else store.widths[name][pos]
+                ws.column_dimensions[get_column_letter(pos + 1)].width = max(10, min(max_len + 2, 60))
+            ws.append([str(c) for c in columns[:ncols]])
+            return ws, stop - start
+
+        ws, room = next_sheet()
+        for frame in store.iter_frames(name, ncols):
+            for values in frame.itertuples(index=False, name=None):
+                if not room:  # tranche suivante (au-delà de la limite de lignes d'Excel)
+                    ws, room = next_sheet()
+                ws.append([_source_cell_value(ws, v) for v in values])
+                room -= 1
+            if record is not None:
+                record.add_source_frame(name, frame)
+
+def _stream_global_sheets(wb, store, record=None):
+    """Feuille(s) Global écrites en flux depuis les partitions fusionnées de store."""
+    from openpyxl.cell import WriteOnlyCell
+    global_chunks = sheet_chunks("Global", store.global_rows)
+
+    def next_global_sheet():
+        sheet_name, start, stop = global_chunks.pop(0)
+        ws = wb.create_sheet(sheet_name)
+        column_styles = setup_global_sheet(ws)
+        ws.append(global_header_cells(ws, WriteOnlyCell))
+        return ws, column_styles, stop - start
+
+    history_batch = []
+    ws, column_styles, room = next_global_sheet()
+    for _, row_values in store.iter_global():
+        if not room:
+            ws, column_styles, room = next_global_sheet()
+        room -= 1
+        if record is not None:
+            history_batch.append(row_values)
+            if len(history_batch) >= 5000:
+                record.add_global_rows(history_batch); history_batch = []
+        ws.append(global_cells(ws, row_values, column_styles, WriteOnlyCell))
+    if record is not None:
+        record.add_global_rows(history_batch)
+
+def run_out_of_core(files: dict, outfile: str, log=print, history=None, outputs=None):
+    """Consolidation à mémoire bornée : sources nettoyées par blocs et déversées sur disque,
+    Global calculé partition par partition (hachage du BDC), puis classeur écrit en flux.
+    outputs : feuilles à écrire (voir output_selection) ; seules les sources utiles sont lues."""
+    from openpyxl import Workbook
+    ensure_deps_loaded()
+    wanted = output_selection(outputs)
+    store = SpillStore()
+    record = None
+    if history is not None:
+        try:
+            record = history.start_run(outfile, files)
+        except Exception as exc:
+            log(f"Historique non mis à jour : {exc}")
+    try:
+        wf_width = spill_sources(store, files, wanted, log)
+        check_sheet_sizes(store.rows, log)
+        if "Commande" in store.columns and "Global" in wanted:
+            log("Calcul de Global par partitions (hors mémoire)")
+            spill_global(store)
+
+        log("Écriture en flux du classeur")
+        wb = Workbook(write_only=True)
+        _stream_cover_sheet(wb)
+        _stream_source_sheets(wb, store, wanted, wf_width, record, log)
+        if "Global" in wanted:
+            log("Création et remplissage de la feuille Global")
+            _stream_global_sheets(wb, store, record)
+        with atomic_output(outfile) as tmp:
+            wb.save(tmp)
+        if record is not None:
+            committed, record = record, None
+            if finish_history(committed, log):
+                log("Historique mis à jour")
+    finally:
+        if record is not None:
+            record.rollback()
+        store.close()
+
+# -------- Écriture XLSX parallèle --------
+# Moteur de sortie "xml" : le XML de chaque feuille est produit par des processus séparés
+# (fichiers temporaires), puis le paquet zip est assemblé en une passe avec le niveau de
+# compression choisi. Le résultat est le même classeur qu'avec openpyxl (valeurs, formats,
+# polices, alignements, largeurs, hauteurs, volets figés, mise en page).
+OUTPUT_ENGINE = os.environ.get("NETTOIEXLSX_OUTPUT", "openpyxl")   # "openpyxl", "xml" ou "xlsxwriter"
+OUTPUT_DEFLATE_LEVEL = int(os.environ.get("NETTOIEXLSX_DEFLATE", "6"))  # 0 (rapide) … 9 (compact)
+OUTPUT_WORKERS = None  # None : un processus par feuille, dans la limite des cœurs
+# Table de chaînes partagées : chaque texte répété (fournisseurs, statuts, "Pas de SF connu"…) n'est
+# stocké qu'une fois pour tout le classeur ; False : chaînes en ligne comme openpyxl.
+OUTPUT_SHARED_STRINGS = os.environ.get("NETTOIEXLSX_SHARED_STRINGS", "1") not in ("0", "off", "false")
+# Modèle de classeur (page de garde, en-tête de Global, styles) généré une fois et mis en cache sur disque
+OUTPUT_TEMPLATE = os.environ.get("NETTOIEXLSX_TEMPLATE", "1") not in ("0", "off", "false")
+
+_SHEET_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+# Styles de cellule (index cellXfs de styles.xml) : police, format de nombre, alignement
+XS_DEFAULT, XS_DATE, XS_DATE_ISO, XS_COVER, XS_HEADER, XS_BODY, XS_BODY_TEXT, XS_BODY_DATE, XS_BODY_AMOUNT = range(9)
+_STYLES_XML = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="{_SHEET_MAIN_NS}">
+<numFmts count="2"><numFmt numFmtId="164" formatCode="dd/mm/yyyy"/><numFmt numFmtId="165" formatCode="YYYY-MM-DD"/></numFmts>
+<fonts count="3"><font><sz val="11"/><color theme="1"/><name val="Calibri"/><family val="2"/><scheme val="minor"/></font><font><name val="Calibri"/><sz val="12"/></font><font><name val="Calibri"/><sz val="9"/></font></fonts>
+<fills count="2"><fill><patternFill/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="9">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0" applyAlignment="1"><alignment vertical="top" wrapText="1"/></xf>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="49" fontId="2" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="164" fontId="2" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="2" fontId="2" fillId="0" borderId="0" xfId="0" applyNumberFormat="1" applyFont="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+_SOURCE_STYLES = {None: XS_DEFAULT, "dd/mm/yyyy": XS_DATE, "YYYY-MM-DD": XS_DATE_ISO}
+_GLOBAL_STYLES = {None: XS_BODY, "@": XS_BODY_TEXT, "dd/mm/yyyy": XS_BODY_DATE, "0.00": XS_BODY_AMOUNT}
+_GLOBAL_COLUMN_STYLES = [_GLOBAL_STYLES[GLOBAL_COLUMN_FORMATS.get(i)] for i in range(1, len(GLOBAL_COLUMN_WIDTHS) + 1)]
+
+def use_xml_writer() -> bool:
+    return (OUTPUT_ENGINE or "openpyxl").lower() == "xml"
+
+def _xml_text(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+def _is_plain_text(text: str) -> bool:
+    """Texte écrit comme chaîne (ni formule, ni code d'erreur Excel)."""
+    from openpyxl.cell.cell import ERROR_CODES
+    return text != "" and not (text.startswith("=") and len(text) > 1) and text not in ERROR_CODES
+
+class _XmlCells:
+    """Éléments <c> tels qu'openpyxl les écrit (nombres au format %.16g) ; textes en ligne ou,
+    s'ils figurent dans sst ({texte: indice}), par référence à la table de chaînes partagées."""
+
+    def __init__(self, sst: dict | None = None):
+        from openpyxl.cell.cell import ERROR_CODES, ILLEGAL_CHARACTERS_RE
+        from openpyxl.utils.datetime import to_excel
+        self.sst = sst or {}
+        self.error_codes = ERROR_CODES
+        self.illegal = ILLEGAL_CHARACTERS_RE
+        self.to_excel = to_excel
+
+    def cell(self, ref: str, value, style: int) -> str:
+        import math
+        s = f' s="{style}"' if style else ""
+        if value is None or (isinstance(value, str) and value == ""):
+            return f'<c r="{ref}"{s}/>' if style else ""
+        if isinstance(value, str):
+            idx = self.sst.get(value)
+            if idx is not None:
+                return f'<c r="{ref}"{s} t="s"><v>{idx}</v></c>'
+        elif isinstance(value, bool):
+            return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+        elif isinstance(value, (int, float, Decimal)):
+            text = "" if math.isnan(value) or math.isinf(value) else "%.16g" % value
+            return f'<c r="{ref}"{s} t="n"><v>{text}</v></c>'
+        elif isinstance(value, (dt.datetime, dt.date, dt.time)):
+            return f'<c r="{ref}"{s} t="n"><v>{"%.16g" % self.to_excel(value)}</v></c>'
+        text = str(value)
+        if self.illegal.search(text):
+            from openpyxl.utils.exceptions import IllegalCharacterError
+            raise IllegalCharacterError(f"{text!r} cannot be used in worksheets.")
+        if text.startswith("=") and len(text) > 1:
+            return f'<c r="{ref}"{s}><f>{_xml_text(text[1:])}</f><v></v></c>'
+        if text in self.error_codes:
+            return f'<c r="{ref}"{s} t="e"><v>{_xml_text(text)}</v></c>'
+        return f'<c r="{ref}"{s} t="inlineStr"><is>{_xml_t(text)}</is></c>'
+
+def _xml_t(text: str) -> str:
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f"<t{space}>{_xml_text(text)}</t>"
+
+def _sheet_strings(spec: dict) -> list:
+    """Textes candidats à la table de chaînes partagées pour une feuille (sans doublon)."""
+    kind = spec["kind"]
+    if kind == "cover":
+        found = GLOBAL_COVER_TEXT.splitlines()
+    elif kind == "source":
+        ncols = spec["ncols"]
+        found = [str(c) for c in spec["columns"][:ncols]]
+        df = spec["data"]
+        for pos in range(ncols):
+            col = df.iloc[:, pos]
+            if col.dtype == object or pd.api.types.is_string_dtype(col.dtype):
+                found.extend(v for v in col.dropna().unique() if isinstance(v, str) and not _DATETIME_TEXT_RE.match(v))
+    else:
+        found = list(GLOBAL_HEADERS) if spec.get("first_row", 1) == 1 else []
+        found.extend(spec["data"].strings())
+    return [t for t in dict.fromkeys(found) if _is_plain_text(t)]
+
+def _sheet_rows(spec: dict):
+    """(hauteur, [(valeur, style), …]) des lignes d'une feuille décrite par spec (moteurs xml et xlsxwriter)."""
+    kind = spec["kind"]
+    if kind == "cover":
+        for line in GLOBAL_COVER_TEXT.splitlines():
+            yield 18, [(line, XS_COVER)]
+    elif kind == "source":
+        ncols = spec["ncols"]
+        yield None, [(str(c), XS_DEFAULT) for c in spec["columns"][:ncols]]
+        for values in spec["data"].itertuples(index=False, name=None):
+            cells = []
+            for v in values[:ncols]:
+                value, fmt = source_cell(v)
+                cells.append((value, _SOURCE_STYLES[fmt]))
+            yield None, cells
+    elif kind == "global":
+        # hauteur par défaut de la feuille (spec row_height), style de cellule = style de colonne
+        if spec.get("first_row", 1) == 1:  # sinon l'en-tête vient du modèle
+            yield None, [(h, XS_HEADER) for h in GLOBAL_HEADERS]
+        for row_values in spec["data"]:
+            yield None, list(zip(row_values, _GLOBAL_COLUMN_STYLES))
+
+def write_sheet_xml_part(spec: dict, path: str):
+    """Écrit <sheetData> de la feuille dans path ; renvoie (dernière ligne, dernière colonne).
+
+    Exécutée dans un processus de travail : ne dépend que de spec (données picklables)."""
+    from openpyxl.utils import get_column_letter as column_letter
+    ensure_deps_loaded()
+    cells_xml = _XmlCells(spec.get("sst"))
+    letters = []
+    max_row = max_col = 0
+    with open(path, "w", encoding="utf-8") as fh:
+        buf = []
+        for row_no, (height, cells) in enumerate(_sheet_rows(spec), start=spec.get("first_row", 1)):
+            while len(letters) < len(cells):
+                letters.append(column_letter(len(letters) + 1))
+            xml_cells = "".join(cells_xml.cell(f"{letters[i]}{row_no}", v, st) for i, (v, st) in enumerate(cells))
+            attrs = f' ht="{height}" customHeight="1"' if height is not None else ""
+            buf.append(f'<row r="{row_no}"{attrs}>{xml_cells}</row>')
+            max_row, max_col = row_no, max(max_col, len(cells))
+            if len(buf) >= 2000:
+                fh.write("".join(buf)); buf = []
+        fh.write("".join(buf))
+    return max_row, max_col
+
+def _sheet_xml_head(spec: dict, max_row: int, max_col: int, selected: bool) -> str:
+    from openpyxl.utils import get_column_letter as column_letter
+    dimension = f"A1:{column_letter(max(max_col, 1))}{max(max_row, 1)}"
+    view = '<sheetView workbookViewId="0"' + (' tabSelected="1"' if selected else "")
+    if spec.get("freeze") == "A2":
+        view += ('><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                 '<selection pane="bottomLeft" activeCell="A2" sqref="A2"/></sheetView>')
+    else:
+        view += '><selection activeCell="A1" sqref="A1"/></sheetView>'
+    col_styles = spec.get("col_styles") or {}
+    cols = "".join(f'<col min="{i}" max="{i}" width="{"%.16g" % w}" customWidth="1"'
+                   + (f' style="{col_styles[i]}"/>' if i in col_styles else "/>")
+                   for i, w in spec.get("widths", []))
+    row_height = spec.get("row_height")
+    sheet_format = (f'<sheetFormatPr baseColWidth="8" defaultRowHeight="{row_height}" customHeight="1"/>'
+                    if row_height else '<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>')
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<worksheet xmlns="{_SHEET_MAIN_NS}" xmlns:r="{_REL_NS}">'
+            f'<sheetPr><outlinePr summaryBelow="1" summaryRight="1"/><pageSetUpPr/></sheetPr>'
+            f'<dimension ref="{dimension}"/><sheetViews>{view}</sheetViews>'
+            + sheet_format + (f"<cols>{cols}</cols>" if cols else "") + "<sheetData>")
+
+def _sheet_xml_tail(spec: dict) -> str:
+    left, right = spec.get("margins", (0.75, 0.75))
+    tail = f'</sheetData><pageMargins left="{left}" right="{right}" top="1" bottom="1" header="0.5" footer="0.5"/>'
+    if spec.get("landscape"):
+        tail += '<pageSetup orientation="landscape"/>'
+    return tail + "</worksheet>"
+
+_HIDDEN_STATE = ' state="hidden"'
+
+def _package_parts(names: list, shared_strings: bool = False, hidden=()) -> dict:
+    """Parties fixes du paquet (types, relations, classeur, styles, propriétés) ; hidden : feuilles masquées."""
+    now = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    sst_type = ('<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+                'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>' if shared_strings else "")
+    sst_rel = (f'<Relationship Id="rId{len(names) + 2}" Type="{_REL_NS}/sharedStrings" '
+               'Target="sharedStrings.xml"/>' if shared_strings else "")
+    sheet_types = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(names) + 1))
+    sheets = "".join(f'<sheet name="{_xml_text(n)}" sheetId="{i}"{_HIDDEN_STATE if n in hidden else ""} r:id="rId{i}"/>'
+                     for i, n in enumerate(names, start=1))
+    sheet_rels = "".join(
+        f'<Relationship Id="rId{i}" Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(names) + 1))
+    head = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    pkg_rels = "http://schemas.openxmlformats.org/package/2006/relationships"
+    return {
+        "[Content_Types].xml": head +
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+            '<Override PartName="/docProps/app.xml" ContentType="application/vnd.openxmlformats-officedocument.extended-properties+xml"/>'
+            + sheet_types + sst_type + "</Types>",
+        "_rels/.rels": head +
+            f'<Relationships xmlns="{pkg_rels}">'
+            f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>'
+            f'<Relationship Id="rId3" Type="{_REL_NS}/extended-properties" Target="docProps/app.xml"/>'
+            "</Relationships>",
+        "docProps/app.xml": head +
+            '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+            "<Application>NettoieXLSX</Application></Properties>",
+        "docProps/core.xml": head +
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+            'xmlns:dcterms="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            f'<dcterms:created xsi:type="dcterms:W3CDTF">{now}</dcterms:created>'
+            f'<dcterms:modified xsi:type="dcterms:W3CDTF">{now}</dcterms:modified></cp:coreProperties>',
+        "xl/workbook.xml": head +
+            f'<workbook xmlns="{_SHEET_MAIN_NS}" xmlns:r="{_REL_NS}"><workbookPr/>'
+            '<bookViews><workbookView activeTab="0"/></bookViews>'
+            f'<sheets>{sheets}</sheets><calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>',
+        "xl/_rels/workbook.xml.rels": head +
+            f'<Relationships xmlns="{pkg_rels}">{sheet_rels}'
+            f'<Relationship Id="rId{len(names) + 1}" Type="{_REL_NS}/styles" Target="styles.xml"/>{sst_rel}</Relationships>',
+        "xl/styles.xml": _STYLES_XML,
+    }
+
+def write_workbook_xml(outfile: str, specs: list, log=print):
+    """Classeur complet à partir des descriptions de feuilles (voir _consolidation_specs)."""
+    import shutil
+    import tempfile
+    import zipfile
+    template = load_template(log) if OUTPUT_TEMPLATE and specs and specs[0]["kind"] == "cover" else None
+    if template is not None:
+        # parties statiques copiées telles quelles : la page de garde n'est plus sérialisée,
+        # Global ne produit que ses lignes de données
+        specs = [dict(spec, first_row=2) if spec["kind"] == "global" else spec for spec in specs[1:]]
+        names = ["Page de garde"] + [spec["name"] for spec in specs]
+    else:
+        names = [spec["name"] for spec in specs]
+    workdir = tempfile.mkdtemp(prefix="nettoiexlsx_xml_")
+    try:
+        strings = {}
+        if OUTPUT_SHARED_STRINGS:
+            # indices attribués ici, une fois pour le classeur ; chaque processus reçoit ceux de sa feuille
+            with_sst = []
+            for spec in specs:
+                found = _sheet_strings(spec)
+                for text in found:
+                    strings.setdefault(text, len(strings))
+                with_sst.append(dict(spec, sst={text: strings[text] for text in found}))
+            specs = with_sst
+        parts = [os.path.join(workdir, f"sheet{i}.xml") for i in range(1, len(specs) + 1)]
+        workers = OUTPUT_WORKERS or min(len(specs), os.cpu_count() or 1)
+        if workers > 1:
+            log(f"Sérialisation des feuilles ({workers} processus)")
+            with process_pool(workers) as pool:
+                sizes = list(pool.map(write_sheet_xml_part, specs, parts))
+        else:
+            sizes = [write_sheet_xml_part(spec, path) for spec, path in zip(specs, parts)]
+
+        log(f"Assemblage du classeur (compression {OUTPUT_DEFLATE_LEVEL})")
+        with zipfile.ZipFile(outfile, "w", compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=OUTPUT_DEFLATE_LEVEL) as zf:
+            hidden = {spec["name"] for spec in specs if spec.get("hidden")}
+            for arcname, xml in _package_parts(names, bool(strings), hidden).items():
+                zf.writestr(arcname, template["xl/styles.xml"] if template and arcname == "xl/styles.xml" else xml)
+            if strings:
+                with zf.open("xl/sharedStrings.xml", "w", force_zip64=True) as dst:
+                    dst.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                              f'<sst xmlns="{_SHEET_MAIN_NS}" uniqueCount="{len(strings)}">'.encode("utf-8"))
+                    batch = []
+                    for text in strings:
+                        batch.append(f"<si>{_xml_t(text)}</si>")
+                        if len(batch) >= 10000:
+                            dst.write("".join(batch).encode("utf-8")); batch = []
+                    dst.write(("".join(batch) + "</sst>").encode("utf-8"))
+            offset = 1
+            if template is not None:
+                zf.writestr("xl/worksheets/sheet1.xml", template["cover"])
+                offset = 2
+            for i, (spec, path, (max_row, max_col)) in enumerate(zip(specs, parts, sizes), start=offset):
+                with zf.open(f"xl/worksheets/sheet{i}.xml", "w", force_zip64=True) as dst:
+                    if spec.get("first_row", 1) > 1:
+                        head, tail = template["global"]
+                        dst.write(head.replace(b'<dimension ref="A1:K1"/>',
+                                               f'<dimension ref="A1:K{max(max_row, 1)}"/>'.encode("ascii"), 1))
+                    else:
+                        head, tail = _sheet_xml_head(spec, max_row, max_col, selected=(i == 1)).encode("utf-8"), None
+                        dst.write(head)
+                    with open(path, "rb") as src:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                    dst.write(tail if tail is not None else _sheet_xml_tail(spec).encode("utf-8"))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# -------- Modèle de classeur (page de garde, en-tête de Global) --------
+# Les parties statiques du classeur sont produites une fois dans un classeur modèle (valide, ouvrable
+# dans Excel) rangé dans le dossier de données ; son nom porte la version et une empreinte des textes,
+# largeurs et styles, de sorte qu'une modification du script en produit un nouveau.
+TEMPLATE_VERSION = 1
+_TEMPLATES = {}  # chemin -> parties lues (service et surveillance : lu une fois par processus)
+
+def app_data_dir() -> str:
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "NettoieXLSX")
+
+def template_path() -> str:
+    import hashlib
+    key = repr((GLOBAL_COVER_TEXT, GLOBAL_HEADERS, GLOBAL_COLUMN_WIDTHS, GLOBAL_WIDTH_OFFSET,
+                GLOBAL_ROW_HEIGHT, GLOBAL_COLUMN_FORMATS, _STYLES_XML))
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    folder = os.environ.get("NETTOIEXLSX_TEMPLATE_DIR") or app_data_dir()
+    return os.path.join(folder, f"modele-v{TEMPLATE_VERSION}-{digest}.xlsx")
+
+def build_template(path: str):
+    """Classeur modèle : page de garde et Global réduite à son en-tête, en chaînes en ligne."""
+    import tempfile
+    import zipfile
+    specs = _consolidation_specs({}, [], GlobalTable.from_rows([]), log=lambda msg: None)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".xlsx", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for arcname, xml in _package_parts([spec["name"] for spec in specs]).items():
+                zf.writestr(arcname, xml)
+            for i, spec in enumerate(specs, start=1):
+                part = tmp + f".sheet{i}"
+                try:
+                    max_row, max_col = write_sheet_xml_part(spec, part)
+                    with open(part, encoding="utf-8") as fh:
+                        rows = fh.read()
+                finally:
+                    if os.path.exists(part):
+                        os.remove(part)
+                zf.writestr(f"xl/worksheets/sheet{i}.xml", _sheet_xml_head(spec, max_row, max_col, selected=(i == 1))
+                            + rows + _sheet_xml_tail(spec))
+        os.replace(tmp, path)  # un autre processus peut générer le même modèle en même temps
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def load_template(log=print):
+    """Parties statiques du modèle (généré au besoin) ; None si le modèle est inutilisable."""
+    import zipfile
+    path = template_path()
+    parts = _TEMPLATES.get(path)
+    if parts is not None:
+        return parts
+    try:
+        if not os.path.exists(path):
+            log("Génération du modèle de classeur")
+            build_template(path)
+        with zipfile.ZipFile(path) as zf:
+            global_xml = zf.read("xl/worksheets/sheet2.xml")
+            head, _, tail = global_xml.partition(b"</sheetData>")
+            parts = {"xl/styles.xml": zf.read("xl/styles.xml"),
+                     "cover": zf.read("xl/worksheets/sheet1.xml"),
+                     "global": (head, b"</sheetData>" + tail)}
+    except (OSError, KeyError, zipfile.BadZipFile) as e:
+        log(f"Modèle de classeur indisponible ({e}) : parties statiques générées")
+        return None
+    _TEMPLATES[path] = parts
+    return parts
+
+# -------- Sortie xlsxwriter (optionnelle) --------
+# Moteur de sortie "xlsxwriter" en mode constant_memory : chaque ligne est écrite puis vidée sur
+# disque ; largeurs et formats de date sont décidés avant l'écriture, sans relire la feuille.
+# La mémoire de pointe ne dépend plus de la taille cumulée des feuilles écrites.
+_XLSXWRITER_AVAILABLE = importlib.util.find_spec("xlsxwriter") is not None
+
+def use_xlsxwriter() -> bool:
+    return (OUTPUT_ENGINE or "").lower() == "xlsxwriter" and _XLSXWRITER_AVAILABLE
+
+def _xlsxwriter_formats(wb) -> dict:
+    """Formats xlsxwriter équivalents aux styles XS_* de l'assembleur XML."""
+    center = {"font_name": "Calibri", "align": "center", "valign": "vcenter"}
+    return {
+        XS_DEFAULT: None,
+        XS_DATE: wb.add_format({"num_format": "dd/mm/yyyy"}),
+        XS_DATE_ISO: wb.add_format({"num_format": "YYYY-MM-DD"}),
+        XS_COVER: wb.add_format({"text_wrap": True, "valign": "top"}),
+        XS_HEADER: wb.add_format({**center, "font_size": 12}),
+        XS_BODY: wb.add_format({**center, "font_size": 9}),
+        XS_BODY_TEXT: wb.add_format({**center, "font_size": 9, "num_format": "@"}),
+        XS_BODY_DATE: wb.add_format({**center, "font_size": 9, "num_format": "dd/mm/yyyy"}),
+        XS_BODY_AMOUNT: wb.add_format({**center, "font_size": 9, "num_format": "0.00"}),
+    }
+
+def _xlsxwriter_cell(ws, r: int, c: int, value, fmt):
+    import math
+    if value is None or (isinstance(value, str) and value == ""):
+        if fmt is not None:
+            ws.write_blank(r, c, None, fmt)
+    elif isinstance(value, bool):
+        ws.write_boolean(r, c, value, fmt)
+    elif isinstance(value, (int, float, Decimal)):
+        if math.isnan(value) or math.isinf(value):
+            ws.write_blank(r, c, None, fmt)
+        else:
+            ws.write_number(r, c, value, fmt)
+    elif isinstance(value, (dt.datetime, dt.date, dt.time)):
+        ws.write_datetime(r, c, value, fmt)
+    else:
+        text = str(value)
+        if text.startswith("=") and len(text) > 1:
+            ws.write_formula(r, c, text, fmt)
+        else:
+            ws.write_string(r, c, text, fmt)
+
+def write_workbook_xlsxwriter(outfile: str, specs: list, log=print):
+    """Classeur complet (xlsxwriter, constant_memory) à partir des descriptions de feuilles."""
+    import xlsxwriter
+    wb = xlsxwriter.Workbook(outfile, {"constant_memory": True})
+    try:
+        formats = _xlsxwriter_formats(wb)
+        for spec in specs:
+            log(f"Écriture de la feuille {spec['name']}")
+            ws = wb.add_worksheet(spec["name"])
+            if spec.get("hidden"):
+                ws.hide()
+            col_styles = spec.get("col_styles") or {}
+            for i, width in spec.get("widths", []):
+                # xlsxwriter ajoute la marge de cellule (5 px) à la largeur : on la retire pour
+                # enregistrer la même largeur qu'openpyxl (au pixel près, chiffre de 7 px)
+                ws.set_column(i - 1, i - 1, (width * 7 - 5) / 7, formats[col_styles[i]] if i in col_styles else None)
+            if spec.get("row_height"):
+                ws.set_default_row(spec["row_height"])
+            if spec.get("freeze") == "A2":
+                ws.freeze_panes(1, 0)
+            if spec.get("landscape"):
+                ws.set_landscape()
+            left, right = spec.get("margins", (0.75, 0.75))  # marges par défaut d'openpyxl
+            ws.set_margins(left=left, right=right, top=1, bottom=1)
+            ws.set_header("", {"margin": 0.5})
+            ws.set_footer("", {"margin": 0.5})
+            for r, (height, cells) in enumerate(_sheet_rows(spec)):
+                if height is not None:
+                    ws.set_row(r, height)
+                for c, (value, style) in enumerate(cells):
+                    _xlsxwriter_cell(ws, r, c, value, formats[style])
+    finally:
+        wb.close()
+
+# -------- Historique des BDC (SQLite) --------
+# Sur demande (NETTOIEXLSX_HISTORY=1 ou --history), chaque traitement ajoute ses sources nettoyées
+# et ses lignes Global dans une base locale, interrogeable par BDC sans rouvrir les anciens exports.
+# Les lignes sont d'abord écrites dans une base de travail propre au traitement puis recopiées en
+# une seule transaction courte à la fin : plusieurs traitements (lots, service, surveillance)
+# peuvent alimenter la même base sans se bloquer. Les traitements plus anciens que
+# HISTORY_RETENTION_DAYS sont purgés à chaque enregistrement.
+HISTORY_ENABLED = os.environ.get("NETTOIEXLSX_HISTORY", "0") not in ("0", "off", "false", "")
+HISTORY_RETENTION_DAYS = int(os.environ.get("NETTOIEXLSX_HISTORY_JOURS", "180"))  # 0 : pas de purge
+
+def default_history_path() -> str:
+    return os.environ.get("NETTOIEXLSX_HISTORY_DB") or os.path.join(app_data_dir(), "historique.sqlite")
+
+GLOBAL_HISTORY_COLUMNS = ["bdc", "objet", "fournisseur", "ht", "visa", "envoye", "sf", "workflow", "paye", "solde", "statut"]
+
+# Colonne BDC de chaque feuille source (Workflow : détectée d'après les noms de colonnes)
+SOURCE_BDC_COLUMNS = {"Commande": "N° commande", "Envoi BDC": "Commande", "Constatation": "Commande",
+                      "Factures": "N° commande", "Workflow": None}
+
+_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_at TEXT NOT NULL,
+    outfile TEXT,
+    files TEXT
+);
+CREATE TABLE IF NOT EXISTS global_rows (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    run_at TEXT NOT NULL,
+    row_no INTEGER NOT NULL,
+    bdc TEXT, objet, fournisseur, ht, visa, envoye, sf, workflow, paye, solde REAL, statut
+);
+CREATE INDEX IF NOT EXISTS idx_global_bdc ON global_rows (bdc, run_at);
+CREATE INDEX IF NOT EXISTS idx_global_run_at ON global_rows (run_at);
+CREATE TABLE IF NOT EXISTS source_rows (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    run_at TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    row_no INTEGER NOT NULL,
+    bdc TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_source_bdc ON source_rows (bdc, run_at);
+CREATE INDEX IF NOT EXISTS idx_source_run_at ON source_rows (run_at);
+"""
+
+def _history_value(v):
+    """Valeur stockée : texte affiché pour les dates, nombres tels quels, NULL pour les vides."""
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return None
+    if isinstance(v, (pd.Timestamp, dt.datetime, dt.date)):
+        return date_to_text_dmy(v)
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, (int, float)):
+        return v.item() if hasattr(v, "item") else v
+    if isinstance(v, Decimal):
+        return format(v, "f")
+    return str(v)
+
+_STAGING_SCHEMA = f"""
+CREATE TABLE global_rows (row_no INTEGER NOT NULL, {', '.join(GLOBAL_HISTORY_COLUMNS)});
+CREATE TABLE source_rows (sheet TEXT NOT NULL, row_no INTEGER NOT NULL, bdc TEXT, data TEXT NOT NULL);
+"""
+
+class HistoryRun:
+    """Un traitement en cours d'enregistrement.
+
+    Les lignes sont écrites dans une base de travail temporaire (aucun verrou sur la base
+    d'historique) ; commit() les recopie dans l'historique en une transaction, rollback() les
+    abandonne. Après une première erreur d'écriture, les ajouts sont ignorés et commit() la relève."""
+
+    def __init__(self, history, outfile, files, run_at):
+        import sqlite3
+        import tempfile
+        self.history = history
+        self.outfile = outfile
+        self.files = files
+        self.run_at = run_at
+        self.error = None
+        fd, self.staging_path = tempfile.mkstemp(prefix="nettoiexlsx_hist_", suffix=".sqlite")
+        os.close(fd)
+        self.conn = sqlite3.connect(self.staging_path)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.executescript(_STAGING_SCHEMA)
+        self._global_row_no = 0
+        self._source_row_no = {}
+
+    def _insert(self, sql, params):
+        if self.error is not None:
+            return
+        try:
+            self.conn.executemany(sql, params)
+        except Exception as exc:
+            self.error = exc
+
+    def add_source_frame(self, sheet, df):
+        import json
+        if df is None or df.empty or self.error is not None:
+            return
+        bdc_col = SOURCE_BDC_COLUMNS.get(sheet)
+        if sheet == "Workflow":
+            bdc_col, _ = workflow_columns(list(df.columns))
+        columns = [str(c) for c in df.columns]
+        bdc_pos = list(df.columns).index(bdc_col) if bdc_col in df.columns else None
+        start = self._source_row_no.get(sheet, 0)
+        params = []
+        for offset, values in enumerate(df.itertuples(index=False, name=None), start=1):
+            data = json.dumps({c: _history_value(v) for c, v in zip(columns, values)}, ensure_ascii=False)
+            bdc = str(values[bdc_pos]).strip() if bdc_pos is not None else None
+            params.append((sheet, start + offset, bdc, data))
+        self._source_row_no[sheet] = start + len(params)
+        self._insert("INSERT INTO source_rows (sheet, row_no, bdc, data) VALUES (?, ?, ?, ?)", params)
+
+    def add_global_rows(self, rows):
+        params = []
+        for values in rows:
+            self._global_row_no += 1
+            params.append((self._global_row_no, *(_history_value(v) for v in values)))
+        placeholders = ", ".join("?" * (1 + len(GLOBAL_HISTORY_COLUMNS)))
+        self._insert(f"INSERT INTO global_rows (row_no, {', '.join(GLOBAL_HISTORY_COLUMNS)}) VALUES ({placeholders})",
+                     params)
+
+    def commit(self):
+        """Recopie le traitement dans l'historique (transaction courte) puis purge les anciens."""
+        try:
+            if self.error is not None:
+                raise self.error
+            self.conn.commit()
+            self.conn.close()
+            self.history.import_run(self.staging_path, self.outfile, self.files, self.run_at)
+        finally:
+            self.rollback()
+
+    def rollback(self):
+        self.conn.close()
+        try:
+            os.remove(self.staging_path)
+        except OSError:
+            pass
+
+class BdcHistory:
+    """Base d'historique des traitements (SQLite, index sur BDC et date de traitement)."""
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_history_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_HISTORY_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        import sqlite3
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start_run(self, outfile: str, files: dict) -> HistoryRun:
+        return HistoryRun(self, outfile, files, dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    def import_run(self, staging_path: str, outfile: str, files: dict, run_at: str):
+        """Ajoute le traitement préparé dans staging_path (voir HistoryRun) et purge les traitements
+        au-delà de HISTORY_RETENTION_DAYS, en une transaction."""
+        import json
+        conn = self._connect()
+        try:
+            conn.execute("ATTACH DATABASE ? AS staging", (staging_path,))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                run_id = conn.execute("INSERT INTO runs (run_at, outfile, files) VALUES (?, ?, ?)",
+                                      (run_at, outfile, json.dumps(files, ensure_ascii=False))).lastrowid
+                columns = ", ".join(GLOBAL_HISTORY_COLUMNS)
+                conn.execute(f"INSERT INTO global_rows (run_id, run_at, row_no, {columns}) "
+                             f"SELECT ?, ?, row_no, {columns} FROM staging.global_rows ORDER BY row_no",
+                             (run_id, run_at))
+                conn.execute("INSERT INTO source_rows (run_id, run_at, sheet, row_no, bdc, data) "
+                             "SELECT ?, ?, sheet, row_no, bdc, data FROM staging.source_rows ORDER BY rowid",
+                             (run_id, run_at))
+                if HISTORY_RETENTION_DAYS > 0:
+                    self._prune(conn, dt.datetime.now() - dt.timedelta(days=HISTORY_RETENTION_DAYS))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            conn.execute("DETACH DATABASE staging")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _prune(conn, before: dt.datetime):
+        cutoff = before.strftime("%Y-%m-%d %H:%M:%S")
+        for table in ("global_rows", "source_rows", "runs"):
+            conn.execute(f"DELETE FROM {table} WHERE run_at < ?", (cutoff,))
+
+    def _query(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return [dict(r) for r in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def runs(self) -> list:
+        return self._query("SELECT run_id, run_at, outfile, files FROM runs ORDER BY run_at, run_id")
+
+    def global_history(self, bdc) -> list:
+        """Lignes Global du BDC, traitement par traitement (du plus ancien au plus récent)."""
+        return self._query(
+            f"SELECT run_id, run_at, {', '.join(GLOBAL_HISTORY_COLUMNS)} FROM global_rows "
+            "WHERE bdc = ? ORDER BY run_at, run_id, row_no", (str(bdc).strip(),))
+
+    def source_rows(self, bdc, sheet: str | None = None) -> list:
+        import json
+        sql = "SELECT run_id, run_at, sheet, row_no, data FROM source_rows WHERE bdc = ?"
+        params = [str(bdc).strip()]
+        if sheet:
+            sql += " AND sheet = ?"; params.append(sheet)
+        rows = self._query(sql + " ORDER BY run_at, run_id, sheet, row_no", params)
+        for r in rows:
+            r["data"] = json.loads(r["data"])
+        return rows
+
+    def first_payment(self, bdc):
+        """Premier traitement où PAYE n'est plus 'pas de paiement connu' : (date du traitement, PAYE) ou None."""
+        for row in self.global_history(bdc):
+            if row["paye"] not in (None, "", "pas de paiement connu"):
+                return row["run_at"], row["paye"]
+        return None
+
+    def describe(self, bdc) -> list:
+        """Résumé texte de l'historique d'un BDC (Journal / ligne de commande)."""
+        history = self.global_history(bdc)
+        if not history:
+            return [f"BDC {bdc} : absent de l'historique ({self.path})"]
+        lines = [f"BDC {bdc} : {len(history)} ligne(s) Global sur {len({r['run_id'] for r in history})} traitement(s)"]
+        for r in history:
+            lines.append(f"  {r['run_at']} | PAYE {r['paye']} | SOLDE {r['solde']} | WORKFLOW {r['workflow'] or ''} | STATUT {r['statut']}")
+        paid = self.first_payment(bdc)
+        if paid:
+            lines.append(f"  Paiement connu depuis le traitement du {paid[0]} ({paid[1]})")
+        return lines
+
+def open_history(log=print):
+    """Base d'historique par défaut, ou None si désactivée ou inaccessible (le traitement continue)."""
+    if not HISTORY_ENABLED:
+        return None
+    try:
+        return BdcHistory()
+    except Exception as exc:
+        log(f"Historique indisponible : {exc}")
+        return None
+
+# -------- Fichier de sortie --------
+# Contrôle préalable (avant toute lecture) puis écriture atomique : le classeur est écrit dans un
+# fichier temporaire du même dossier, synchronisé sur disque puis renommé. Un arrêt en cours de
+# route laisse l'ancien fichier intact, jamais un classeur tronqué.
+_UMASK_LOCK = threading.Lock()
+
+def _read_umask() -> int:
+    """umask du processus. os.umask ne sait que le remplacer : le lire le modifie un instant pour
+    tout le processus, d'où une seule lecture, à l'import, sous verrou."""
+    with _UMASK_LOCK:
+        umask = os.umask(0)
+        os.umask(umask)
+    return umask
+
+PROCESS_UMASK = _read_umask()
+
+def output_problem(outfile: str) -> str | None:
+    """Raison pour laquelle outfile ne pourra pas être écrit (None : rien à signaler)."""
+    import tempfile
+    folder = os.path.dirname(os.path.abspath(outfile))
+    if not os.path.isdir(folder):
+        return f"dossier introuvable : {folder}"
+    if os.path.isdir(outfile):
+        return f"{outfile} est un dossier"
+    try:
+        fd, probe = tempfile.mkstemp(prefix=".~nettoiexlsx.", suffix=".tmp", dir=folder)
+        os.close(fd); os.remove(probe)
+    except OSError as e:
+        return f"dossier non accessible en écriture : {folder} ({e.strerror})"
+    if os.path.exists(outfile):
+        try:
+            with open(outfile, "r+b"):  # refusé tant qu'Excel garde le classeur ouvert
+                pass
+        except OSError as e:
+            return f"{os.path.basename(outfile)} est ouvert dans Excel ou protégé en écriture ({e.strerror})"
+    return None
+
+def check_output(outfile: str):
+    problem = output_problem(outfile)
+    if problem:
+        raise PermissionError(f"Fichier de sortie inutilisable : {problem}")
+
+@contextlib.contextmanager
+def atomic_output(outfile: str):
+    """with atomic_output(outfile) as tmp : écrire dans tmp ; remplace outfile en cas de succès."""
+    import tempfile
+    folder = os.path.dirname(os.path.abspath(outfile))
+    base, ext = os.path.splitext(os.path.basename(outfile))
+    fd, tmp = tempfile.mkstemp(prefix=f".~{base}.", suffix=ext or ".xlsx", dir=folder)
+    os.close(fd)
+    try:
+        yield tmp
+        with open(tmp, "rb+") as fh:
+            os.fsync(fh.fileno())
+        # mkstemp crée le fichier en 0600 : on reprend les droits de l'ancien fichier (ou ceux par défaut)
+        if os.path.exists(outfile):
+            mode = os.stat(outfile).st_mode & 0o777
+        else:
+            mode = 0o666 & ~PROCESS_UMASK
+        os.chmod(tmp, mode)
+        try:
+            os.replace(tmp, outfile)
+        except PermissionError as e:
+            raise PermissionError(f"{os.path.basename(outfile)} est ouvert dans Excel "
+                                  f"ou protégé en écriture ({e.strerror})") from e
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+# -------- Traitement complet --------
+# (clé de fichier, feuille, message du Journal, lecture + nettoyage)
+SOURCE_READERS = [
+    ("Commandes", "Commande", "Lecture/Nettoyage : Commandes", process_commandes),
+    ("Constatations", "Constatation", "Lecture/Nettoyage : Constatations", process_constatations),
+    ("Factures", "Factures", "Lecture/Nettoyage : Factures", process_factures),
+    ("EnvoiBDC", "Envoi BDC", "Lecture/Nettoyage : Envoi BDC", process_envoi_bdc),
+    ("Workflow", "Workflow", "Lecture : Workflow", process_workflow),
+]
+
+class SourceCache:
+    """Sources nettoyées gardées entre deux traitements, relues seulement si le fichier a changé.
+
+    La signature d'un fichier est (chemin, date de modification, taille), ou (taille, SHA-1 du contenu)
+    avec by_content=True pour des copies temporaires d'un même fichier (service HTTP).
+    max_entries : nombre de versions conservées par case.
+    """
+
+    def __init__(self, max_entries: int = 1, by_content: bool = False):
+        from collections import OrderedDict
+        self.max_entries = max_entries
+        self.by_content = by_content
+        self._entries = OrderedDict()  # (case, signature) -> DataFrame, du moins au plus récent
+        self._lock = threading.Lock()
+
+    def signature(self, path: str):
+        st = os.stat(path)
+        if not self.by_content:
+            return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        import hashlib
+        digest = hashlib.sha1()
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(block)
+        return (st.st_size, digest.hexdigest())
+
+    def load(self, key: str, path: str, reader):
+        """(DataFrame, True si repris du cache)."""
+        entry_key = (key, self.signature(path))
+        with self._lock:
+            if entry_key in self._entries:
+                self._entries.move_to_end(entry_key)
+                return self._entries[entry_key], True
+        df = reader(path)
+        with self._lock:
+            self._entries[entry_key] = df
+            same_slot = [k for k in self._entries if k[0] == key]
+            for old in same_slot[:-self.max_entries]:
+                del self._entries[old]
+        return df, False
+
+def read_slot(key: str, value, reader, cache=None):
+    """(DataFrame, fichiers repris du cache, lignes écartées) d'une case (voir slot_paths)."""
+    paths = slot_paths(value)
+    if cache is not None:
+        # une entrée de cache par fichier de la case
+        loaded = [cache.load(key if len(paths) == 1 else (key, os.path.abspath(p)), p, reader) for p in paths]
+        frames, reused = [df for df, _ in loaded], sum(hit for _, hit in loaded)
+    else:
+        workers = min(len(paths), INPUT_WORKERS or os.cpu_count() or 1)
+        if workers > 1:
+            with process_pool(workers) as pool:
+                frames = list(pool.map(reader, paths))
+        else:
+            frames = [reader(p) for p in paths]
+        reused = 0
+    df, dropped = union_frames(frames)
+    return df, reused, dropped
+
+class Pipeline:
+    """Traitement vu comme un graphe d'étapes évaluées à la demande et mémorisées.
+
+    Nœuds : chaque feuille source (lecture + nettoyage de sa case), "recherches" (tables de
+    correspondance de Global, voir build_global_lookups) et "Global" (GlobalTable). get(nœud) évalue
+    d'abord ses dépendances ; chaque étape s'exécute au plus une fois, et seulement si une sortie
+    demandée en a besoin.
+    lineage : Global relève aussi ses lignes sources (values["lignage"], GlobalLineage) ; elle est
+    alors calculée par le moteur pandas.
+    engine : moteur de Global retenu à la création ("pandas" ou "polars", voir use_polars).
+    """
+
+    def __init__(self, files: dict, log=print, cache=None, lineage=False):
+        self.files, self.log, self.cache, self.lineage = files, log, cache, lineage
+        self.engine = "polars" if use_polars() and not lineage else "pandas"
+        self.values = {}   # nœud -> résultat (None : case vide)
+        self.timings = {}  # nœud -> secondes, dépendances non comprises
+        self._readers = {name: (key, message, reader) for key, name, message, reader in SOURCE_READERS}
+
+    def has(self, node: str) -> bool:
+        """True si le nœud peut produire un résultat (source : case renseignée)."""
+        if node in self._readers:
+            return bool(slot_paths(self.files.get(self._readers[node][0])))
+        return node in ("recherches", "Global")
+
+    def sources(self) -> dict:
+        """{feuille: DataFrame} des sources déjà lues."""
+        return {name: self.values[name] for name in SHEET_ORDER if self.values.get(name) is not None}
+
+    def step(self, node: str) -> tuple:
+        """(dépendances, construction) d'un nœud calculé : construction(*valeurs des dépendances)."""
+        if node == "recherches":
+            return ("Envoi BDC", "Factures", "Workflow", "Constatation"), build_global_lookups
+        if node != "Global":
+            raise KeyError(node)
+        df_cmd = self.get("Commande")
+        if df_cmd is None or df_cmd.empty or "N° commande" not in df_cmd.columns:
+            return ("Commande",), self._empty_global  # Global vide : les autres sources ne sont pas lues
+        if self.engine == "polars":
+            return ("Commande", "Envoi BDC", "Factures", "Workflow", "Constatation"), self._polars_global
+        return ("Commande", "recherches"), self._pandas_global
+
+    def dependencies(self, node: str) -> tuple:
+        return () if node in self._readers else self.step(node)[0]
+
+    def get(self, node: str):
+        if node not in self.values:
+            if node in self._readers:
+                started = time.perf_counter()
+                self.values[node] = self._read(node)
+            else:
+                deps, build = self.step(node)
+                args = [self.get(dep) for dep in deps]
+                started = time.perf_counter()
+                self.values[node] = build(*args)
+            self.timings[node] = time.perf_counter() - started
+        return self.values[node]
+
+    def _empty_global(self, df_cmd):
+        if self.lineage:
+            self.values["lignage"] = GlobalLineage().freeze(None)
+        return GlobalTable.from_rows([])
+
+    def _pandas_global(self, df_cmd, lookups):
+        lineage = GlobalLineage() if self.lineage else None
+        table = GlobalTable.from_rows(iter_global_rows(df_cmd, lookups, lineage))
+        if lineage is not None:
+            self.values["lignage"] = lineage.freeze(lookups["fact"])
+        return table
+
+    @staticmethod
+    def _polars_global(df_cmd, df_envoi, df_fact, df_wf, df_const):
+        return GlobalTable.from_rows(iter_global_rows_polars(df_cmd, df_envoi, df_fact, df_wf, df_const))
+
+    def _read(self, name: str):
+        key, message, reader = self._readers[name]
+        count = len(slot_paths(self.files.get(key)))
+        if not count:
+            return None
+        if self.cache is None:
+            self.log(message + (f" ({count} fichiers)" if count > 1 else ""))
+        df, reused, dropped = read_slot(key, self.files[key], reader, self.cache)
+        if self.cache is not None:
+            self.log(f"Inchangé : {name} (cache)" if reused == count
+                     else message + (f" ({count} fichiers, {reused} repris du cache)" if count > 1 else ""))
+        if dropped:
+            self.log(f"{name} : {dropped} ligne(s) déjà présente(s) dans un fichier précédent écartée(s)")
+        return df
+
+def run_consolidation(files: dict, outfile: str, log=print, history=None, cache=None, outputs=None,
+                      formats=None, lineage=None):
+    """Lit, nettoie et écrit les sources présentes puis l'onglet Global dans outfile.
+
+    files : {"Commandes", "Constatations", "Factures", "EnvoiBDC", "Workflow"} -> chemin, plusieurs
+    chemins séparés par ";", motif ou liste (voir slot_paths), ou "".
+    history : BdcHistory où ajouter ce traitement (None : pas d'historique).
+    cache : SourceCache réutilisé d'un traitement à l'autre (mode surveillance).
+    outputs : feuilles voulues parmi OUTPUT_NAMES (None : OUTPUT_SELECTION) ; seules les étapes
+    utiles à ces feuilles sont exécutées (voir Pipeline).
+    formats : formats écrits parmi EXPORT_FORMAT_NAMES (None : EXPORT_FORMATS, voir export_consolidation).
+    lineage : lignage de Global parmi LINEAGE_MODES (None : LINEAGE_MODE, voir lineage_sheets).
+    Renvoie le ConsolidationResult du traitement (sources lues, Global), None en mode hors mémoire.
+    """
+    wanted = output_selection(OUTPUT_SELECTION if outputs is None else outputs)
+    formats = export_formats(EXPORT_FORMATS if formats is None else formats)
+    lineage = lineage_output(LINEAGE_MODE if lineage is None else lineage, formats, wanted)
+    sidecar = [lineage_path(outfile)] if lineage == "fichier" else []
+    for path in [outfile] + export_paths(outfile, formats, wanted) + sidecar:
+        check_output(path)
+    ensure_deps_loaded()
+    if (ENGINE or "").lower() == "polars" and not _POLARS_AVAILABLE:
+        log("Moteur Polars indisponible (pip install polars) : moteur pandas utilisé")
+    if (OUTPUT_ENGINE or "").lower() == "xlsxwriter" and not _XLSXWRITER_AVAILABLE:
+        log("xlsxwriter indisponible (pip install xlsxwriter) : écriture openpyxl utilisée")
+    if len(wanted) < len(OUTPUT_NAMES):
+        log("Feuilles demandées : " + ", ".join(name for name in OUTPUT_NAMES if name in wanted))
+    if use_out_of_core(files):
+        log("Entrées volumineuses : mode hors mémoire")
+        if formats != ["xlsx"]:
+            log("Exports CSV et Parquet indisponibles en mode hors mémoire : classeur xlsx seul")
+        if lineage:
+            log("Lignage indisponible en mode hors mémoire")
+        return run_out_of_core(files, outfile, log, history=history, outputs=wanted)
+    if lineage and use_polars():
+        log("Lignage : Global calculée par le moteur pandas (seul à relever les lignes sources)")
+
+    pipeline = Pipeline(files, log, cache, lineage=lineage is not None)
+    dfs = {name: pipeline.get(name) for name in SHEET_ORDER if name in wanted and pipeline.has(name)}
+    global_values = pipeline.get("Global") if "Global" in wanted else None
+    skipped = [name for name in SHEET_ORDER if pipeline.has(name) and name not in pipeline.values]
+    if skipped:
+        log("Non lu(s), inutile(s) pour les feuilles demandées : " + ", ".join(skipped))
+    check_sheet_sizes({name: len(df) for name, df in dfs.items()}, log)
+    dfs = lineage_sheets(outfile, dfs, pipeline.values.get("lignage"), global_values,
+                         {name: len(df) for name, df in pipeline.sources().items()}, lineage, log)
+
+    export_consolidation(outfile, dfs, log, outputs=wanted, global_values=global_values, formats=formats)
+
+    if history is not None and record_history(history, outfile, files, pipeline.sources(), global_values, log):
+        log("Historique mis à jour")
+    return ConsolidationResult(pipeline.sources(), global_values, dict(pipeline.timings), files,
+                               lookups=pipeline.values.get("recherches"), lineage=pipeline.values.get("lignage"))
+
+def record_history(history, outfile: str, files: dict, dfs: dict, global_values, log=print) -> bool:
+    """Ajoute à history un traitement dont les sources nettoyées et Global sont en mémoire.
+
+    Une erreur d'historique est journalisée sans faire échouer la consolidation (renvoie False)."""
+    try:
+        record = history.start_run(outfile, files)
+    except Exception as exc:
+        log(f"Historique non mis à jour : {exc}")
+        return False
+    for name in SHEET_ORDER:
+        if name in dfs:
+            record.add_source_frame(name, dfs[name])
+    if global_values is not None:
+        record.add_global_rows(global_values)
+    return finish_history(record, log)
+
+def finish_history(record, log=print) -> bool:
+    """Valide record (HistoryRun) ; une erreur est journalisée, jamais propagée."""
+    try:
+        record.commit()
+    except Exception as exc:
+        log(f"Historique non mis à jour : {exc}")
+        return False
+    return True
+
+SHEET_ORDER = ["Commande", "Envoi BDC", "Constatation", "Factures", "Workflow"]
+
+# Feuilles que l'on peut demander (la page de garde est toujours écrite) ; Global a besoin de toutes
+# les sources, une feuille source seulement de la sienne
+OUTPUT_NAMES = ["Global"] + SHEET_ORDER
+OUTPUT_SELECTION = os.environ.get("NETTOIEXLSX_SORTIES") or None  # ex. "Global,Factures" ; None : toutes
+OUTPUT_PRESETS = [
+    ("Toutes les feuilles", list(OUTPUT_NAMES)),
+    ("Global seul", ["Global"]),
+    ("Global + Factures", ["Global", "Factures"]),
+]
+
+def output_selection(outputs) -> set:
+    """Ensemble des feuilles demandées : None (toutes), liste de noms ou texte "Global,Factures"."""
+    if not outputs:
+        return set(OUTPUT_NAMES)
+    names = [str(name).strip() for name in (outputs.split(",") if isinstance(outputs, str) else outputs)]
+    unknown = [name for name in names if name and name not in OUTPUT_NAMES]
+    if unknown:
+        raise ValueError(f"Feuille(s) inconnue(s) : {', '.join(unknown)} (possibles : {', '.join(OUTPUT_NAMES)})")
+    return {name for name in names if name}
+
+def needed_sources(outputs) -> list:
+    """Feuilles sources à lire pour produire les feuilles demandées."""
+    wanted = output_selection(outputs)
+    return [name for name in SHEET_ORDER if "Global" in wanted or name in wanted]
+
+def write_consolidation(outfile: str, dfs: dict, log=print, outputs=None, global_values=None):
+    """Écrit le classeur (page de garde, sources, Global) avec le moteur de sortie choisi ;
+    renvoie les lignes de Global (valeurs, None si Global n'est pas demandée). L'écriture est
+    atomique (voir atomic_output).
+
+    outputs : feuilles à écrire parmi OUTPUT_NAMES (None : toutes) ; global_values : Global déjà
+    calculée (None : calculée d'après dfs). dfs peut contenir la feuille masquée LINEAGE_SHEET,
+    écrite après les sources (voir lineage_sheets)."""
+    wanted = output_selection(outputs)
+    order = [name for name in SHEET_ORDER if name in wanted] + [name for name in HIDDEN_SHEETS if name in dfs]
+    if "Global" in wanted and global_values is None:
+        global_values = global_table(dfs.get("Commande"), dfs.get("Envoi BDC"), dfs.get("Factures"),
+                                     dfs.get("Workflow"), dfs.get("Constatation"))
+    with atomic_output(outfile) as tmp:
+        if use_xml_writer():
+            write_workbook_xml(tmp, _consolidation_specs(dfs, order, global_values, log), log)
+        elif use_xlsxwriter():
+            write_workbook_xlsxwriter(tmp, _consolidation_specs(dfs, order, global_values, log), log)
+        else:
+            _write_consolidation_openpyxl(tmp, dfs, order, global_values, log)
+    return global_values
+
+def _write_consolidation_openpyxl(outfile: str, dfs: dict, order: list, global_values, log=print):
+    """Écriture via pd.ExcelWriter (openpyxl) ; pas de feuille Global si global_values est None."""
+    with pd.ExcelWriter(outfile, engine="openpyxl") as writer:
+        log("Création de la page de garde")
+        create_cover_sheet(writer)
+        for name in order:
+            if name in dfs:
+                df = dfs[name]
+                for sheet_name, start, stop in sheet_chunks(name, len(df)):
+                    log(f"Écriture de la feuille {sheet_name}")
+                    part = df if stop - start == len(df) else df.iloc[start:stop]
+                    part.to_excel(writer, index=False, sheet_name=sheet_name)
+                    ws = writer.book[sheet_name]
+                    autofit_worksheet(ws, df)  # largeurs de la source complète sur chaque tranche
+                    strip_times_in_worksheet(ws)
+                    if name in HIDDEN_SHEETS:
+                        ws.sheet_state = "hidden"
+
+        # Global
+        if global_values is not None:
+            log("Création et remplissage de la feuille Global")
+            create_and_fill_global_sheet(writer, global_values)
+
+def _consolidation_specs(dfs: dict, order: list, values, log=print):
+    """Descriptions des feuilles pour les moteurs xml et xlsxwriter (Global : values, None si absente).
+
+    Une description est un dict : name, kind ("cover", "source", "global"), widths [(colonne, largeur)],
+    et selon le cas data, columns, ncols, freeze, landscape, margins, col_styles {colonne: style},
+    row_height (hauteur de ligne par défaut), hidden (feuille masquée)."""
+    specs = [{"name": "Page de garde", "kind": "cover", "widths": [(1, 120)], "freeze": "A2"}]
+    for name in order:
+        if name in dfs:
+            df = dfs[name]
+            widths = list(enumerate(autofit_widths(df), start=1))
+            for sheet_name, start, stop in sheet_chunks(name, len(df)):
+                part = df if stop - start == len(df) else df.iloc[start:stop]
+                specs.append({"name": sheet_name, "kind": "source", "data": part, "columns": list(df.columns),
+                              "ncols": df.shape[1], "widths": widths, "hidden": name in HIDDEN_SHEETS})
+    if values is None:
+        return specs
+    log("Création et remplissage de la feuille Global")
+    for sheet_name, start, stop in sheet_chunks("Global", len(values)):
+        specs.append({"name": sheet_name, "kind": "global", "data": values[start:stop], "landscape": True,
+                      "margins": (0.19685, 0.19685), "row_height": GLOBAL_ROW_HEIGHT,
+                      "col_styles": dict(enumerate(_GLOBAL_COLUMN_STYLES, start=1)),
+                      "widths": [(i, w + GLOBAL_WIDTH_OFFSET) for i, w in enumerate(GLOBAL_COLUMN_WIDTHS, start=1)]})
+    return specs
+
+# -------- Exports CSV et Parquet --------
+# Le résultat en mémoire (sources nettoyées, Global) est écrit une fois par format demandé : le
+# classeur xlsx dans le fil principal (Journal en direct), CSV et Parquet en parallèle dans des
+# fils séparés, une feuille par fichier à côté du classeur ("<sortie> - Global.csv"…).
+EXPORT_FORMAT_NAMES = ["xlsx", "csv", "parquet"]
+EXPORT_FORMATS = os.environ.get("NETTOIEXLSX_FORMATS", "xlsx")  # ex. "xlsx,csv,parquet"
+CSV_SEPARATOR = ";"        # Excel français
+CSV_ENCODING = "utf-8-sig"  # BOM : accents reconnus à l'ouverture dans Excel
+_PARQUET_PANDAS = (importlib.util.find_spec("pyarrow") is not None
+                   or importlib.util.find_spec("fastparquet") is not None)
+
+def export_formats(formats) -> list:
+    """Formats demandés, dans l'ordre de EXPORT_FORMAT_NAMES : liste ou texte "xlsx,csv"."""
+    names = [str(f).strip().lower() for f in (formats.split(",") if isinstance(formats, str) else formats or [])]
+    unknown = [f for f in names if f and f not in EXPORT_FORMAT_NAMES]
+    if unknown:
+        raise ValueError(f"Format(s) inconnu(s) : {', '.join(unknown)} (possibles : {', '.join(EXPORT_FORMAT_NAMES)})")
+    return [f for f in EXPORT_FORMAT_NAMES if f in names]
+
+def export_path(outfile: str, fmt: str, sheet: str) -> str:
+    return f"{os.path.splitext(outfile)[0]} - {sheet}.{fmt}"
+
+def export_paths(outfile: str, formats, outputs=None) -> list:
+    """Fichiers écrits pour ces formats et ces feuilles (classeur compris)."""
+    wanted = output_selection(outputs)
+    paths = []
+    for fmt in export_formats(formats):
+        if fmt == "xlsx":
+            paths.append(outfile)
+        else:
+            paths.extend(export_path(outfile, fmt, name) for name in OUTPUT_NAMES if name in wanted)
+    return paths
+
+def _export_value(v):
+    """Valeur telle qu'affichée dans le classeur : dates sans heure, vides à None."""
+    if v is None or isinstance(v, (list, tuple, dict, set)):
+        return v
+    if isinstance(v, str):
+        if _DATETIME_TEXT_RE.match(v):  # comme strip_times_in_worksheet
+            d = pd.to_datetime(v, dayfirst=True, errors="coerce")
+            return d.date() if pd.notna(d) else v
+        return v
+    if pd.isna(v):
+        return None
+    if isinstance(v, (pd.Timestamp, dt.datetime)):
+        return v.date()
+    if isinstance(v, Decimal):
+        return float(v)
+    if hasattr(v, "item"):  # scalaire NumPy
+        return v.item()
+    return v
+
+def _csv_text(v, number_format=None) -> str:
+    """Texte affiché dans le classeur : format "0.00" à 2 décimales, Standard à 15 chiffres
+    significatifs (0.1 + 0.2 -> 0,3), virgule décimale."""
+    if v is None:
+        return ""
+    if isinstance(v, dt.date):
+        return v.strftime("%d/%m/%Y")
+    if isinstance(v, float):
+        text = f"{v:.2f}" if number_format == "0.00" else f"{v:.15g}"
+        return text.replace(".", ",")
+    return str(v)
+
+def sheet_number_formats(name: str, ncols: int) -> list:
+    """Format de nombre de chaque colonne dans le classeur (sources : Standard, None)."""
+    if name != "Global":
+        return [None] * ncols
+    return [GLOBAL_COLUMN_FORMATS.get(i) for i in range(1, ncols + 1)]
+
+def export_frames(dfs: dict, global_values, outputs=None) -> dict:
+    """{feuille: (en-têtes, colonnes de valeurs exportées)} des feuilles demandées, dans l'ordre du classeur."""
+    wanted = output_selection(outputs)
+    frames = {}
+    for name in SHEET_ORDER:
+        if name in wanted and dfs.get(name) is not None:
+            df = dfs[name]
+            frames[name] = ([str(c) for c in df.columns],
+                            [_cached(_export_value)(df.iloc[:, i]) for i in range(df.shape[1])])
+    if global_values is not None and "Global" in wanted:
+        frames["Global"] = (list(GLOBAL_HEADERS), [_cached(_export_value)(col) for col in global_values.columns()])
+    return frames
+
+def write_csv_exports(outfile: str, frames: dict) -> list:
+    """Un CSV par feuille (séparateur ";", UTF-8 avec BOM, dates jj/mm/aaaa, virgule décimale)."""
+    import csv
+    paths = []
+    for name, (headers, columns) in frames.items():
+        path = export_path(outfile, "csv", name)
+        with atomic_output(path) as tmp:
+            with open(tmp, "w", encoding=CSV_ENCODING, newline="") as fh:
+                writer = csv.writer(fh, delimiter=CSV_SEPARATOR)
+                writer.writerow(headers)
+                formats = sheet_number_formats(name, len(columns))
+                writer.writerows(zip(*(_cached(lambda v, f=f: _csv_text(v, f))(col) for col, f in zip(columns, formats))))
+        paths.append(path)
+    return paths
+
+def _parquet_column(values: list) -> list:
+    """Colonne d'un seul type pour Parquet : types mêlés (date et texte…) convertis en texte."""
+    kinds = {"date" if isinstance(v, dt.date) else "nombre" if isinstance(v, (int, float)) and not isinstance(v, bool)
+             else type(v).__name__ for v in values if v is not None}
+    if len(kinds) <= 1 and kinds <= {"date", "nombre", "str", "bool"}:
+        if kinds == {"nombre"} and any(isinstance(v, float) for v in values):
+            return [None if v is None else float(v) for v in values]
+        return values
+    return [None if v is None else _csv_text(v) for v in values]
+
+def _typed_columns(headers: list, columns: list) -> dict:
+    """{nom unique: colonne d'un seul type} (noms en double suffixés comme pandas : Montant, Montant.1…)."""
+    seen, data = {}, {}
+    for h, col in zip(headers, columns):
+        data[f"{h}.{seen[h]}" if h in seen else h] = _parquet_column(col)
+        seen[h] = seen.get(h, 0) + 1
+    return data
+
+def write_parquet_exports(outfile: str, frames: dict) -> list:
+    """Un fichier Parquet par feuille (pandas avec pyarrow ou fastparquet, sinon Polars)."""
+    paths = []
+    for name, (headers, columns) in frames.items():
+        data = _typed_columns(headers, columns)
+        names = list(data)
+        path = export_path(outfile, "parquet", name)
+        with atomic_output(path) as tmp:
+            if _PARQUET_PANDAS:
+                pd.DataFrame(data, columns=names).to_parquet(tmp, index=False)
+            else:
+                pl = _polars()
+                pl.DataFrame({n: pl.Series(n, col, strict=False) for n, col in data.items()}).write_parquet(tmp)
+        paths.append(path)
+    return paths
+
+EXPORT_WRITERS = {"csv": write_csv_exports, "parquet": write_parquet_exports}
+
+def _timed(fn, *args):
+    started = time.perf_counter()
+    return fn(*args), time.perf_counter() - started
+
+def export_consolidation(outfile: str, dfs: dict, log=print, outputs=None, global_values=None, formats=None):
+    """Écrit le résultat dans chaque format demandé (EXPORT_FORMATS par défaut), formats en parallèle ;
+    renvoie les lignes de Global (voir write_consolidation)."""
+    formats = export_formats(EXPORT_FORMATS if formats is None else formats)
+    wanted = output_selection(outputs)
+    if "parquet" in formats and not (_PARQUET_PANDAS or _POLARS_AVAILABLE):
+        log("Parquet indisponible (pip install pyarrow) : export Parquet ignoré")
+        formats.remove("parquet")
+    if "Global" in wanted and global_values is None:
+        global_values = global_table(dfs.get("Commande"), dfs.get("Envoi BDC"), dfs.get("Factures"),
+                                     dfs.get("Workflow"), dfs.get("Constatation"))
+    side = [fmt for fmt in formats if fmt in EXPORT_WRITERS]
+    if not side:
+        if "xlsx" in formats:
+            write_consolidation(outfile, dfs, log, outputs=wanted, global_values=global_values)
+        return global_values
+    from concurrent.futures import ThreadPoolExecutor
+    frames = export_frames(dfs, global_values, wanted)
+    with ThreadPoolExecutor(max_workers=len(side)) as pool:
+        futures = {fmt: pool.submit(_timed, EXPORT_WRITERS[fmt], outfile, frames) for fmt in side}
+        if "xlsx" in formats:
+            _, seconds = _timed(write_consolidation, outfile, dfs, log, wanted, global_values)
+            log(f"Export xlsx : {seconds:.2f} s")
+        for fmt, future in futures.items():
+            paths, seconds = future.result()
+            log(f"Export {fmt} : {seconds:.2f} s ({len(paths)} fichier(s) : "
+                + ", ".join(os.path.basename(p) for p in paths) + ")")
+    return global_values
+
+# -------- Lignage --------
+# Pour chaque ligne de Global, les lignes de Commande, Envoi BDC, Constatation, Factures et
+# Workflow qui l'ont alimentée (GlobalLineage, relevé pendant les jointures du moteur pandas) :
+# feuille masquée du classeur ou fichier "<sortie> - Lignage.csv" à côté.
+LINEAGE_MODES = ["non", "feuille", "fichier"]
+LINEAGE_MODE = os.environ.get("NETTOIEXLSX_LIGNAGE", "non")
+LINEAGE_SHEET = "Lignage"
+HIDDEN_SHEETS = [LINEAGE_SHEET]
+LINEAGE_HEADERS = ["Global", "BDC"] + SHEET_ORDER
+
+def lineage_output(mode, formats, outputs=None):
+    """"feuille", "fichier" ou None (pas de lignage, ou Global non demandée) ; "feuille" devient
+    "fichier" quand le classeur xlsx n'est pas demandé."""
+    mode = str(mode or "non").strip().lower()
+    if mode not in LINEAGE_MODES:
+        raise ValueError(f"Lignage inconnu : {mode} (possibles : {', '.join(LINEAGE_MODES)})")
+    if mode == "non" or "Global" not in output_selection(outputs):
+        return None
+    return "feuille" if mode == "feuille" and "xlsx" in export_formats(formats) else "fichier"
+
+def lineage_path(outfile: str) -> str:
+    return export_path(outfile, "csv", LINEAGE_SHEET)
+
+def _row_refs(name: str, positions, nrows: int) -> list:
+    """Lignes du classeur (en-tête : ligne 1) ; "Feuille_2!15" quand la feuille est découpée."""
+    import bisect
+    chunks = sheet_chunks(name, nrows)
+    if len(chunks) <= 1:
+        return [p + 2 if p >= 0 else None for p in positions.tolist()]
+    starts = [start for _, start, _ in chunks]
+    refs = []
+    for p in positions.tolist():
+        if p < 0:
+            refs.append(None)
+        else:
+            k = bisect.bisect_right(starts, p) - 1
+            refs.append(f"{chunks[k][0]}!{p - starts[k] + 2}")
+    return refs
+
+def lineage_columns(lineage: GlobalLineage, global_values, sizes: dict) -> list:
+    """Colonnes de LINEAGE_HEADERS : ligne de Global, BDC, puis ligne(s) de chaque source.
+
+    sizes : {feuille: nombre de lignes} des sources nettoyées (découpage des feuilles) ; plusieurs
+    lignes Factures sont séparées par des virgules."""
+    import numpy as np
+    n = len(lineage)
+    columns = [_row_refs("Global", np.arange(n), n), global_values.column(0)]
+    for name, attr in zip(SHEET_ORDER, GlobalLineage.COLUMNS):
+        if name != "Factures":
+            columns.append(_row_refs(name, getattr(lineage, attr), sizes.get(name, 0)))
+            continue
+        rows = lineage.fact.rows if lineage.fact is not None else np.zeros(0, dtype=np.int32)
+        refs = _row_refs(name, rows, sizes.get(name, 0))
+        offsets = lineage.fact.offsets if lineage.fact is not None else None
+        columns.append([", ".join(str(r) for r in refs[offsets[g]:offsets[g + 1]]) if g >= 0 else None
+                        for g in lineage.factures.tolist()])
+    return columns
+
+def lineage_sheets(outfile: str, dfs: dict, lineage, global_values, sizes: dict, mode, log=print) -> dict:
+    """dfs complété de la feuille LINEAGE_SHEET (mode "feuille") ; en mode "fichier", écrit le CSV
+    à côté du classeur et renvoie dfs inchangé."""
+    if mode is None or lineage is None or global_values is None:
+        return dfs
+    started = time.perf_counter()
+    columns = lineage_columns(lineage, global_values, sizes)
+    if mode == "fichier":
+        path, = write_csv_exports(outfile, {LINEAGE_SHEET: (list(LINEAGE_HEADERS), columns)})
+        log(f"Lignage : {os.path.basename(path)} ({time.perf_counter() - started:.2f} s)")
+        return dfs
+    log(f"Lignage : feuille masquée {LINEAGE_SHEET} ({time.perf_counter() - started:.2f} s)")
+    return dict(dfs, **{LINEAGE_SHEET: lineage_frame(columns)})
+
+def lineage_frame(columns: list):
+    """DataFrame (colonnes LINEAGE_HEADERS, valeurs telles quelles) des colonnes de lineage_columns."""
+    return pd.DataFrame({h: pd.Series(col, dtype=object) for h, col in zip(LINEAGE_HEADERS, columns)})
+
+def global_with_lineage(dfs: dict):
+    """(GlobalTable, GlobalLineage) d'après les sources de dfs, moteur pandas."""
+    df_cmd = dfs.get("Commande")
+    if df_cmd is None or df_cmd.empty or "N° commande" not in df_cmd.columns:
+        return GlobalTable.from_rows([]), GlobalLineage().freeze(None)
+    lookups = build_global_lookups(dfs.get("Envoi BDC"), dfs.get("Factures"), dfs.get("Workflow"),
+                                   dfs.get("Constatation"))
+    lineage = GlobalLineage()
+    return GlobalTable.from_rows(iter_global_rows(df_cmd, lookups, lineage)), lineage.freeze(lookups["fact"])
+
+# -------- API Python --------
+# consolidate() : le traitement du bouton « Lancer » sans interface ni classeur, pour d'autres
+# scripts Python (module nettoiexlsx à côté de ce fichier) ; les résultats restent en mémoire.
+class ConsolidationResult:
+    """Résultat de consolidate().
+
+    sources : {feuille: DataFrame nettoyé} ; global_values : GlobalTable (None si Global n'est pas
+    demandée) ; timings : {étape du Pipeline: secondes} ; files : cases et fichiers lus ;
+    lookups : tables de correspondance de Global (voir build_global_lookups) si elles ont été calculées ;
+    lineage : GlobalLineage si le lignage a été demandé.
+    """
+
+    def __init__(self, sources: dict, global_values, timings: dict, files: dict, lookups=None, lineage=None):
+        self.sources = sources
+        self.global_values = global_values
+        self.timings = timings
+        self.files = files
+        self.lookups = lookups
+        self.lineage = lineage
+
+    @property
+    def global_frame(self):
+        """Global en DataFrame (colonnes A..K, index : ligne de Commande d'origine)."""
+        if self.global_values is None:
+            return None
+        return pd.DataFrame(dict(zip(GLOBAL_HEADERS, self.global_values.columns())),
+                            index=self.global_values.index, columns=GLOBAL_HEADERS)
+
+    @property
+    def lineage_frame(self):
+        """Lignage de Global en DataFrame (colonnes LINEAGE_HEADERS), None s'il n'a pas été relevé."""
+        if self.lineage is None or self.global_values is None:
+            return None
+        return lineage_frame(lineage_columns(self.lineage, self.global_values,
+                                             {name: len(df) for name, df in self.sources.items()}))
+
+    def frames(self) -> dict:
+        """{feuille: DataFrame}, sources puis Global, dans l'ordre du classeur."""
+        frames = dict(self.sources)
+        if self.global_values is not None:
+            frames["Global"] = self.global_frame
+        return frames
+
+    def _typed(self) -> dict:
+        return {name: _typed_columns(headers, columns)
+                for name, (headers, columns) in export_frames(self.sources, self.global_values).items()}
+
+    def to_polars(self) -> dict:
+        """{feuille: DataFrame Polars} (mémoire Arrow), valeurs et types de l'export Parquet."""
+        pl = _polars()
+        return {name: pl.DataFrame({n: pl.Series(n, col, strict=False) for n, col in data.items()})
+                for name, data in self._typed().items()}
+
+    def to_arrow(self) -> dict:
+        """{feuille: pyarrow.Table}, valeurs et types de l'export Parquet (pip install pyarrow)."""
+        import pyarrow as pa
+        return {name: pa.table(data) for name, data in self._typed().items()}
+
+def consolidation_files(paths) -> dict:
+    """{case: chemins} d'après un dict de cases (inchangé), un dossier d'exports ou des fichiers
+    (liste, ou texte à la manière de slot_paths) rangés d'après leur contenu."""
+    if isinstance(paths, dict):
+        return paths
+    if isinstance(paths, (str, os.PathLike)) and os.path.isdir(paths):
+        return scan_export_folder(os.fspath(paths))
+    files = {}
+    for path in slot_paths([os.fspath(p) for p in paths] if isinstance(paths, (list, tuple)) else os.fspath(paths)):
+        key = classify_file(path)
+        if key is None:
+            raise ValueError(f"Fichier non reconnu : {path}")
+        files.setdefault(key, []).append(path)
+    return files
+
+def consolidate(paths, outputs=None, log=None, lineage=False) -> ConsolidationResult:
+    """Lit et nettoie les sources puis calcule Global, sans rien écrire.
+
+    paths : voir consolidation_files. outputs : feuilles voulues (voir output_selection) ; seules
+    les étapes nécessaires sont exécutées. Moteur : ENGINE du module ("pandas" ou "polars").
+    lineage : relève aussi les lignes sources de Global (result.lineage, result.lineage_frame).
+    """
+    ensure_deps_loaded()
+    files = consolidation_files(paths)
+    wanted = output_selection(outputs)
+    pipeline = Pipeline(files, log or (lambda msg: None), lineage=lineage)
+    sources = {name: pipeline.get(name) for name in SHEET_ORDER if name in wanted and pipeline.has(name)}
+    global_values = pipeline.get("Global") if "Global" in wanted else None
+    return ConsolidationResult(sources, global_values, dict(pipeline.timings), files,
+                               lookups=pipeline.values.get("recherches"), lineage=pipeline.values.get("lignage"))
+
+# -------- Recherche de BDC --------
+# Après un traitement, toutes les lignes d'un BDC (Global et chaque source) sont retrouvées en
+# mémoire, sans rouvrir le classeur : BDC triés pour la recherche par préfixe (dichotomie), positions
+# des lignes de chaque feuille par BDC.
+class BdcIndex:
+    """Index des lignes par BDC d'un ConsolidationResult.
+
+    keys : BDC distincts triés ; rows[feuille] : BDC -> positions des lignes dans la feuille.
+    """
+
+    def __init__(self, result: ConsolidationResult):
+        self.result = result
+        self.rows = {}
+        if result.global_values is not None:
+            self._add("Global", result.global_values.column(0))
+        for name in SHEET_ORDER:
+            df = result.sources.get(name)
+            if df is None or df.empty:
+                continue
+            bdc_col = workflow_columns(list(df.columns))[0] if name == "Workflow" else SOURCE_BDC_COLUMNS.get(name)
+            if bdc_col in df.columns:
+                self._add(name, df.iloc[:, list(df.columns).index(bdc_col)])
+        self.keys = sorted(set().union(*self.rows.values()))
+
+    def _add(self, sheet: str, values):
+        positions = self.rows[sheet] = {}
+        for pos, v in enumerate(values):
+            key = "" if _is_nan(v) else str(v).strip()
+            if key:
+                positions.setdefault(key, []).append(pos)
+
+    def search(self, text: str, limit: int = 200):
+        """(BDC commençant par text, dans l'ordre, au plus limit ; nombre total de BDC trouvés)."""
+        import bisect
+        text = str(text).strip()
+        lo = bisect.bisect_left(self.keys, text)
+        hi = bisect.bisect_left(self.keys, text + "\U0010ffff")
+        return self.keys[lo:min(hi, lo + limit)], hi - lo
+
+    def sheet_rows(self, bdc: str) -> dict:
+        """{feuille: (en-têtes, [valeurs de chaque ligne])} du BDC, Global en premier."""
+        found = {}
+        for sheet, positions in self.rows.items():
+            rows = positions.get(bdc)
+            if not rows:
+                continue
+            if sheet == "Global":
+                table = self.result.global_values
+                found[sheet] = (list(GLOBAL_HEADERS), [list(table[pos]) for pos in rows])
+            else:
+                df = self.result.sources[sheet]
+                found[sheet] = ([str(c) for c in df.columns], [list(df.iloc[pos]) for pos in rows])
+        return found
+
+    def describe(self, bdc: str) -> list:
+        """Lignes de texte : chaque ligne de chaque feuille pour ce BDC (panneau de recherche)."""
+        found = self.sheet_rows(bdc)
+        if not found:
+            return [f"BDC {bdc} : absent du dernier traitement"]
+        lines = [f"BDC {bdc}"]
+        lookups = self.result.lookups
+        if lookups is not None and bdc in lookups["fact"].positions:
+            pos = lookups["fact"].positions[bdc]
+            lines.append(f"  {lookups['fact'].count(pos)} facture(s), total HT {_csv_text(float(lookups['fact'].total(pos)), '0.00')}")
+        for sheet, (headers, rows) in found.items():
+            lines.append("")
+            lines.append(f"{sheet} ({len(rows)} ligne{'s' if len(rows) > 1 else ''})")
+            formats = sheet_number_formats(sheet, len(headers))
+            for values in rows:
+                lines.append("  " + " | ".join(f"{h} : {_csv_text(_export_value(v), f)}"
+                                               for h, v, f in zip(headers, values, formats)))
+        return lines
+
+# -------- Réglages temporaires --------
+# Les réglages (ENGINE, OUTPUT_ENGINE…) sont des variables du module : le banc d'essai, le corpus
+# de référence et les tâches du lot les remplacent le temps d'un traitement, toujours par
+# module_settings, qui les rétablit même en cas d'erreur.
+_SETTINGS_LOCK = threading.RLock()
+
+@contextlib.contextmanager
+def module_settings(**settings):
+    """with module_settings(ENGINE="polars", …) : réglages remplacés le temps du bloc, puis rétablis.
+
+    Deux blocs de threads différents ne se chevauchent pas (verrou)."""
+    unknown = [name for name in settings if name not in globals()]
+    if unknown:
+        raise KeyError(f"réglage(s) inconnu(s) : {', '.join(unknown)}")
+    with _SETTINGS_LOCK:
+        saved = {name: globals()[name] for name in settings}
+        globals().update(settings)
+        try:
+            yield
+        finally:
+            globals().update(saved)
+
+# -------- Traitement par lots --------
+# Plusieurs bases en une commande : un seul groupe de processus (dépendances chargées une fois par
+# processus) lit chaque fichier distinct une seule fois, même s'il sert à plusieurs bases, et écrit
+# le classeur de chaque base dès que ses sources sont prêtes.
+BATCH_WORKERS = None  # None : un processus par cœur
+# réglages du processus principal (ligne de commande) recopiés dans les processus du lot
+BATCH_SETTINGS = ["ENGINE", "OUTPUT_ENGINE", "OUTPUT_DEFLATE_LEVEL", "OUTPUT_SHARED_STRINGS",
+                  "OUTPUT_TEMPLATE", "SHEET_ROW_LIMIT", "OUT_OF_CORE_MODE", "OUTPUT_SELECTION", "EXPORT_FORMATS",
+                  "LINEAGE_MODE"]
+
+def load_batch_manifest(path: str) -> list:
+    """[{"nom", "files", "sortie"}] des bases à consolider.
+
+    path : fichier JSON, liste (ou {"bases": [...]}) de {"nom", "sortie", case: chemin(s)} avec
+    les cases de SOURCE_READERS et des chemins relatifs au manifeste ; ou dossier dont chaque
+    sous-dossier d'exports est une base (sortie : WATCH_DEFAULT_OUTFILE dans le sous-dossier).
+    """
+    if os.path.isdir(path):
+        bases = []
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            files = scan_export_folder(entry.path) if entry.is_dir() else {}
+            if files:
+                bases.append({"nom": entry.name, "files": files,
+                              "sortie": os.path.join(entry.path, WATCH_DEFAULT_OUTFILE)})
+        return bases
+    import json
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+
+    def resolve(value) -> list:
+        parts = value if isinstance(value, (list, tuple)) else str(value).split(SLOT_SEPARATOR)
+        return [os.path.join(root, str(part).strip()) for part in parts if str(part).strip()]
+
+    bases = []
+    for i, entry in enumerate(data.get("bases", []) if isinstance(data, dict) else data, 1):
+        name = str(entry.get("nom") or i)
+        if not entry.get("sortie"):
+            raise ValueError(f"Manifeste : base {name} sans fichier de sortie (\"sortie\")")
+        files = {key: resolve(entry[key]) for key, *_ in SOURCE_READERS if entry.get(key)}
+        if any(base["nom"] == name for base in bases):
+            raise ValueError(f"Manifeste : base {name} déclarée deux fois")
+        bases.append({"nom": name, "files": files, "sortie": resolve(entry["sortie"])[0]})
+    return bases
+
+def _batch_worker_init():
+    """Processus du lot : dépendances chargées une fois pour toutes les tâches."""
+    ensure_deps_loaded()
+
+def _batch_task(settings: dict, fn, *args):
+    """Tâche du lot exécutée avec les réglages du processus principal et sans sous-processus (le
+    lot occupe déjà les cœurs) ; les réglages du processus du lot sont rétablis ensuite."""
+    with module_settings(**settings, INPUT_WORKERS=1, OUTPUT_WORKERS=1):
+        return fn(*args)
+
+def _batch_read(key: str, path: str):
+    """(DataFrame nettoyé, secondes) d'un fichier du lot."""
+    reader = next(reader for k, _, _, reader in SOURCE_READERS if k == key)
+    started = time.perf_counter()
+    df = reader(path)
+    return df, time.perf_counter() - started
+
+def _batch_write(outfile: str, dfs: dict):
+    """(valeurs de Global, secondes, messages du Journal) d'une base dont les sources sont lues."""
+    messages = []
+    started = time.perf_counter()
+    lineage = lineage_output(LINEAGE_MODE, EXPORT_FORMATS, OUTPUT_SELECTION)
+    global_values = None
+    if lineage:
+        global_values, found = global_with_lineage(dfs)
+        dfs = lineage_sheets(outfile, dfs, found, global_values, {name: len(df) for name, df in dfs.items()},
+                             lineage, messages.append)
+    global_values = export_consolidation(outfile, dfs, messages.append, outputs=OUTPUT_SELECTION,
+                                         global_values=global_values)
+    return global_values, time.perf_counter() - started, messages
+
+def _batch_out_of_core(files: dict, outfile: str, history_path: str | None):
+    """(None, secondes, messages du Journal) d'une base volumineuse traitée en entier par un processus."""
+    messages = []
+    started = time.perf_counter()
+    history = BdcHistory(history_path) if history_path else None
+    run_out_of_core(files, outfile, messages.append, history=history, outputs=OUTPUT_SELECTION)
+    return None, time.perf_counter() - started, messages
+
+class BatchRun:
+    """Un lot en cours : lectures des fichiers distincts, puis écriture de chaque base dès que ses
+    sources sont lues (voir run_batch). report : {base: {"lecture", "ecriture", "fin", "erreur"}}."""
+
+    def __init__(self, bases: list, log=print):
+        self.bases = bases
+        self.log = log
+        self.started = time.perf_counter()
+        self.report = {base["nom"]: {"lecture": None, "ecriture": None, "fin": None, "erreur": None}
+                       for base in bases}
+        self.lineage = lineage_output(LINEAGE_MODE, EXPORT_FORMATS, OUTPUT_SELECTION)
+        self.sources = needed_sources(OUTPUT_SELECTION)
+        self.settings = {name: globals()[name] for name in BATCH_SETTINGS}
+        self.history = None
+        self.pool = None
+        self.tasks = {}    # future -> ("lecture", fichier) / ("ecriture", base)
+        self.waiting = {}  # base -> fichiers pas encore lus
+        self.users = {}    # fichier -> bases qui l'attendent encore
+        self.parsed = {}   # fichier -> (DataFrame, secondes)
+        self.uses = 0
+
+    def fail(self, base, problem: str, suffix: str = ""):
+        self.report[base["nom"]]["erreur"] = problem
+        self.log(f"{base['nom']} : {problem}{suffix}")
+
+    def check_outputs(self) -> list:
+        """Bases dont les fichiers de sortie sont utilisables (et distincts d'une base à l'autre)."""
+        outputs = {}
+        for base in self.bases:
+            outfile = os.path.abspath(base["sortie"])
+            problem = next(filter(None, (output_problem(path) for path in
+                                         [outfile] + export_paths(outfile, EXPORT_FORMATS, OUTPUT_SELECTION)
+                                         + ([lineage_path(outfile)] if self.lineage == "fichier" else []))), None)
+            if not problem and outfile in outputs:
+                problem = f"même fichier de sortie que la base {outputs[outfile]}"
+            outputs.setdefault(outfile, base["nom"])
+            if problem:
+                self.fail(base, problem, " — base ignorée")
+        return [base for base in self.bases if not self.report[base["nom"]]["erreur"]]
+
+    def submit(self, kind: str, item, fn, *args):
+        self.tasks[self.pool.submit(_batch_task, self.settings, fn, *args)] = (kind, item)
+
+    def schedule(self, base):
+        """Base volumineuse : confiée entière à un processus ; sinon lectures de ses fichiers pas encore demandés."""
+        try:
+            out_of_core = use_out_of_core(base["files"])
+        except OSError as exc:
+            self.fail(base, str(exc), " — base ignorée")
+            return
+        if out_of_core:
+            self.log(f"{base['nom']} : entrées volumineuses, mode hors mémoire")
+            if self.lineage:
+                self.log(f"{base['nom']} : lignage indisponible en mode hors mémoire")
+            self.submit("ecriture", base, _batch_out_of_core, base["files"], base["sortie"],
+                        self.history.path if self.history is not None else None)
+            return
+        base["ids"] = {(key, os.path.realpath(p)) for key, sheet, _, _ in SOURCE_READERS if sheet in self.sources
+                       for p in slot_paths(base["files"].get(key))}
+        self.waiting[base["nom"]] = set(base["ids"])
+        for file_id in base["ids"]:
+            self.uses += 1
+            if file_id not in self.users:
+                self.users[file_id] = set()
+                self.submit("lecture", file_id, _batch_read, *file_id)
+            self.users[file_id].add(base["nom"])
+
+    def submit_write(self, base):
+        """Réunit les sources lues de la base et demande l'écriture de son classeur."""
+        name = base["nom"]
+        dfs, seconds = {}, 0.0
+        for key, sheet, _, _ in SOURCE_READERS:
+            ids = [(key, os.path.realpath(p)) for p in slot_paths(base["files"].get(key)) if sheet in self.sources]
+            if not ids:
+                continue
+            dfs[sheet], dropped = union_frames([self.parsed[file_id][0] for file_id in ids])
+            seconds += sum(self.parsed[file_id][1] for file_id in ids)
+            if dropped:
+                self.log(f"{name} : {sheet} : {dropped} ligne(s) déjà présente(s) dans un fichier "
+                         f"précédent écartée(s)")
+        check_sheet_sizes({sheet: len(df) for sheet, df in dfs.items()}, lambda msg: self.log(f"{name} : {msg}"))
+        self.report[name]["lecture"], base["dfs"] = seconds, dfs
+        self.submit("ecriture", base, _batch_write, base["sortie"], dfs)
+
+    def release(self, base):
+        """Oublie les fichiers lus que plus aucune base n'attend."""
+        for file_id in base.get("ids", ()):
+            self.users[file_id].discard(base["nom"])
+            if not self.users[file_id]:
+                self.parsed.pop(file_id, None)
+
+    def read_done(self, file_id, future, todo: list):
+        """Fichier lu (ou illisible) : écriture des bases qui n'attendaient plus que lui."""
+        try:
+            self.parsed[file_id] = future.result()
+        except Exception as exc:
+            self.log(f"Lecture impossible : {file_id[1]} ({exc})")
+            self.parsed[file_id] = None
+        for base in todo:
+            name = base["nom"]
+            if file_id not in self.waiting.get(name, ()):
+                continue
+            self.waiting[name].discard(file_id)
+            if self.parsed[file_id] is None and not self.report[name]["erreur"]:
+                self.report[name]["erreur"] = f"lecture impossible : {os.path.basename(file_id[1])}"
+            if self.waiting[name]:
+                continue
+            del self.waiting[name]
+            if not self.report[name]["erreur"]:
+                try:
+                    self.submit_write(base)
+                except Exception as exc:
+                    self.report[name]["erreur"] = str(exc)
+                    self.log(f"{name} : échec ({exc})")
+            self.release(base)
+
+    def write_done(self, base, future):
+        """Classeur écrit (ou en échec) : Journal et historique de la base."""
+        name = base["nom"]
+        try:
+            global_values, seconds, messages = future.result()
+        except Exception as exc:
+            self.report[name]["erreur"] = str(exc)
+            self.log(f"{name} : échec ({exc})")
+            return
+        for msg in messages:
+            self.log(f"{name} : {msg}")
+        self.report[name]["ecriture"] = seconds
+        self.report[name]["fin"] = time.perf_counter() - self.started
+        if self.history is not None and global_values is not None:
+            record_history(self.history, base["sortie"], base["files"], base.pop("dfs"), global_values,
+                           lambda msg: self.log(f"{name} : {msg}"))
+        self.log(f"{name} : terminée ({self.report[name]['fin']:.1f} s)")
+
+    def run(self, workers: int):
+        from concurrent.futures import wait, FIRST_COMPLETED
+        todo = self.check_outputs()
+        self.history = open_history(self.log)
+        self.log(f"Lot : {len(todo)} base(s), {workers} processus")
+        with process_pool(workers, initializer=_batch_worker_init) as self.pool:
+            for base in todo:
+                self.schedule(base)
+            self.log(f"{len(self.users)} fichier(s) distinct(s) à lire pour {self.uses} source(s)")
+            for base in todo:
+                if base["nom"] in self.waiting and not self.waiting[base["nom"]]:
+                    del self.waiting[base["nom"]]
+                    self.submit_write(base)  # base sans source : classeur avec Global seul
+            while self.tasks:
+                done, _ = wait(self.tasks, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, item = self.tasks.pop(future)
+                    if kind == "lecture":
+                        self.read_done(item, future, todo)
+                    else:
+                        self.write_done(item, future)
+
+    def summary(self) -> int:
+        """Tableau récapitulatif dans le Journal ; nombre de bases en échec."""
+        self.log(f"{'Base':<20} {'Lecture':>9} {'Écriture':>9} {'Terminée':>9}  Résultat")
+        for base in self.bases:
+            entry = self.report[base["nom"]]
+            fmt = lambda s: f"{s:8.2f}s" if s is not None else f"{'—':>9}"
+            self.log(f"{base['nom']:<20} {fmt(entry['lecture'])} {fmt(entry['ecriture'])} {fmt(entry['fin'])}  "
+                     + (f"échec : {entry['erreur']}" if entry["erreur"] else "ok"))
+        failed = sum(1 for entry in self.report.values() if entry["erreur"])
+        self.log(f"Lot terminé en {time.perf_counter() - self.started:.1f} s : "
+                 f"{len(self.bases) - failed} base(s) écrite(s)" + (f", {failed} en échec" if failed else ""))
+        return failed
+
+def run_batch(manifest: str, workers: int | None = None, log=print) -> int:
+    """Consolide toutes les bases du manifeste (voir load_batch_manifest) ; 0 si toutes ont abouti."""
+    ensure_deps_loaded()
+    bases = load_batch_manifest(manifest)
+    if not bases:
+        log(f"Aucune base dans {manifest}")
+        return 1
+    batch = BatchRun(bases, log)
+    batch.run(workers or BATCH_WORKERS or os.cpu_count() or 1)
+    return 1 if batch.summary() else 0
+
+# -------- Banc d'essai de l'écriture --------
+# Mêmes sources nettoyées écrites avec chaque moteur de sortie : durée d'écriture (Global compris)
+# et taille du classeur produit.
+BENCHMARK_OUTPUTS = [
+    ("openpyxl", {"OUTPUT_ENGINE": "openpyxl"}),
+    ("xml, chaînes en ligne", {"OUTPUT_ENGINE": "xml", "OUTPUT_SHARED_STRINGS": False}),
+    ("xml, chaînes partagées", {"OUTPUT_ENGINE": "xml", "OUTPUT_SHARED_STRINGS": True}),
+    ("xlsxwriter", {"OUTPUT_ENGINE": "xlsxwriter"}),
+]
+
+def scan_export_folder(directory: str) -> dict:
+    """{case: chemin} des exports reconnus dans le dossier (le plus récent l'emporte)."""
+    files = {}
+    for entry in sorted(os.scandir(directory), key=lambda e: e.stat().st_mtime_ns):
+        if entry.name.lower().endswith(".xlsx") and not entry.name.startswith(("~$", ".~")):
+            key = classify_file(entry.path)
+            if key:
+                files[key] = entry.path
+    return files
+
+def run_benchmark(directory: str, repeat: int = 1, log=print) -> list:
+    """[(moteur, secondes (meilleure de repeat), octets)] pour les exports du dossier."""
+    import shutil
+    import tempfile
+    ensure_deps_loaded()
+    files = scan_export_folder(directory)
+    log("Entrées : " + ", ".join(f"{k} = {os.path.basename(p)}" for k, p in sorted(files.items())))
+    dfs = {name: reader(files[key]) for key, name, _, reader in SOURCE_READERS if files.get(key)}
+    workdir = tempfile.mkdtemp(prefix="nettoiexlsx_bench_")
+    results = []
+    try:
+        for label, settings in BENCHMARK_OUTPUTS:
+            if settings["OUTPUT_ENGINE"] == "xlsxwriter" and not _XLSXWRITER_AVAILABLE:
+                continue
+            with module_settings(**settings):
+                outfile = os.path.join(workdir, f"bench_{len(results)}.xlsx")
+                best = None
+                for _ in range(max(1, repeat)):
+                    started = time.perf_counter()
+                    write_consolidation(outfile, dfs, log=lambda msg: None)
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                results.append((label, best, os.path.getsize(outfile)))
+            log(f"{label:<24} {best:8.2f} s {results[-1][2] / 1024:10.0f} Ko")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+# -------- Corpus de référence --------
+# Les exemples d'exports livrés avec le script sont consolidés sans interface par chaque moteur ;
+# chaque feuille produite est ramenée à une forme canonique (valeurs et formats de nombre) et
+# comparée à un instantané enregistré auparavant. L'instantané versionné (reference.json, à côté
+# des exemples) est commun à tous : un écart introduit par quiconque est détecté partout. Une copie
+# locale (dossier de données) peut le remplacer. Les durées dépendent de la machine : elles sont
+# gardées à part, dans le dossier de données du poste, et seulement affichées (jamais un échec).
+GOLDEN_VARIANTS = [
+    ("pandas, openpyxl", {"ENGINE": "pandas", "OUTPUT_ENGINE": "openpyxl", "OUT_OF_CORE_MODE": "off"}),
+    ("pandas, xml", {"ENGINE": "pandas", "OUTPUT_ENGINE": "xml", "OUT_OF_CORE_MODE": "off"}),
+    ("pandas, xlsxwriter", {"ENGINE": "pandas", "OUTPUT_ENGINE": "xlsxwriter", "OUT_OF_CORE_MODE": "off"}),
+    ("polars, openpyxl", {"ENGINE": "polars", "OUTPUT_ENGINE": "openpyxl", "OUT_OF_CORE_MODE": "off"}),
+    ("hors mémoire", {"ENGINE": "pandas", "OUTPUT_ENGINE": "openpyxl", "OUT_OF_CORE_MODE": "on"}),
+]
+# Mêmes exports coupés en deux fichiers par case (réunion de plusieurs fichiers) : le résultat
+# doit rester celui de l'instantané, en mémoire comme hors mémoire
+GOLDEN_SPLIT_SLOTS = ["Commandes", "Factures"]
+GOLDEN_SPLIT_VARIANTS = [
+    ("pandas, 2 fichiers", {"ENGINE": "pandas", "OUTPUT_ENGINE": "openpyxl", "OUT_OF_CORE_MODE": "off"}),
+    ("hors mémoire, 2 fichiers", {"ENGINE": "pandas", "OUTPUT_ENGINE": "openpyxl", "OUT_OF_CORE_MODE": "on"}),
+]
+GOLDEN_TIME_TOLERANCE = 1.5  # au-delà de 1,5 fois la durée de référence du poste : signalé
+
+GOLDEN_SNAPSHOT_NAME = "reference.json"
+
+def default_golden_path(directory: str) -> str:
+    """Instantané versionné à côté des exports du corpus (NETTOIEXLSX_REFERENCE : autre fichier)."""
+    return os.environ.get("NETTOIEXLSX_REFERENCE") or os.path.join(directory, GOLDEN_SNAPSHOT_NAME)
+
+def local_golden_path() -> str:
+    """Instantané propre à ce poste (dossier de données), remplaçant facultatif du fichier versionné."""
+    return os.path.join(app_data_dir(), GOLDEN_SNAPSHOT_NAME)
+
+def golden_timings_path() -> str:
+    """Durées de référence de ce poste (NETTOIEXLSX_REFERENCE_DUREES : autre fichier)."""
+    return (os.environ.get("NETTOIEXLSX_REFERENCE_DUREES")
+            or os.path.join(app_data_dir(), "reference-durees.json"))
+
+def _write_json(path: str, data: dict):
+    import json
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with atomic_output(path) as tmp:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False, indent=1)
+
+def split_export(path: str, header_rows: int, folder: str) -> list:
+    """Deux copies de l'export dans folder : chacune garde les header_rows premières lignes (titre,
+    en-tête) et une moitié des lignes de données, la première moitié dans le premier fichier."""
+    from openpyxl import load_workbook as open_workbook
+    paths = []
+    for half in (0, 1):
+        wb = open_workbook(path)
+        ws = wb.worksheets[0]
+        last = ws.max_row
+        cut = header_rows + 1 + (last - header_rows) // 2  # première ligne du second fichier
+        if half == 0:
+            ws.delete_rows(cut, last - cut + 1)
+        else:
+            ws.delete_rows(header_rows + 1, cut - header_rows - 1)
+        paths.append(os.path.join(folder, f"{half + 1} - {os.path.basename(path)}"))
+        wb.save(paths[-1])
+    return paths
+
+def _canonical_value(v) -> str:
+    if v is None or (isinstance(v, str) and v == ""):
+        return ""
+    if isinstance(v, bool):
+        return f"b:{v}"
+    if isinstance(v, (int, float)):
+        return f"n:{float(v)!r}"  # 3 et 3.0 : même nombre pour Excel
+    if isinstance(v, (dt.datetime, dt.date, dt.time)):
+        return f"d:{v.isoformat()}"
+    return f"s:{v}"
+
+def canonical_workbook(path: str) -> dict:
+    """{feuille: [[(valeur, format), …], …]} ; cellules vides au format Standard retirées en fin de ligne."""
+    from openpyxl import load_workbook as open_workbook
+    wb = open_workbook(path, read_only=True)
+    try:
+        sheets = {}
+        for ws in wb.worksheets:
+            rows = []
+            for row in ws.iter_rows():
+                cells = [(_canonical_value(c.value), getattr(c, "number_format", "General") or "General")
+                         for c in row]
+                while cells and cells[-1] == ("", "General"):
+                    cells.pop()
+                rows.append(cells)
+            while rows and not rows[-1]:
+                rows.pop()
+            sheets[ws.title] = rows
+        return sheets
+    finally:
+        wb.close()
+
+def workbook_digests(sheets: dict) -> dict:
+    """{feuille: {"rows", "digest", "row_digests"}} : empreintes par feuille et par ligne."""
+    import hashlib
+    import json
+    out = {}
+    for name, rows in sheets.items():
+        row_digests = [hashlib.sha1(json.dumps(r, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+                       for r in rows]
+        out[name] = {"rows": len(rows),
+                     "digest": hashlib.sha256("".join(row_digests).encode("ascii")).hexdigest(),
+                     "row_digests": row_digests}
+    return out
+
+def compare_digests(expected: dict, found: dict) -> list:
+    """Écarts lisibles entre deux jeux d'empreintes (liste vide : identiques)."""
+    problems = []
+    if list(expected) != list(found):
+        problems.append(f"feuilles {list(found)} au lieu de {list(expected)}")
+    for name, ref in expected.items():
+        got = found.get(name)
+        if got is None or got["digest"] == ref["digest"]:
+            continue
+        if got["rows"] != ref["rows"]:
+            problems.append(f"{name} : {got['rows']} lignes au lieu de {ref['rows']}")
+        first = next((i for i, (a, b) in enumerate(zip(ref["row_digests"], got["row_digests"])) if a != b), None)
+        if first is not None:
+            problems.append(f"{name} : première ligne différente : {first + 1}")
+    return problems
+
+def run_golden(directory: str, snapshot: str | None = None, update: bool = False, log=print) -> int:
+    """Consolide les exports du dossier avec chaque variante et compare à l'instantané.
+
+    snapshot : fichier de l'instantané (None : default_golden_path, versionné avec les exports).
+    update : (ré)enregistre l'instantané à partir de la première variante (toutes doivent concorder).
+    Les durées sont comparées à celles du poste (golden_timings_path, enregistrées avec update ou
+    au premier passage) à titre indicatif. Code retour 0 = sorties conformes."""
+    import json
+    import shutil
+    import tempfile
+    ensure_deps_loaded()
+    snapshot = snapshot or default_golden_path(directory)
+    files = scan_export_folder(directory)
+    if not files:
+        log(f"Aucun export reconnu dans {directory}")
+        return 1
+    log("Entrées : " + ", ".join(f"{k} = {os.path.basename(p)}" for k, p in sorted(files.items())))
+    reference = None
+    if not update:
+        try:
+            with open(snapshot, encoding="utf-8") as fh:
+                reference = json.load(fh)
+        except FileNotFoundError:
+            log(f"Instantané absent ({snapshot}) : relancer avec l'enregistrement")
+            return 1
+        missing = sorted(set(reference.get("inputs", {})) - set(files))
+        if missing:
+            log(f"Exports manquants par rapport à l'instantané : {', '.join(missing)}")
+            return 1
+
+    try:
+        with open(golden_timings_path(), encoding="utf-8") as fh:
+            baselines = {} if update else json.load(fh).get("timings", {})
+    except (OSError, ValueError):
+        baselines = {}
+
+    workdir = tempfile.mkdtemp(prefix="nettoiexlsx_ref_")
+    failures = 0
+    expected = reference["sheets"] if reference else None
+    timings = {}
+    try:
+        split = dict(files)
+        for key, _, skip, *_ in OUT_OF_CORE_SOURCES:
+            if key in GOLDEN_SPLIT_SLOTS and key in files:
+                split[key] = split_export(files[key], skip + 1, workdir)
+        runs = [(label, settings, files) for label, settings in GOLDEN_VARIANTS]
+        runs += [(label, settings, split) for label, settings in GOLDEN_SPLIT_VARIANTS]
+        for label, settings, inputs in runs:
+            if settings["OUTPUT_ENGINE"] == "xlsxwriter" and not _XLSXWRITER_AVAILABLE:
+                log(f"{label:<24} ignorée (xlsxwriter indisponible)"); continue
+            if settings["ENGINE"] == "polars" and not _POLARS_AVAILABLE:
+                log(f"{label:<24} ignorée (polars indisponible)"); continue
+            with module_settings(**settings):
+                outfile = os.path.join(workdir, f"ref_{len(timings)}.xlsx")
+                started = time.perf_counter()
+                run_consolidation(inputs, outfile, log=lambda msg: None)
+                elapsed = time.perf_counter() - started
+            timings[label] = round(elapsed, 3)
+            found = workbook_digests(canonical_workbook(outfile))
+            if expected is None:
+                expected = found
+            problems = compare_digests(expected, found)
+            baseline = baselines.get(label)
+            timing = f"{elapsed:6.2f} s"
+            if baseline:
+                timing += f" (référence {baseline:.2f} s, {elapsed / baseline - 1:+.0%})"
+                if elapsed > baseline * GOLDEN_TIME_TOLERANCE:
+                    timing += " PLUS LENT"
+            log(f"{label:<24} {'conforme' if not problems else 'DIFFÉRENT'}  {timing}")
+            for problem in problems:
+                log(f"    {problem}")
+            failures += bool(problems)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if update and not failures:
+        _write_json(snapshot, {"created": dt.datetime.now().isoformat(timespec="seconds"),
+                               "inputs": {k: os.path.basename(p) for k, p in sorted(files.items())},
+                               "sheets": expected})
+        log(f"Instantané enregistré : {snapshot}")
+    if (update or not baselines) and not failures:
+        try:
+            _write_json(golden_timings_path(), {"created": dt.datetime.now().isoformat(timespec="seconds"),
+                                                "timings": timings})
+            log(f"Durées de référence de ce poste enregistrées : {golden_timings_path()}")
+        except OSError as exc:
+            log(f"Durées de référence non enregistrées : {exc}")
+    return 1 if failures else 0
+
+# -------- Essai différentiel des moteurs de Global --------
+# Le calcul d'origine (dictionnaires et Decimal, ligne à ligne) est figé ci-dessous et fait
+# référence : premier envoi retenu, dernier Workflow retenu, statut de constatation par BDC complet
+# puis par ses 5 premiers caractères, nombre/somme/date unique des factures, doublons stricts
+# écartés (sig_value). Les moteurs en service (calcul ligne à ligne actuel, agrégats Factures
+# compacts, Global compacte, partitions du mode hors mémoire, Polars) sont confrontés à lui sur des entrées générées pour
+# piéger les cas limites. Ne pas modifier la référence pour suivre un moteur.
+def reference_facture_totals(df_fact) -> dict:
+    """Agrégats Factures de référence : {BDC: {'count', 'sum', 'date', 'raw'}} (copie figée)."""
+    # Factures -> agrégats pour I (Payé) et J (Solde)
+    # Stocke date parsée ET valeur brute pour le cas 1 facture sans date exploitable
+    fact_agg = {}  # bdc -> {'count': n, 'sum': Decimal, 'date': dt.date|None, 'raw': Any|None}
+    if df_fact is not None and not df_fact.empty and "N° commande" in df_fact.columns:
+        for _, r in df_fact.iterrows():
+            key = str(r.get("N° commande", "")).strip()
+            if not key: continue
+            amt = to_decimal(r.get("Montant HT"))
+            raw_date = r.get("Date de règlement")
+            dreg = to_date_only(raw_date)  # dt.date | "" | original si non parsé
+
+            if key not in fact_agg:
+                fact_agg[key] = {'count': 0, 'sum': Decimal('0'), 'date': None, 'raw': None}
+
+            fact_agg[key]['count'] += 1
+            fact_agg[key]['sum'] += amt
+
+            if fact_agg[key]['count'] == 1:
+                fact_agg[key]['date'] = dreg if isinstance(dreg, dt.date) else None
+                fact_agg[key]['raw']  = raw_date
+            else:
+                fact_agg[key]['date'] = None
+                fact_agg[key]['raw']  = None
+    return fact_agg
+
+def _reference_rows(df_cmd, df_envoi, fact_agg, df_wf, df_const):
+    """Jointures et lignes de Global de référence (copie figée), agrégats Factures fournis."""
+    if df_cmd is None or df_cmd.empty or "N° commande" not in df_cmd.columns:
+        return
+
+    # Envoi BDC -> F
+    envoi_lookup = {}
+    if df_envoi is not None and not df_envoi.empty:
+        for _, r in df_envoi.iterrows():
+            key = str(r.get("Commande", "")).strip()
+            if not key: continue
+            b_txt = date_to_text_dmy(r.get("Date envoi"))
+            c_txt = "" if pd.isna(r.get("Agent")) else str(r.get("Agent")).strip()
+            val = f"{b_txt} {c_txt}".strip() if (b_txt or c_txt) else ""
+            if key not in envoi_lookup:
+                envoi_lookup[key] = val
+
+    # Workflow -> H
+    wf_lookup = {}
+    wf_bdc_col, wf_val_col = choose_workflow_value_column(df_wf)
+    if df_wf is not None and not df_wf.empty and wf_bdc_col is not None:
+        for _, r in df_wf.iterrows():
+            key = str(r.get(wf_bdc_col, "")).strip()
+            if not key: continue
+            v = r.get(wf_val_col) if wf_val_col else ""
+            v = to_date_only(v)
+            wf_lookup[key] = v
+
+    # Constatation -> Statut (pour G)
+    const_stat_by_full, const_stat_by_extract = {}, {}
+    if df_const is not None and not df_const.empty:
+        for _, r in df_const.iterrows():
+            key_full = str(r.get("Commande", "")).strip()
+            key_ex = str(r.get("extrait commande", "")).strip()
+            st = r.get("Statut")
+            if key_full: const_stat_by_full[key_full] = st
+            if key_ex: const_stat_by_extract[key_ex] = st
+
+    # Déduplication stricte : signature (toutes colonnes)
+    seen_signatures = set()
+
+    # Lignes Global
+    for idx, row in df_cmd.iterrows():
+        bdc = str(row.get("N° commande", "")).strip()
+        if not bdc: continue
+
+        b = row.get("Libellé", "-")
+        c = row.get("Fournisseur", "-")
+        d_val_raw = row.get("Montant HT", "0")
+        d = d_val_raw
+        e = row.get("Ind. Visa", "-")
+        f = envoi_lookup.get(bdc, "")
+
+        # G (SF)
+        g = "Pas de SF connu"
+        c_norm = str(c).strip().upper()
+        if c_norm == "BNP PARIBAS - REGULARISATION CARTE ACHAT":
+            g = "ss objet Régul CA"
+        else:
+            f_norm = strip_accents(str(f)).lower()
+            if "ss objet regul ca" in f_norm:
+                st = const_stat_by_full.get(bdc)
+                if st is None or (isinstance(st, float) and pd.isna(st)):
+                    st = const_stat_by_extract.get(bdc[:5])
+                g = st if st not in (None, "") and not (isinstance(st, float) and pd.isna(st)) else "Pas de SF connu"
+
+        # H (WORKFLOW)
+        h = wf_lookup.get(bdc, "")
+
+        # I (PAYE)
+        fa = fact_agg.get(bdc)
+        if fa is None or fa['count'] == 0:
+            i = "pas de paiement connu"
+        elif fa['count'] == 1:
+            if isinstance(fa['date'], dt.date):
+                i = fa['date']  # vraie date
+            else:
+                raw = fa['raw']
+                txt = date_to_text_dmy(raw) if raw not in (None, "") else "date manquante"
+                i = txt
+        else:
+            n = fa['count']
+            i = f"{n} paiement" + ("s" if n >= 2 else "")
+
+        # J (SOLDE) = D - somme(Montant HT factures)
+        total_fact = fact_agg.get(bdc, {'sum': Decimal('0')})['sum']
+        d_amount = to_decimal(d_val_raw)
+        solde = d_amount - total_fact
+        j = float(solde)
+
+        # K (STATUT)
+        k = row.get("Statut", "-")
+
+        row_values = [bdc, b, c, d, e, f, g, h, i, j, k]
+        signature = tuple(sig_value(x) for x in row_values)
+        if signature in seen_signatures:
+            continue  # doublon strict -> on ignore
+        seen_signatures.add(signature)
+
+        yield idx, row_values
+
+def reference_global_rows(df_cmd, df_envoi, df_fact, df_wf, df_const):
+    """Moteur de référence : copie figée du calcul d'origine de Global, (index Commande, valeurs A..K)."""
+    return _reference_rows(df_cmd, df_envoi, reference_facture_totals(df_fact), df_wf, df_const)
+
+def compact_facture_rows(df_cmd, df_envoi, df_fact, df_wf, df_const):
+    """Référence dont seuls les agrégats Factures viennent de FactureTotals (centimes int64, ordinal
+    de la première date, somme Decimal exacte au besoin) : isole l'agrégation compacte."""
+    totals = FactureTotals.from_frame(df_fact)
+    fact_agg = {}
+    for key, pos in totals.positions.items():
+        count = totals.count(pos)
+        fact_agg[key] = {'count': count, 'sum': totals.total(pos),
+                         'date': totals.single_date(pos) if count == 1 else None,
+                         'raw': totals.raw.get(pos) if count == 1 else None}
+    return _reference_rows(df_cmd, df_envoi, fact_agg, df_wf, df_const)
+
+def live_global_rows(df_cmd, df_envoi, df_fact, df_wf, df_const):
+    """Calcul ligne à ligne en service (build_global_lookups + iter_global_rows)."""
+    return iter_global_rows(df_cmd, build_global_lookups(df_envoi, df_fact, df_wf, df_const))
+
+def partitioned_global_rows(df_cmd, df_envoi, df_fact, df_wf, df_const):
+    """Global calculée comme en mode hors mémoire : partitions par hachage du BDC puis fusion."""
+    store = SpillStore()
+    try:
+        wf_cols = [] if df_wf is None else [c for c in workflow_columns(list(df_wf.columns))[:1] if c is not None]
+        sources = [("Commande", df_cmd, ["N° commande"]), ("Envoi BDC", df_envoi, ["Commande"]),
+                   ("Factures", df_fact, ["N° commande"]), ("Workflow", df_wf, wf_cols),
+                   ("Constatation", df_const, ["Commande", "extrait commande"])]
+        for name, df, key_cols in sources:
+            if df is not None:
+                store.append(name, df, [df[c] for c in key_cols])
+        spill_global(store, live_global_rows)
+        return list(store.iter_global())
+    finally:
+        store.close()
+
+def differential_engines() -> list:
+    engines = [("référence", reference_global_rows), ("ligne à ligne", live_global_rows),
+               ("agrégats Factures", compact_facture_rows), ("partitions", partitioned_global_rows),
+               ("compact", lambda *args: GlobalTable.from_rows(live_global_rows(*args)).items())]
+    if _POLARS_AVAILABLE:
+        engines.append(("polars", iter_global_rows_polars))
+    return engines
+
+def random_global_inputs(rng, n_cmd: int):
+    """Sources nettoyées factices : BDC float/str/espacés/tronqués, NaN, clés en double,
+    dates illisibles, montants à la française, lignes strictement identiques."""
+    nan = float("nan")
+    bdcs = [12690, 12690.0, "12690", " 12690 ", "12691", "1269", "126901", nan, "", "ABCDE1", 13438, "13438"]
+    values = ["x", nan, "", None, 3, "Reçu", "ss objet Régul CA"]
+    dates = [dt.datetime(2026, 1, 5, 10, 30), "05/01/2026", "2026-01-05", "bad", nan, "", dt.date(2026, 2, 1),
+             "05/01/2026 10:30", "31/02/2026", pd.Timestamp("2025-12-31 23:59")]
+    # 1e-7, "0,005" et 2e13 (au-delà de FactureTotals.MAX_CENTS) passent par la somme Decimal exacte
+    amounts = [36.75, "36,75", "1 234,56 €", nan, "", 110.25, "abc", 0.1, 1e-7, -5, "-12,5", "0,005", 2e13]
+    suppliers = ["DELL", "BNP PARIBAS - REGULARISATION CARTE ACHAT", nan, " bnp paribas - regularisation carte achat "]
+
+    def pick(choices, n):
+        return [rng.choice(choices) for _ in range(n)]
+
+    cmd = pd.DataFrame({"N° commande": pick(bdcs, n_cmd), "Libellé": pick(values, n_cmd),
+                        "Fournisseur": pick(suppliers, n_cmd), "Montant HT": pick(amounts, n_cmd),
+                        "Type de flux": None, "Nature de dépense": None, "Statut": pick(values, n_cmd),
+                        "Ind. Visa": pick(values, n_cmd), "Auteur": None}, dtype=object)
+    if n_cmd and rng.random() < 0.5:  # doublons stricts
+        cmd = pd.concat([cmd, cmd.sample(n=rng.randint(1, n_cmd), random_state=rng.randint(0, 2**31))],
+                        ignore_index=True)
+    k = rng.randint(0, max(n_cmd, 1))
+    envoi = pd.DataFrame({"Commande": pick(bdcs, k), "Date envoi": pick(dates, k),
+                          "Agent": pick(["Dupont", nan, "ss objet Régul CA", "SS OBJET REGUL CA x"], k)}, dtype=object)
+    k = rng.randint(0, max(n_cmd, 1))
+    fact = pd.DataFrame({"N° commande": pick(bdcs, k), "Montant HT": pick(amounts, k),
+                         "Date de règlement": pick(dates, k)}, dtype=object)
+    k = rng.randint(0, max(n_cmd // 2, 1))
+    wf = pd.DataFrame({"BDC": pick(bdcs, k), "Date": pick(dates, k), "X": 1}, dtype=object)
+    k = rng.randint(0, max(n_cmd // 2, 1))
+    keys = pick(bdcs, k)
+    const = pd.DataFrame({"Commande": keys, "extrait commande": pd.Series(keys, dtype=object).astype(str).str.slice(0, 5),
+                          "Statut": pick(values, k)}, dtype=object)
+    # une source peut manquer
+    return tuple([cmd] + [df if rng.random() > 0.1 else None for df in (envoi, fact, wf, const)])
+
+def _comparable_rows(rows) -> list:
+    return [(idx, tuple(sig_value(v) for v in values), tuple(type(v).__name__ for v in values))
+            for idx, values in rows]
+
+def run_differential(cases: int = 300, seed: int = 0, volume: int = 20000, log=print) -> int:
+    """Confronte chaque moteur à la référence sur cases jeux aléatoires (graines seed…) puis mesure
+    le débit sur un jeu de volume lignes Commande. Code retour 0 = aucun écart."""
+    import random
+    ensure_deps_loaded()
+    engines = differential_engines()
+    failures = 0
+    for case in range(seed, seed + cases):
+        args = random_global_inputs(random.Random(case), random.Random(case).randint(0, 40))
+        expected = _comparable_rows(reference_global_rows(*args))
+        for label, engine in engines[1:]:
+            found = _comparable_rows(engine(*args))
+            if found == expected:
+                continue
+            failures += 1
+            first = next((i for i, (a, b) in enumerate(zip(expected, found)) if a != b), min(len(expected), len(found)))
+            log(f"Graine {case}, moteur {label} : écart à la ligne {first + 1} "
+                f"({len(found)} lignes au lieu de {len(expected)})")
+            if first < len(expected):
+                log(f"    référence : {expected[first]}")
+            if first < len(found):
+                log(f"    {label} : {found[first]}")
+    log(f"{cases} jeux aléatoires (graines {seed} à {seed + cases - 1}) : "
+        + ("aucun écart" if not failures else f"{failures} écart(s)"))
+
+    if volume:
+        args = random_global_inputs(random.Random(seed), volume)
+        n = len(args[0])
+        for label, engine in engines:
+            started = time.perf_counter()
+            produced = len(list(engine(*args)))
+            elapsed = time.perf_counter() - started
+            log(f"{label:<18} {n / elapsed:12.0f} lignes Commande/s ({elapsed:.2f} s, {produced} lignes Global)")
+    return 1 if failures else 0
+
+# -------- Surveillance d'un dossier --------
+# Les exports Geslab/DMF déposés dans le dossier sont rangés dans leur case (contenu, puis nom) ;
+# la consolidation est refaite quand les fichiers n'ont plus bougé depuis WATCH_DEBOUNCE_S.
+WATCH_INTERVAL_S = 2.0
+WATCH_DEBOUNCE_S = 5.0
+WATCH_DEFAULT_OUTFILE = "Consolidation SAG.xlsx"
+
+# Testés dans l'ordre sur le nom normalisé (sans accents, minuscules)
+WATCH_NAME_PATTERNS = [
+    ("EnvoiBDC", re.compile(r"\benvoi\b.*\bbdc\b")),
+    ("Workflow", re.compile(r"\bworkflow\b")),
+    ("Constatations", re.compile(r"\bconstatations?\b")),
+    ("Factures", re.compile(r"\bfactures?\b")),
+    ("Commandes", re.compile(r"\bcommandes?\b")),
+]
+
+def classify_by_name(path: str):
+    """Case du formulaire d'après le nom du fichier, ou None."""
+    stem = normalize_colname(os.path.splitext(os.path.basename(path))[0])
+    for key, pattern in WATCH_NAME_PATTERNS:
+        if pattern.search(stem):
+            return key
+    return None
+
+def classify_file(path: str):
+    """Case d'un fichier : d'après son contenu, sinon d'après son nom."""
+    return classify_workbook(path) or classify_by_name(path)
+
+class FolderWatcher:
+    """Surveille un dossier (scrutation) et republie la consolidation à chaque nouvel export stable."""
+
+    def __init__(self, directory: str, outfile: str | None = None, log=print,
+                 interval: float | None = None, debounce: float | None = None):
+        self.directory = os.path.abspath(directory)
+        self.outfile = os.path.abspath(outfile or os.path.join(self.directory, WATCH_DEFAULT_OUTFILE))
+        self.log = log
+        self.interval = WATCH_INTERVAL_S if interval is None else interval
+        self.debounce = WATCH_DEBOUNCE_S if debounce is None else debounce
+        self.cache = SourceCache()
+        self.stop_event = threading.Event()
+        self._changed_at = {}     # chemin -> ((taille, mtime), instant du dernier changement vu)
+        self._ignored = set()
+        self._kinds = {}          # chemin -> ((taille, mtime), case reconnue)
+        self._done = None         # signature des entrées du dernier traitement (réussi ou non)
+
+    def scan(self) -> dict:
+        """{chemin: (taille, mtime_ns)} des .xlsx du dossier, hors sortie et fichiers de verrou Excel."""
+        found = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if not name.lower().endswith(".xlsx") or name.startswith("~$") or not entry.is_file():
+                    continue
+                path = os.path.abspath(entry.path)
+                if os.path.normcase(path) == os.path.normcase(self.outfile):
+                    continue
+                st = entry.stat()
+                found[path] = (st.st_size, st.st_mtime_ns)
+        return found
+
+    def assign(self, snapshot: dict) -> dict:
+        """Fichier retenu par case : le plus récemment modifié."""
+        files = {}
+        for path, (_, mtime) in snapshot.items():
+            known = self._kinds.get(path)
+            if known is None or known[0] != snapshot[path]:
+                known = self._kinds[path] = (snapshot[path], classify_file(path))
+            key = known[1]
+            if key is None:
+                if path not in self._ignored:
+                    self._ignored.add(path)
+                    self.log(f"Fichier non reconnu, ignoré : {os.path.basename(path)}")
+                continue
+            if key not in files or mtime > snapshot[files[key]][1]:
+                files[key] = path
+        return files
+
+    def poll_once(self, now: float | None = None) -> bool:
+        """Un passage de scrutation ; True si une consolidation a été publiée."""
+        now = time.monotonic() if now is None else now
+        snapshot = self.scan()
+        for path, sig in snapshot.items():
+            seen = self._changed_at.get(path)
+            if seen is None or seen[0] != sig:
+                self._changed_at[path] = (sig, now)
+        for path in set(self._changed_at) - set(snapshot):
+            del self._changed_at[path]
+
+        files = self.assign(snapshot)
+        if not files:
+            return False
+        signature = {key: (path, snapshot[path]) for key, path in files.items()}
+        if signature == self._done:
+            return False
+        if any(now - self._changed_at[path][1] < self.debounce for path in files.values()):
+            return False  # écriture encore en cours : on attend que les fichiers se stabilisent
+
+        self._done = signature
+        self.log("Nouvelles entrées : " + ", ".join(f"{k} = {os.path.basename(p)}" for k, p in sorted(files.items())))
+        started = time.perf_counter()
+        try:
+            run_consolidation({key: files.get(key, "") for key, *_ in SOURCE_READERS}, self.outfile,
+                              log=self.log, history=open_history(self.log), cache=self.cache)
+        except Exception as exc:
+            self.log(f"✖ Erreur : {exc}")
+            return False
+        self.log(f"✔ Consolidation publiée en {time.perf_counter() - started:.1f} s : {self.outfile}")
+        return True
+
+    def run_forever(self):
+        self.log(f"Surveillance de {self.directory} (sortie : {self.outfile})")
+        while True:
+            try:
+                self.poll_once()
+            except OSError as exc:
+                self.log(f"✖ Dossier inaccessible : {exc}")
+            if self.stop_event.wait(self.interval):
+                return
+
+    def stop(self):
+        self.stop_event.set()
+
+# -------- Service HTTP local --------
+# Un seul processus, dépendances chargées au démarrage, sources nettoyées gardées en cache :
+# les postes envoient leurs fichiers (ou leurs chemins) et récupèrent le classeur consolidé.
+#   POST /travaux               multipart (champs Commandes, Constatations, Factures, EnvoiBDC, Workflow)
+#                               ou JSON {"Commandes": "chemin", ...} -> 202 + état du travail
+#   GET  /travaux/<id>          état du travail (JSON)
+#   GET  /travaux/<id>/resultat classeur consolidé (.xlsx)
+#   POST /consolider            comme /travaux, mais attend la fin et renvoie le classeur
+#   GET  /sante                 état du service
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+SERVICE_WORKERS = 2
+SERVICE_CACHE_ENTRIES = 4       # versions de chaque source gardées en mémoire
+SERVICE_MAX_JOBS = 50           # travaux terminés conservés (fichiers compris)
+SERVICE_MAX_UPLOAD = 512 * 1024 * 1024
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+SLOT_KEYS = [key for key, *_ in SOURCE_READERS]
+
+class ConsolidationJob:
+    def __init__(self, job_id: str, files: dict, outfile: str, workdir: str):
+        self.id = job_id
+        self.files = files
+        self.outfile = outfile
+        self.workdir = workdir
+        self.status = "en attente"
+        self.error = None
+        self.messages = []
+        self.created = time.time()
+        self.duration = None
+        self.done = threading.Event()
+
+    def to_json(self) -> dict:
+        return {"id": self.id, "statut": self.status, "erreur": self.error, "journal": self.messages,
+                "duree_s": self.duration, "fichiers": {k: os.path.basename(v) for k, v in self.files.items() if v}}
+
+class ConsolidationService:
+    """File de travaux traitée par des threads dont les dépendances sont déjà chargées."""
+
+    def __init__(self, workers: int | None = None, log=print):
+        import queue
+        import tempfile
+        self.workers = workers or SERVICE_WORKERS
+        self.log = log
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.cache = SourceCache(max_entries=SERVICE_CACHE_ENTRIES, by_content=True)
+        self.workdir = tempfile.mkdtemp(prefix="nettoiexlsx_service_")
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._threads = []
+
+    def start(self):
+        ensure_deps_loaded()  # chargement + préchauffage avant d'accepter des travaux
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"consolidation-{i + 1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        import shutil
+        for _ in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join(timeout=30)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def submit(self, paths: dict | None = None, uploads: dict | None = None) -> ConsolidationJob:
+        """paths : {case: chemin côté serveur} ; uploads : {case: (nom de fichier, contenu)}."""
+        with self._lock:
+            self._counter += 1
+            job_id = f"{self._counter:06d}"
+        job_dir = os.path.join(self.workdir, job_id)
+        os.makedirs(job_dir)
+        files = {key: "" for key in SLOT_KEYS}
+        for key, path in (paths or {}).items():
+            if key not in files:
+                raise ValueError(f"case inconnue : {key}")
+            if path and not os.path.isfile(path):
+                raise ValueError(f"fichier introuvable : {path}")
+            files[key] = path or ""
+        for key, (filename, content) in (uploads or {}).items():
+            if key not in files:
+                raise ValueError(f"case inconnue : {key}")
+            path = os.path.join(job_dir, f"{key}_{os.path.basename(filename or key)}")
+            if not path.lower().endswith(".xlsx"):
+                path += ".xlsx"
+            with open(path, "wb") as fh:
+                fh.write(content)
+            files[key] = path
+        if not any(files.values()):
+            raise ValueError("aucun fichier à traiter")
+        job = ConsolidationJob(job_id, files, os.path.join(job_dir, "export_clean.xlsx"), job_dir)
+        with self._lock:
+            self.jobs[job_id] = job
+        self.queue.put(job)
+        self._forget_old()
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.status = "en cours"
+            started = time.perf_counter()
+            try:
+                run_consolidation(job.files, job.outfile, log=job.messages.append,
+                                  history=open_history(job.messages.append), cache=self.cache)
+                job.status = "terminé"
+            except Exception as exc:
+                job.status, job.error = "erreur", str(exc)
+            job.duration = round(time.perf_counter() - started, 3)
+            job.done.set()
+            self.log(f"Travail {job.id} : {job.status} en {job.duration} s")
+
+    def _forget_old(self):
+        import shutil
+        with self._lock:
+            finished = [j for j in self.jobs.values() if j.done.is_set()]
+            for job in finished[:max(0, len(finished) - SERVICE_MAX_JOBS)]:
+                del self.jobs[job.id]
+                shutil.rmtree(job.workdir, ignore_errors=True)
+
+def _parse_multipart(content_type: str, body: bytes) -> dict:
+    """{case: (nom de fichier, contenu)} d'un formulaire multipart/form-data."""
+    from email.parser import BytesParser
+    from email.policy import HTTP
+    message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    uploads = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        content = part.get_payload(decode=True)
+        if name and content:
+            uploads[name] = (part.get_filename() or name, content)
+    return uploads
+
+def _make_service_handler(service: ConsolidationService):
+    from http.server import BaseHTTPRequestHandler
+    import json
+
+    class Handler(BaseHTTPRequestHandler):
+        server_version = "NettoieXLSX"
+
+        def log_message(self, fmt, *args):
+            service.log(f"{self.address_string()} {fmt % args}")
+
+        def _json(self, code: int, payload: dict):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _xlsx(self, job: ConsolidationJob):
+            with open(job.outfile, "rb") as fh:
+                data = fh.read()
+            self.send_response(200)
+            self.send_header("Content-Type", XLSX_MIME)
+            self.send_header("Content-Disposition", f'attachment; filename="export_clean_{job.id}.xlsx"')
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _submit(self) -> ConsolidationJob:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > SERVICE_MAX_UPLOAD:
+                raise ValueError("envoi trop volumineux")
+            body = self.rfile.read(length)
+            ctype = self.headers.get("Content-Type", "")
+            if ctype.startswith("multipart/form-data"):
+                return service.submit(uploads=_parse_multipart(ctype, body))
+            try:
+                paths = json.loads(body.decode("utf-8") or "{}")
+            except ValueError as exc:  # UnicodeDecodeError et JSONDecodeError compris
+                raise ValueError(f"corps JSON illisible : {exc}") from None
+            if not isinstance(paths, dict) or not all(isinstance(p, str) for p in paths.values()):
+                raise ValueError('corps JSON attendu : objet {"case": "chemin", …}')
+            return service.submit(paths=paths)
+
+        def do_GET(self):
+            parts = [p for p in self.path.split("?")[0].split("/") if p]
+            if parts == ["sante"]:
+                return self._json(200, {"statut": "ok", "workers": service.workers, "en_attente": service.queue.qsize()})
+            job = service.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "travaux" else None
+            if job is None:
+                return self._json(404, {"erreur": "introuvable"})
+            if len(parts) == 2:
+                return self._json(200, job.to_json())
+            if parts[2] != "resultat":
+                return self._json(404, {"erreur": "introuvable"})
+            if job.status != "terminé":
+                return self._json(409, job.to_json())
+            return self._xlsx(job)
+
+        def do_POST(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path not in ("/travaux", "/consolider"):
+                return self._json(404, {"erreur": "introuvable"})
+            try:
+                job = self._submit()
+            except (ValueError, UnicodeDecodeError) as exc:
+                return self._json(400, {"erreur": str(exc)})
+            if path == "/travaux":
+                return self._json(202, job.to_json())
+            job.done.wait()
+            if job.status != "terminé":
+                return self._json(500, job.to_json())
+            return self._xlsx(job)
+
+    return Handler
+
+def serve(host: str | None = None, port: int | None = None, workers: int | None = None, log=print):
+    """Lance le service HTTP local (bloquant, Ctrl+C pour arrêter)."""
+    from http.server import ThreadingHTTPServer
+    service = ConsolidationService(workers, log=log)
+    log("Chargement des dépendances…")
+    service.start()
+    httpd = ThreadingHTTPServer((host or SERVICE_HOST, SERVICE_PORT if port is None else port),
+                                _make_service_handler(service))
+    log(f"Service prêt sur http://{httpd.server_address[0]}:{httpd.server_address[1]} ({service.workers} workers)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.stop()
+
+class BdcSearchWindow(tk.Toplevel):
+    """Panneau de recherche : BDC du dernier traitement filtrés à la frappe (BdcIndex), et toutes les
+    lignes du BDC choisi dans Global et dans chaque source."""
+    MAX_MATCHES = 200
+
+    def __init__(self, master, index: BdcIndex, text: str = ""):
+        super().__init__(master)
+        self.title("Recherche BDC — dernier traitement")
+        self.geometry("980x560")
+        self.index = index
+
+        top = ttk.Frame(self)
+        top.pack(fill="x", padx=10, pady=8)
+        ttk.Label(top, text="BDC ou début du numéro :").pack(side="left")
+        self.query_var = tk.StringVar(value=text)
+        entry = ttk.Entry(top, textvariable=self.query_var, width=24)
+        entry.pack(side="left", padx=6)
+        self.count_var = tk.StringVar()
+        ttk.Label(top, textvariable=self.count_var).pack(side="left", padx=6)
+
+        body = ttk.PanedWindow(self, orient="horizontal")
+        body.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        self.matches = tk.Listbox(body, width=22, exportselection=False)
+        detail_frame = ttk.Frame(body)
+        self.detail = tk.Text(detail_frame, wrap="none", font="TkFixedFont", bg="#ffffff")
+        yscroll = ttk.Scrollbar(detail_frame, command=self.detail.yview)
+        xscroll = ttk.Scrollbar(detail_frame, orient="horizontal", command=self.detail.xview)
+        self.detail.configure(yscrollcommand=yscroll.set, xscrollcommand=xscroll.set)
+        self.detail.grid(row=0, column=0, sticky="nsew")
+        yscroll.grid(row=0, column=1, sticky="ns")
+        xscroll.grid(row=1, column=0, sticky="we")
+        detail_frame.grid_rowconfigure(0, weight=1)
+        detail_frame.grid_columnconfigure(0, weight=1)
+        body.add(self.matches, weight=0)
+        body.add(detail_frame, weight=1)
+
+        self.query_var.trace_add("write", lambda *_: self._search())
+        self.matches.bind("<<ListboxSelect>>", lambda e: self._show_selected())
+        entry.bind("<Return>", lambda e: self._show_selected())
+        entry.focus_set()
+        self._search()
+
+    def _search(self):
+        keys, total = self.index.search(self.query_var.get(), self.MAX_MATCHES)
+        self.matches.delete(0, "end")
+        for key in keys:
+            self.matches.insert("end", key)
+        self.count_var.set(f"{total} BDC" + (f" ({len(keys)} premiers affichés)" if total > len(keys) else ""))
+        if keys:
+            self.matches.selection_set(0)
+        self._show_selected()
+
+    def _show_selected(self):
+        selection = self.matches.curselection()
+        self.detail.delete("1.0", "end")
+        if selection:
+            self.detail.insert("end", "\n".join(self.index.describe(self.matches.get(selection[0]))))
+
+# -------- GUI --------
+class App(tk.Tk):
+    def __init__(self):
+        super().__init__()
+        STARTUP.mark("Tk initialisé")
+        self.title("Nettoie XLSX — V15")
+        self.geometry("1060x740")
+        self.minsize(980, 700)
+
+        # ttk standard pour le premier affichage ; ttkbootstrap est appliqué ensuite (_attach_deferred)
+        style = ttk.Style()
+        if "clam" in style.theme_names():
+            style.theme_use("clam")
+        self._drop_targets = []  # [(entry, var)] enregistrés au chargement de tkinterdnd2
+
+        self.configure(bg="#eef6ff")
+        padding = {"padx": 16, "pady": 10}
+        frm = tk.Frame(self, bg="#eef6ff")
+        frm.pack(fill="both", expand=True, **padding)
+        # la racine est un tk.Tk ordinaire, sans méthodes tkinterdnd2 : le dépôt sur la fenêtre
+        # passe par ce cadre, qui contient tout le reste (tkdnd remonte aux parents du widget survolé)
+        self._window_drop_target = frm
+
+        title_font = tkfont.Font(size=16, weight="bold")
+        subtitle_font = tkfont.Font(size=10)
+
+        header = tk.Frame(frm, bg="#d9f1ff", highlightthickness=1, highlightbackground="#b6dbf7")
+        header.grid(row=0, column=0, columnspan=3, sticky="we", pady=(0, 12))
+        ttk.Label(
+            header,
+            text="✨ Nettoie XLSX — Consolidation SAG",
+            font=title_font,
+            background="#d9f1ff",
+        ).pack(anchor="w", padx=12, pady=(8, 0))
+        ttk.Label(
+            header,
+            text="Importez vos fichiers sources, lancez le traitement et obtenez un export consolidé avec l’onglet Global.",
+            font=subtitle_font,
+            background="#d9f1ff",
+        ).pack(anchor="w", padx=12, pady=(0, 8))
+
+        # Variables
+        self.commandes_var = tk.StringVar()
+        self.constatations_var = tk.StringVar()
+        self.factures_var = tk.StringVar()
+        self.envoi_var = tk.StringVar()
+        self.workflow_var = tk.StringVar()
+        self.outfile_var = tk.StringVar()
+        self.status_var = tk.StringVar(value="Prêt")
+
+        # Lignes fichiers (ordre demandé)
+        src_frame = tk.LabelFrame(
+            frm,
+            text="Fichiers sources",
+            bg="#f7fbff",
+            fg="#1f4a7c",
+            highlightthickness=1,
+            highlightbackground="#c6dcf5",
+        )
+        src_frame.grid(row=1, column=0, columnspan=3, sticky="we", pady=(0, 10))
+        src_frame.grid_columnconfigure(1, weight=1)
+        self._row_file(src_frame, 0, "Commandes (.xlsx)", self.commandes_var)
+        self._row_file(src_frame, 1, "Constatations (.xlsx)", self.constatations_var)
+        self._row_file(src_frame, 2, "Factures (.xlsx)", self.factures_var)
+        self._row_file(src_frame, 3, "Envoi BDC (.xlsx)", self.envoi_var)
+        self._row_file(src_frame, 4, "Workflow (.xlsx)", self.workflow_var)
+
+        # Sortie
+        out_frame = tk.LabelFrame(
+            frm,
+            text="Export",
+            bg="#f7fbff",
+            fg="#1f4a7c",
+            highlightthickness=1,
+            highlightbackground="#c6dcf5",
+        )
+        out_frame.grid(row=2, column=0, columnspan=3, sticky="we", pady=(0, 10))
+        out_frame.grid_columnconfigure(1, weight=1)
+        ttk.Label(out_frame, text="Fichier de sortie (.xlsx)", background="#f7fbff").grid(
+            row=0, column=0, sticky="w", padx=8, pady=6
+        )
+        ttk.Entry(out_frame, textvariable=self.outfile_var).grid(row=0, column=1, sticky="we", padx=8, pady=6)
+        ttk.Button(out_frame, text="Parcourir…", command=self._pick_outfile).grid(row=0, column=2, sticky="we", padx=8, pady=6)
+        # Feuilles à produire : seules les étapes nécessaires sont exécutées (Pipeline)
+        self._output_presets = dict(OUTPUT_PRESETS)
+        selected = output_selection(OUTPUT_SELECTION)
+        label = next((k for k, v in OUTPUT_PRESETS if set(v) == selected), None)
+        if label is None:  # sélection de NETTOIEXLSX_SORTIES / --sorties hors des choix proposés
+            label = ", ".join(name for name in OUTPUT_NAMES if name in selected)
+            self._output_presets[label] = sorted(selected, key=OUTPUT_NAMES.index)
+        self.outputs_var = tk.StringVar(value=label)
+        ttk.Label(out_frame, text="Feuilles à produire", background="#f7fbff").grid(
+            row=1, column=0, sticky="w", padx=8, pady=6
+        )
+        ttk.Combobox(out_frame, textvariable=self.outputs_var, values=list(self._output_presets),
+                     state="readonly").grid(row=1, column=1, sticky="w", padx=8, pady=6)
+        # Formats écrits (CSV et Parquet : un fichier par feuille à côté du classeur)
+        ttk.Label(out_frame, text="Formats", background="#f7fbff").grid(row=2, column=0, sticky="w", padx=8, pady=6)
+        formats_frame = tk.Frame(out_frame, bg="#f7fbff")
+        formats_frame.grid(row=2, column=1, sticky="w", padx=8, pady=6)
+        selected_formats = export_formats(EXPORT_FORMATS)
+        self.format_vars = {}
+        for fmt, text in (("xlsx", "Classeur xlsx"), ("csv", "CSV (;)"), ("parquet", "Parquet")):
+            self.format_vars[fmt] = tk.BooleanVar(value=fmt in selected_formats)
+            ttk.Checkbutton(formats_frame, text=text, variable=self.format_vars[fmt]).pack(side="left", padx=(0, 12))
+        # Lignage : lignes sources de chaque ligne de Global
+        self._lineage_modes = {"Non": "non", "Feuille masquée": "feuille", "Fichier CSV": "fichier"}
+        mode = str(LINEAGE_MODE or "non").strip().lower()
+        self.lineage_var = tk.StringVar(value=next((k for k, v in self._lineage_modes.items() if v == mode), "Non"))
+        ttk.Label(out_frame, text="Lignage", background="#f7fbff").grid(row=3, column=0, sticky="w", padx=8, pady=6)
+        ttk.Combobox(out_frame, textvariable=self.lineage_var, values=list(self._lineage_modes),
+                     state="readonly").grid(row=3, column=1, sticky="w", padx=8, pady=6)
+
+        # Boutons
+        btns = ttk.Frame(frm)
+        btns.grid(row=3, column=0, columnspan=3, sticky="we", pady=(0, 10))
+        ttk.Button(btns, text="Lancer le traitement", command=self.run).pack(side="left", padx=4)
+        ttk.Button(btns, text="Vider les champs", command=self.clear_fields).pack(side="left", padx=4)
+        self.history_bdc_var = tk.StringVar()
+        ttk.Button(btns, text="Historique BDC", command=self.lookup_history).pack(side="right", padx=4)
+        ttk.Button(btns, text="Rechercher", command=self.open_search).pack(side="right", padx=4)
+        self.search_index = None  # BdcIndex du dernier traitement
+        history_entry = ttk.Entry(btns, textvariable=self.history_bdc_var, width=14)
+        history_entry.pack(side="right", padx=4)
+        history_entry.bind("<Return>", lambda e: self.lookup_history())
+        ttk.Label(btns, text="BDC :").pack(side="right")
+
+        # Log (exactement tes lignes)
+        log_frame = tk.LabelFrame(
+            frm,
+            text="Journal",
+            bg="#f7fbff",
+            fg="#1f4a7c",
+            highlightthickness=1,
+            highlightbackground="#c6dcf5",
+        )
+        log_frame.grid(row=4, column=0, columnspan=3, sticky="nsew")
+        log_frame.grid_columnconfigure(0, weight=1)
+        log_frame.grid_rowconfigure(0, weight=1)
+        self.log = tk.Text(
+            log_frame,
+            height=16,
+            wrap="word",
+            bg="#ffffff",
+            highlightthickness=1,
+            highlightbackground="#d5e7fb",
+        )
+        scrollbar = ttk.Scrollbar(log_frame, command=self.log.yview)
+        self.log.configure(yscrollcommand=scrollbar.set)
+        self.log.grid(row=0, column=0, sticky="nsew")
+        scrollbar.grid(row=0, column=1, sticky="ns")
+        frm.grid_columnconfigure(0, weight=1)
+        frm.grid_rowconfigure(4, weight=1)
+
+        for line in INTRO_LOG_TEXT.strip().splitlines():
+            self.log.insert("end", line+"\n")
+        if not DND_AVAILABLE:
+            self.log.insert("end", "Drag & drop indisponible : installez 'tkinterdnd2' (pip install tkinterdnd2).\n")
+
+        status = tk.Frame(frm, bg="#eef6ff")
+        status.grid(row=5, column=0, columnspan=3, sticky="we", pady=(8, 0))
+        ttk.Label(status, textvariable=self.status_var, background="#eef6ff").pack(anchor="w")
+
+        self._first_map_bind = self.bind("<Map>", self._on_first_map, add="+")
+
+    # Démarrage différé : rien de coûteux avant que la fenêtre soit visible
+    def _on_first_map(self, event):
+        if event.widget is not self or self._first_map_bind is None:
+            return
+        self.unbind("<Map>", self._first_map_bind)
+        self._first_map_bind = None
+        STARTUP.mark("fenêtre affichée")
+        self.after_idle(self._attach_deferred)
+
+    def _attach_deferred(self):
+        if _TTKBOOTSTRAP_AVAILABLE:
+            try:
+                ttkbootstrap = importlib.import_module("ttkbootstrap")
+                ttkbootstrap.Style(theme="minty")
+                STARTUP.mark("thème ttkbootstrap appliqué")
+            except Exception as exc:
+                self._log(f"Thème ttkbootstrap non appliqué : {exc}")
+        if DND_AVAILABLE:
+            try:
+                from tkinterdnd2 import DND_FILES, TkinterDnD
+                TkinterDnD._require(self)
+                for entry, var in self._drop_targets:
+                    entry.drop_target_register(DND_FILES)
+                    entry.dnd_bind('<<Drop>>', lambda e, v=var: self._on_drop(e, v))
+                # dépôt n'importe où dans la fenêtre : chaque fichier va dans sa case
+                self._window_drop_target.drop_target_register(DND_FILES)
+                self._window_drop_target.dnd_bind('<<Drop>>', lambda e: self._on_drop(e, None))
+                STARTUP.mark("drag & drop activé")
+            except Exception as exc:
+                self._log(f"Drag & drop indisponible : {exc}")
+        preload_deps_in_background()
+        if DEBUG_STARTUP:
+            self._log(STARTUP.report())
+            if sys.stderr is not None:
+                print(STARTUP.report(), file=sys.stderr)
+
+    # UI helpers
+    def _row_file(self, parent, row, label, var):
+        ttk.Label(parent, text=label, background="#f7fbff").grid(row=row, column=0, sticky="w", padx=8, pady=6)
+        entry = ttk.Entry(parent, textvariable=var)
+        entry.grid(row=row, column=1, sticky="we", padx=8, pady=6)
+        ttk.Button(parent, text="Parcourir…", command=lambda v=var: self._pick(v)).grid(row=row, column=2, sticky="we", padx=8, pady=6)
+        self._drop_targets.append((entry, var))
+
+    def _pick(self, var):
+        paths = filedialog.askopenfilenames(filetypes=[("Excel","*.xlsx")])  # plusieurs fichiers possibles
+        if paths: var.set(SLOT_SEPARATOR.join(paths))
+
+    def _pick_outfile(self):
+        initial_dir = ""
+        for v in (self.commandes_var.get(), self.constatations_var.get(), self.factures_var.get(),
+                  self.envoi_var.get(), self.workflow_var.get()):
+            if slot_paths(v): initial_dir = os.path.dirname(slot_paths(v)[0]); break
+        path = filedialog.asksaveasfilename(defaultextension=".xlsx",
                                             filetypes=[("Excel","*.xlsx")],
                                             initialdir=initial_dir or None,
                                             initialfile="export_clean.xlsx")
         if path: self.outfile_var.set(path)
 
+    def _slot_vars(self):
+        return {"Commandes": self.commandes_var, "Constatations": self.constatations_var,
+                "Factures": self.factures_var, "EnvoiBDC": self.envoi_var, "Workflow": self.workflow_var}
+
     def _on_drop(self, event, var):
+        """Fichiers déposés sur une case (var) ou sur la fenêtre (var None) : rangés d'après leur contenu."""
         try:
-            paths = self.tk.splitlist(event.data)
-            if not paths: return
+            paths = [p for p in self.tk.splitlist(event.data) if p.lower().endswith(".xlsx")]
+            if not paths:
+                messagebox.showwarning("Format non pris en charge", "Déposez un fichier .xlsx."); return
+            slots = self._slot_vars()
+            labels = {v: k for k, v in slots.items()}
+            unknown, assigned = [], {}
             for p in paths:
-                if p.lower().endswith(".xlsx"):
-                    var.set(p); break
-            else:
-                messagebox.showwarning("Format non pris en charge", "Déposez un fichier .xlsx.")
+                key = classify_workbook(p)
+                if key is None:
+                    unknown.append(p); continue
+                assigned.setdefault(key, []).append(p)  # plusieurs exports d'une même case : tous gardés
+                if var is not None and slots[key] is not var:
+                    self._log(f"{os.path.basename(p)} reconnu comme {key} (déposé sur {labels[var]}) : placé dans {key}")
+                else:
+                    self._log(f"{os.path.basename(p)} → {key}")
+            for key, found in assigned.items():
+                slots[key].set(SLOT_SEPARATOR.join(found))
+            if unknown and var is not None and labels[var] not in assigned:
+                var.set(unknown.pop(0))  # non reconnu : rangé là où il a été déposé
+            for p in unknown:
+                self._log(f"Fichier non reconnu : {os.path.basename(p)} (déposez-le sur sa case)")
         except Exception as e:
             messagebox.showerror("Erreur DnD", str(e))
 
@@ -814,15 +5070,37 @@ class App(BaseTk):
         self.log.delete("1.0","end")
         self.status_var.set("Prêt")
 
+    def lookup_history(self):
+        bdc = self.history_bdc_var.get().strip()
+        if not bdc:
+            return
+        if not HISTORY_ENABLED:
+            self._log("Historique désactivé (activer avec NETTOIEXLSX_HISTORY=1 ou --history)."); return
+        try:
+            for line in BdcHistory().describe(bdc):
+                self._log(line)
+        except Exception as exc:
+            self._log(f"✖ Historique : {exc}")
+
+    def open_search(self):
+        if self.search_index is None:
+            messagebox.showinfo("Recherche BDC", "Lancez d'abord un traitement : la recherche porte sur ses résultats.")
+            return
+        BdcSearchWindow(self, self.search_index, self.history_bdc_var.get().strip())
+
     def _log(self, msg):
         self.log.insert("end", msg+"\n"); self.log.see("end"); self.update_idletasks()
 
     # Run
     def run(self):
+        if not DEPS.loaded:
+            self.status_var.set("Chargement des dépendances…")
+            self._log("Chargement de pandas/openpyxl…")
         try:
-            ensure_deps_loaded()
+            DEPS.wait()
         except Exception as exc:
             messagebox.showerror("Erreur de dépendances", f"Impossible de charger pandas/openpyxl : {exc}")
+            self.status_var.set("Erreur")
             return
         self.status_var.set("Traitement en cours…")
         files = {
@@ -840,55 +5118,26 @@ class App(BaseTk):
             self._pick_outfile(); outfile = self.outfile_var.get().strip()
             if not outfile:
                 messagebox.showwarning("Sortie manquante","Veuillez choisir un fichier de sortie .xlsx."); return
+        formats = [fmt for fmt, var in self.format_vars.items() if var.get()]
+        if not formats:
+            messagebox.showwarning("Aucun format", "Cochez au moins un format de sortie."); return
+        outputs = self._output_presets[self.outputs_var.get()]
+        lineage = self._lineage_modes[self.lineage_var.get()]
+        # Contrôle avant lecture : un classeur resté ouvert dans Excel est signalé tout de suite
+        sidecar = [lineage_path(outfile)] if lineage_output(lineage, formats, outputs) == "fichier" else []
+        problem = next(filter(None, (output_problem(path) for path in
+                                     [outfile] + export_paths(outfile, formats, outputs) + sidecar)), None)
+        if problem:
+            self._log(f"✖ Fichier de sortie inutilisable : {problem}")
+            messagebox.showerror("Fichier de sortie", f"Impossible d'écrire le fichier de sortie :\n{problem}")
+            self.status_var.set("Erreur")
+            return
 
         try:
-            dfs = {}
-
-            if files["Commandes"]:
-                self._log("Lecture/Nettoyage : Commandes")
-                dfs["Commande"] = process_commandes(files["Commandes"])
-
-            if files["Constatations"]:
-                self._log("Lecture/Nettoyage : Constatations")
-                dfs["Constatation"] = process_constatations(files["Constatations"])
-
-            if files["Factures"]:
-                self._log("Lecture/Nettoyage : Factures")
-                dfs["Factures"] = process_factures(files["Factures"])
-
-            if files["EnvoiBDC"]:
-                self._log("Lecture/Nettoyage : Envoi BDC")
-                dfs["Envoi BDC"] = process_envoi_bdc(files["EnvoiBDC"])
-
-            if files["Workflow"]:
-                self._log("Lecture : Workflow")
-                dfs["Workflow"] = process_workflow(files["Workflow"])
-
-            # Écriture des feuilles sources
-            order = ["Commande", "Envoi BDC", "Constatation", "Factures", "Workflow"]
-            with pd.ExcelWriter(outfile, engine="openpyxl") as writer:
-                self._log("Création de la page de garde")
-                create_cover_sheet(writer)
-                for name in order:
-                    if name in dfs:
-                        self._log(f"Écriture de la feuille {name}")
-                        df = dfs[name]
-                        df.to_excel(writer, index=False, sheet_name=name)
-                        ws = writer.book[name]
-                        autofit_worksheet(ws, df)
-                        strip_times_in_worksheet(ws)
-
-                # Global
-                self._log("Création et remplissage de la feuille Global")
-                create_and_fill_global_sheet(
-                    writer,
-                    dfs.get("Commande"),
-                    dfs.get("Envoi BDC"),
-                    dfs.get("Factures"),
-                    dfs.get("Workflow"),
-                    dfs.get("Constatation"),
-                )
-
+            result = run_consolidation(files, outfile, log=self._log, history=open_history(self._log),
+                                       outputs=outputs, formats=formats, lineage=lineage)
+            # hors mémoire : rien n'est gardé en mémoire, pas de recherche sur ce traitement
+            self.search_index = BdcIndex(result) if result is not None else None
             self._log(f"✔ Terminé. Fichier créé : {outfile}")
             messagebox.showinfo("Terminé", f"Fichier créé :\n{outfile}")
             self.status_var.set("Terminé")
@@ -898,6 +5147,144 @@ class App(BaseTk):
             messagebox.showerror("Erreur", f"Echec du traitement : {e}")
             self.status_var.set("Erreur")
 
-if __name__ == "__main__":
+def check_startup_budget() -> int:
+    """Ouvre la fenêtre, attend le premier affichage puis compare au budget. Code retour 0 = OK."""
+    STARTUP.mark("module importé")
     app = App()
+    def _finish():
+        if app._first_map_bind is not None:  # pas encore affichée : on repasse plus tard
+            app.after(50, _finish); return
+        app.destroy()
+    app.after(50, _finish)
     app.mainloop()
+    print(STARTUP.report())
+    first_paint = STARTUP.elapsed("fenêtre affichée")
+    return 0 if first_paint is not None and first_paint <= STARTUP_BUDGET_S else 1
+
+def main(argv=None):
+    global OUT_OF_CORE_MODE, ENGINE, HISTORY_ENABLED, OUTPUT_ENGINE, OUTPUT_DEFLATE_LEVEL, OUTPUT_SELECTION
+    global EXPORT_FORMATS, LINEAGE_MODE
+    import argparse
+    parser = argparse.ArgumentParser(description="Nettoie XLSX — consolidation SAG")
+    parser.add_argument("--debug-startup", action="store_true",
+                        help="journalise les jalons du démarrage et le temps d'import de chaque module")
+    parser.add_argument("--check-startup", action="store_true",
+                        help="mesure le temps jusqu'au premier affichage et échoue si le budget est dépassé")
+    parser.add_argument("--engine", choices=["pandas", "polars"], default=None,
+                        help="moteur de nettoyage et de calcul de Global (défaut : pandas)")
+    parser.add_argument("--historique", metavar="BDC",
+                        help="affiche l'historique d'un BDC enregistré par les traitements précédents")
+    parser.add_argument("--history", action="store_true",
+                        help="enregistre les traitements dans la base d'historique "
+                             f"(conservés {HISTORY_RETENTION_DAYS} jours, NETTOIEXLSX_HISTORY_JOURS)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="n'enregistre pas ce traitement dans la base d'historique")
+    parser.add_argument("--watch", metavar="DOSSIER",
+                        help="surveille un dossier et refait la consolidation à chaque nouvel export")
+    parser.add_argument("--sortie", metavar="FICHIER",
+                        help=f"classeur publié en mode surveillance (défaut : DOSSIER/{WATCH_DEFAULT_OUTFILE})")
+    parser.add_argument("--serve", nargs="?", const=SERVICE_PORT, type=int, metavar="PORT",
+                        help=f"lance le service HTTP local de consolidation (défaut : port {SERVICE_PORT})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"threads de traitement du service (défaut : {SERVICE_WORKERS}), "
+                             "processus du traitement par lots (défaut : un par cœur)")
+    parser.add_argument("--lot", metavar="MANIFESTE",
+                        help="consolide plusieurs bases en une fois : manifeste JSON (nom, sortie et "
+                             "fichiers de chaque base) ou dossier d'un sous-dossier d'exports par base")
+    parser.add_argument("--output", choices=["openpyxl", "xml", "xlsxwriter"], default=None,
+                        help="moteur d'écriture : openpyxl, assembleur XML parallèle ou xlsxwriter "
+                             "constant_memory (défaut : openpyxl)")
+    parser.add_argument("--deflate", type=int, choices=range(10), default=None, metavar="0-9",
+                        help=f"niveau de compression du moteur xml (défaut : {OUTPUT_DEFLATE_LEVEL})")
+    parser.add_argument("--sorties", metavar="FEUILLES", default=None,
+                        help="feuilles à produire, séparées par des virgules (ex. Global,Factures ; défaut : "
+                             "toutes) ; seules les sources nécessaires sont lues")
+    parser.add_argument("--formats", metavar="FORMATS", default=None,
+                        help="formats écrits, séparés par des virgules : xlsx, csv (« ; », UTF-8 avec BOM), "
+                             "parquet (défaut : xlsx) ; une feuille par fichier CSV ou Parquet")
+    parser.add_argument("--lignage", choices=LINEAGE_MODES, default=None,
+                        help="lignes sources de chaque ligne de Global : feuille masquée « Lignage » du classeur "
+                             "ou fichier « <sortie> - Lignage.csv » (défaut : non)")
+    parser.add_argument("--benchmark", metavar="DOSSIER",
+                        help="compare les moteurs de sortie (durée d'écriture, taille) sur les exports du dossier")
+    parser.add_argument("--out-of-core", choices=["auto", "on", "off"], default=None,
+                        help="mode hors mémoire pour les très gros exports (défaut : auto)")
+    parser.add_argument("--reference", nargs="?", const=os.path.dirname(os.path.abspath(__file__)),
+                        metavar="DOSSIER",
+                        help="consolide les exemples d'exports (défaut : dossier du script) avec chaque moteur "
+                             "et compare à l'instantané de référence")
+    parser.add_argument("--reference-maj", action="store_true",
+                        help="avec --reference : enregistre l'instantané (sorties, et durées du poste) "
+                             "au lieu de comparer")
+    parser.add_argument("--reference-fichier", metavar="FICHIER", default=None,
+                        help=f"instantané de référence (défaut : {GOLDEN_SNAPSHOT_NAME} versionné à côté des exports)")
+    parser.add_argument("--reference-locale", action="store_true",
+                        help="avec --reference : instantané propre à ce poste, dans le dossier de données")
+    parser.add_argument("--differentiel", nargs="?", const=300, type=int, metavar="N",
+                        help="confronte les moteurs de Global au calcul de référence sur N jeux aléatoires "
+                             "(défaut : 300) et mesure leur débit")
+    parser.add_argument("--graine", type=int, default=0,
+                        help="avec --differentiel : première graine aléatoire (défaut : 0)")
+    args = parser.parse_args(argv)
+    if args.output:
+        OUTPUT_ENGINE = args.output
+    if args.deflate is not None:
+        OUTPUT_DEFLATE_LEVEL = args.deflate
+    if args.history:
+        HISTORY_ENABLED = True
+    if args.no_history:
+        HISTORY_ENABLED = False
+    if args.sorties:
+        try:
+            output_selection(args.sorties)
+        except ValueError as exc:
+            parser.error(str(exc))
+        OUTPUT_SELECTION = args.sorties
+    if args.formats:
+        try:
+            if not export_formats(args.formats):
+                parser.error("--formats : aucun format")
+        except ValueError as exc:
+            parser.error(str(exc))
+        EXPORT_FORMATS = args.formats
+    if args.lignage:
+        LINEAGE_MODE = args.lignage
+    if args.historique:
+        ensure_deps_loaded()
+        print("\n".join(BdcHistory().describe(args.historique)))
+        return 0
+    if args.engine:
+        ENGINE = args.engine
+    if args.out_of_core:
+        OUT_OF_CORE_MODE = args.out_of_core
+    if args.benchmark:
+        run_benchmark(args.benchmark, repeat=3)
+        return 0
+    if args.differentiel is not None:
+        return run_differential(args.differentiel, seed=args.graine)
+    if args.reference:
+        snapshot = args.reference_fichier or (local_golden_path() if args.reference_locale else None)
+        return run_golden(args.reference, snapshot, update=args.reference_maj)
+    if args.lot:
+        return run_batch(args.lot, workers=args.workers)
+    if args.serve is not None:
+        serve(port=args.serve, workers=args.workers)
+        return 0
+    if args.watch:
+        ensure_deps_loaded()
+        try:
+            FolderWatcher(args.watch, args.sortie).run_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.check_startup:
+        return check_startup_budget()
+    STARTUP.mark("module importé")
+    app = App()
+    app.mainloop()
+    return 0
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()  # processus de travail du moteur xml dans l'exécutable
+    sys.exit(main())
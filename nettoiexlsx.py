@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Module importable de NettoieXLSX (le script NettoieXLSX_GUI-V15.py, dont le nom n'est pas un
+nom de module Python).
+
+    import nettoiexlsx
+    result = nettoiexlsx.consolidate(["commandes.xlsx", "factures.xlsx", "list workflow.xlsx"])
+    result.global_frame          # Global en DataFrame (A..K)
+    result.sources["Factures"]   # source nettoyée
+    result.timings               # durée de chaque étape
+
+Les réglages du script sont des attributs du module (nettoiexlsx.ENGINE = "polars"…).
+L'interface n'est pas lancée à l'import. Comme pour tout programme multiprocessus, le script
+appelant place son traitement sous if __name__ == "__main__": (processus de lecture et
+d'écriture parallèles).
+"""
+import os
+
+_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NettoieXLSX_GUI-V15.py")
+
+# Le script est exécuté dans l'espace de noms de ce module : fonctions et classes sont
+# nettoiexlsx.*, y compris pour les processus de travail (lecture et écriture parallèles).
+with open(_SCRIPT, encoding="utf-8") as _fh:
+    exec(compile(_fh.read(), _SCRIPT, "exec"), globals())
+del _fh
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""Les tests importent le script via le module nettoiexlsx, à la racine du dépôt."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""Moteurs de Global (ligne à ligne, compact, partitions, Polars) confrontés à la copie figée
+du calcul d'origine de Global (A..K)."""
+import nettoiexlsx
+
+
+def test_engines_match_reference():
+    messages = []
+    # jeux aléatoires seulement : la mesure de débit (volume) n'a pas sa place dans un test
+    code = nettoiexlsx.run_differential(cases=60, seed=4242, volume=0, log=messages.append)
+    assert code == 0, "\n".join(messages)
+    labels = [label for label, _ in nettoiexlsx.differential_engines()]
+    assert labels[0] == "référence" and "ligne à ligne" in labels
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""Corpus de référence : chaque moteur consolide les exemples d'exports et doit reproduire
+l'instantané versionné (reference.json). Seule la conformité compte, pas les durées."""
+import os
+
+import nettoiexlsx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_sample_exports_match_snapshot(tmp_path, monkeypatch):
+    # modèle du moteur xml et durées du poste hors du dossier de données de l'utilisateur
+    monkeypatch.setenv("NETTOIEXLSX_TEMPLATE_DIR", str(tmp_path))
+    monkeypatch.setenv("NETTOIEXLSX_REFERENCE_DUREES", str(tmp_path / "durees.json"))
+    messages = []
+    code = nettoiexlsx.run_golden(ROOT, os.path.join(ROOT, nettoiexlsx.GOLDEN_SNAPSHOT_NAME),
+                                  log=messages.append)
+    assert code == 0, "\n".join(messages)
+    assert any("conforme" in m for m in messages)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Historique des BDC : traitements concurrents sur une même base, purge des anciens traitements."""
+import os
+import sqlite3
+import threading
+
+import nettoiexlsx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILES = {"Commandes": "commandes (8).xlsx", "Constatations": "constatations (2).xlsx",
+         "Factures": "factures (7).xlsx", "EnvoiBDC": "Envoi BDC 20260109.xlsx", "Workflow": "list workflow.xlsx"}
+
+
+def test_concurrent_runs_share_history(tmp_path, monkeypatch):
+    monkeypatch.setattr(nettoiexlsx, "OUT_OF_CORE_MODE", "off")
+    nettoiexlsx.ensure_deps_loaded()
+    files = {key: os.path.join(ROOT, name) for key, name in FILES.items()}
+    history = nettoiexlsx.BdcHistory(str(tmp_path / "historique.sqlite"))
+    messages, errors = [], []
+
+    def run(target, outfile):
+        try:
+            target(files, str(tmp_path / outfile), log=messages.append, history=history)
+        except Exception as exc:  # pragma: no cover - affiché par l'assertion
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run, args=(nettoiexlsx.run_out_of_core, "hors_memoire.xlsx")),
+               threading.Thread(target=run, args=(nettoiexlsx.run_consolidation, "memoire.xlsx"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert messages.count("Historique mis à jour") == 2, messages
+    runs = history.runs()
+    assert len(runs) == 2
+    rows = history._query("SELECT run_id, COUNT(*) AS n FROM global_rows GROUP BY run_id")
+    assert len(rows) == 2 and rows[0]["n"] == rows[1]["n"] > 0
+
+
+def test_old_runs_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(nettoiexlsx, "HISTORY_RETENTION_DAYS", 30)
+    path = str(tmp_path / "historique.sqlite")
+    history = nettoiexlsx.BdcHistory(path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO runs (run_at, outfile, files) VALUES ('2000-01-01 00:00:00', 'ancien.xlsx', '{}')")
+    conn.execute("INSERT INTO global_rows (run_id, run_at, row_no, bdc) VALUES (1, '2000-01-01 00:00:00', 1, '1')")
+    conn.commit()
+    conn.close()
+    record = history.start_run("nouveau.xlsx", {})
+    record.add_global_rows([("2",) + (None,) * (len(nettoiexlsx.GLOBAL_HISTORY_COLUMNS) - 1)])
+    assert nettoiexlsx.finish_history(record)
+    assert [r["outfile"] for r in history.runs()] == ["nouveau.xlsx"]
+    assert history.global_history("1") == [] and len(history.global_history("2")) == 1
+
+
+def test_history_error_does_not_fail_consolidation(tmp_path):
+    history = nettoiexlsx.BdcHistory(str(tmp_path / "historique.sqlite"))
+    record = history.start_run("sortie.xlsx", {})
+    record.add_global_rows([("trop", "peu")])  # nombre de colonnes invalide
+    messages = []
+    assert not nettoiexlsx.finish_history(record, messages.append)
+    assert messages and messages[0].startswith("Historique non mis à jour")
+    assert history.runs() == []
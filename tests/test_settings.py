@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Réglages temporaires (module_settings) : toujours rétablis, noms inconnus refusés."""
+import pytest
+
+import nettoiexlsx
+
+
+def test_settings_restored_after_error():
+    before = nettoiexlsx.OUTPUT_ENGINE
+    with pytest.raises(RuntimeError):
+        with nettoiexlsx.module_settings(OUTPUT_ENGINE="xml"):
+            assert nettoiexlsx.OUTPUT_ENGINE == "xml"
+            raise RuntimeError("échec du traitement")
+    assert nettoiexlsx.OUTPUT_ENGINE == before
+
+
+def test_unknown_setting_rejected():
+    with pytest.raises(KeyError):
+        with nettoiexlsx.module_settings(OUTPUT_ENGIN="xml"):
+            pass
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Budget de démarrage (STARTUP_BUDGET_S) : import léger, premier affichage de la fenêtre."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "NettoieXLSX_GUI-V15.py")
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "polars")
+
+
+def _python(code: str) -> str:
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return out.stdout
+
+
+def test_import_within_budget():
+    # processus neuf : rien n'est déjà en cache dans sys.modules
+    seconds, budget, heavy = _python(
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        "import nettoiexlsx\n"
+        "print(time.perf_counter() - t)\n"
+        "print(nettoiexlsx.STARTUP_BUDGET_S)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    ).split("\n")[:3]
+    assert float(seconds) <= float(budget), f"import en {float(seconds):.3f} s (budget {budget} s)"
+    assert not heavy, f"dépendances lourdes chargées à l'import : {heavy}"
+
+
+def _has_display() -> bool:
+    if sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        return False
+    try:
+        _python("import tkinter; tkinter.Tk().destroy()")
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+
+def test_first_paint_within_budget():
+    if not _has_display():
+        pytest.skip("pas d'affichage : premier affichage de la fenêtre non mesuré")
+    out = subprocess.run([sys.executable, SCRIPT, "--check-startup"], cwd=ROOT, capture_output=True, text=True)
+    assert out.returncode == 0, out.stdout + out.stderr